@@ -8,9 +8,14 @@ from setuptools import setup, find_packages
 # To use a consistent encoding
 from codecs import open
 from os import path
+import re
 
 here = path.abspath(path.dirname(__file__))
 
+# Read the version from the package so it's only set in one place
+with open(path.join(here, 'slap', '__init__.py'), encoding='utf-8') as f:
+    version = re.search(r"^__version__ = '([^']+)'", f.read(), re.M).group(1)
+
 # Get the long description from the README file
 #with open(path.join(here, 'README.md'), encoding='utf-8') as f:
 #long_description = f.read()
@@ -21,7 +26,7 @@ setup(
     # Versions should comply with PEP440.  For a discussion on single-sourcing
     # the version across setup.py and the project code, see
     # https://packaging.python.org/en/latest/single_source_version.html
-    version='3.0.0',
+    version=version,
     description='A set of scripts for publishing ESRI services',
     long_description='A set of scripts for publishing ESRI services',
 
@@ -78,7 +83,8 @@ setup(
     # $ pip install -e .[dev,test]
     extras_require={
         'dev': ['check-manifest'],
-        'test': ['mock', 'coverage', 'pyfakefs'],
+        'test': ['mock', 'coverage', 'pyfakefs', 'cryptography'],
+        'cache': ['cryptography'],
     },
 
     # If there are data files included in your packages that need to be
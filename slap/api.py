@@ -1,21 +1,122 @@
+import os
+import re
+import time
 import requests
 import json
+import urlparse
+import threading
+from timeit import default_timer
+from multiprocessing.pool import ThreadPool
+from slap.auth import TokenManager, TokenCache
+from slap.retry import RetryPolicy, CircuitBreaker
+from slap.metrics import Metrics
+from slap.transport import SessionTransport
+from slap.profiling import span
+
+
+class InvalidTokenError(requests.exceptions.RequestException):
+    pass
 
 
 class Api:
 
-    def __init__(self, ags_url, token_url, portal_url, username, password, verify_certs=False):
+    # Calls that are safe to repeat if the first attempt may or may not have reached the server
+    idempotent_operations = ['generateToken', 'exists', 'edit', 'service', 'services', 'startServices', 'stop',
+                             'uploadPart']
+
+    # Service definitions are uploaded in parts this size, so only one part is held in memory at a time
+    upload_part_size = 8 * 1024 * 1024
+
+    def __init__(self, ags_url, token_url, portal_url, username, password, verify_certs=False,
+                 pool_size=10, connect_timeout=None, read_timeout=None, token_cache=False,
+                 retry_policy=None, circuit_breaker=None, transport=None):
         self._ags_url = ags_url
         self._token_url = token_url if token_url else ags_url + '/generateToken'
         self._portal_url = portal_url
         self._username = username
         self._password = password
         self._verify_certs = verify_certs
-        self._token = None
+        self._timeout = (connect_timeout, read_timeout)
+        self._transport = transport if transport else SessionTransport(pool_size)
+        self._retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self._circuit_breaker = circuit_breaker if circuit_breaker else CircuitBreaker()
+        self._retry_stats = {}
+        self._merged_connection_stats = {'requests': 0, 'connections': 0, 'reused': 0}
+        self._popped_connection_stats = {'requests': 0, 'connections': 0, 'reused': 0}
+        self.metrics = Metrics()
+        self._stats_lock = threading.Lock()
+        self._token_manager = TokenManager(
+            token_url=self._token_url,
+            username=username,
+            password=password,
+            post=self.post,
+            cache=self.create_token_cache(token_cache)
+        )
+
+    @property
+    def connection_stats(self):
+        stats = self._get_pool_stats()
+        with self._stats_lock:
+            return dict((key, stats[key] + self._merged_connection_stats[key]) for key in stats)
+
+    def _get_pool_stats(self):
+        requests_sent = 0
+        connections_opened = 0
+        for pool in self._get_connection_pools():
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+        return {
+            'requests': requests_sent,
+            'connections': connections_opened,
+            'reused': max(requests_sent - connections_opened, 0)
+        }
+
+    def pop_connection_stats(self):
+        # This process's connection stats since the last call, e.g. for a worker to send to the parent
+        stats = self._get_pool_stats()
+        with self._stats_lock:
+            popped, self._popped_connection_stats = self._popped_connection_stats, stats
+        return dict((key, stats[key] - popped[key]) for key in stats)
+
+    def merge_connection_stats(self, stats):
+        with self._stats_lock:
+            for key in self._merged_connection_stats:
+                self._merged_connection_stats[key] += stats[key]
+
+    @property
+    def retry_stats(self):
+        with self._stats_lock:
+            return dict((operation, stats.copy()) for operation, stats in self._retry_stats.items())
+
+    def _record_retry(self, operation, backoff):
+        with self._stats_lock:
+            stats = self._retry_stats.setdefault(operation, {'retries': 0, 'backoff': 0.0})
+            stats['retries'] += 1
+            stats['backoff'] += backoff
+
+    def _get_connection_pools(self):
+        return self._transport.get_connection_pools()
+
+    def create_token_cache(self, token_cache):
+        if not token_cache:
+            return None
+        return TokenCache(
+            token_url=self._token_url,
+            username=self._username,
+            password=self._password,
+            directory=token_cache if isinstance(token_cache, basestring) else None
+        )
+
+    @property
+    def transport(self):
+        return self._transport
+
+    def close(self):
+        self._transport.close()
 
     @property
     def token(self):
-        return self._token if self._token else self.get_token()
+        return self._token_manager.get_token()
 
     @property
     def params(self):
@@ -24,13 +125,83 @@ class Api:
             'f': 'json'
         }
 
-    def post(self, url, params):
-        response = requests.post(url, data=params, verify=self._verify_certs)
-        return self.parse_response(response)
+    def post(self, url, params, files=None):
+        return self._request('POST', url, params, files)
 
     def get(self, url, params):
-        response = requests.get(url, params=params, verify=self._verify_certs)
-        return self.parse_response(response)
+        return self._request('GET', url, params)
+
+    def _request(self, method, url, params, files=None):
+        try:
+            return self._send_with_retries(method, url, params, files)
+        except InvalidTokenError:
+            if 'token' not in params:
+                raise
+            # The token expired or was revoked server-side; get a new one and try once more
+            new_params = params.copy()
+            new_params['token'] = self._token_manager.refresh(invalid_token=params['token'])
+            return self._send_with_retries(method, url, new_params, files)
+
+    def _send_with_retries(self, method, url, params, files=None):
+        operation = self.get_operation(method, url)
+        retries = self._retry_policy.max_retries if self.is_idempotent(method, operation) else 0
+        start = default_timer()
+        attempt = 0
+        while True:
+            response = None
+            try:
+                self._circuit_breaker.before_call()
+                response = self._send(method, url, params, files)
+                parsed_response = self.parse_response(response)
+            except Exception as e:
+                if getattr(e, 'response', None) is not None:
+                    response = e.response
+                if self._should_retry(e, attempt, retries):
+                    backoff = self._retry_policy.get_backoff(attempt, e)
+                    self._record_retry(operation, backoff)
+                    self._retry_policy.sleep(backoff)
+                    attempt += 1
+                    continue
+                self._record_call(operation, start, response, attempt, error=True)
+                raise
+            self._circuit_breaker.record_success()
+            self._record_call(operation, start, response, attempt)
+            return parsed_response
+
+    def _should_retry(self, error, attempt, retries):
+        if not self._retry_policy.is_retryable(error):
+            return False
+        self._circuit_breaker.record_failure()
+        return attempt < retries and not self._circuit_breaker.is_open
+
+    def _record_call(self, operation, start, response, retries, error=False):
+        self.metrics.record(
+            operation=operation,
+            duration=default_timer() - start,
+            status=response.status_code if response is not None else None,
+            size=len(response.content) if response is not None and response.content else 0,
+            retries=retries,
+            error=error
+        )
+
+    @staticmethod
+    def get_operation(method, url):
+        segments = urlparse.urlsplit(url).path.rstrip('/').split('/')
+        if '.' in segments[-1]:
+            return 'service'  # e.g. services/folder/name.MapServer
+        if segments[-1] == 'services' or (method == 'GET' and len(segments) > 1 and segments[-2] == 'services'):
+            return 'services'  # folder listing
+        if len(segments) > 1 and segments[-2] == 'jobs':
+            return 'job'  # geoprocessing job status
+        return segments[-1]
+
+    def is_idempotent(self, method, operation):
+        return method == 'GET' or operation in self.idempotent_operations
+
+    def _send(self, method, url, params, files=None):
+        with span(self.get_operation(method, url), 'rest', method=method, url=url):
+            return self._transport.send(method, url, params, verify=self._verify_certs, timeout=self._timeout,
+                                        files=files)
 
     @staticmethod
     def parse_response(response):
@@ -45,19 +216,23 @@ class Api:
     def check_parsed_response(parsed_response):
         if 'status' in parsed_response:  # token requests don't have this
             if parsed_response['status'] == 'error':  # handle a 200 response with an error
-                raise requests.exceptions.RequestException(parsed_response['messages'][0])
+                message = parsed_response['messages'][0] if parsed_response.get('messages') else 'Unknown error'
+                if Api.is_invalid_token_error(parsed_response.get('code'), message):
+                    raise InvalidTokenError(message)
+                raise requests.exceptions.RequestException(message)
+        elif 'error' in parsed_response:  # token and rest endpoints report errors this way
+            error = parsed_response['error']
+            message = error.get('message', 'Unknown error')
+            if Api.is_invalid_token_error(error.get('code'), message):
+                raise InvalidTokenError(message)
+            raise requests.exceptions.RequestException(message)
+
+    @staticmethod
+    def is_invalid_token_error(code, message):
+        return code in (498, 499) or 'invalid token' in message.lower() or 'token required' in message.lower()
 
     def get_token(self):
-        params = {
-            'username': self._username,
-            'password': self._password,
-            'client': 'requestip',
-            'expiration': 60,
-            'f': 'json'
-        }
-        response = self.post(self._token_url, params)
-        self._token = response['token']
-        return self._token
+        return self._token_manager.refresh()
 
     def get_service_params(self, service_name, folder='', service_type='MapServer'):
         folder = self.build_folder_string(folder)
@@ -84,6 +259,117 @@ class Api:
         new_params['type'] = service_type
         return self.post(url, new_params)
 
+    def list_services(self, folder=''):
+        url = '{0}/services/{1}'.format(self._ags_url, folder if folder else '')
+        return self.get(url, self.params)
+
+    def start_services(self, services):
+        # services is a list of dicts with service_name, folder and service_type keys
+        url = '{0}/services/startServices'.format(self._ags_url)
+        new_params = self.params.copy()
+        new_params['services'] = json.dumps({'services': [
+            {
+                'folderName': service['folder'] if service.get('folder') else '',
+                'serviceName': service['service_name'],
+                'type': service['service_type'] if service.get('service_type') else 'MapServer'
+            } for service in services
+        ]})
+        return self.post(url, new_params)
+
+    def stop_service(self, service_name, folder='', service_type='MapServer'):
+        folder = self.build_folder_string(folder)
+        url = '{0}/services/{1}{2}.{3}/stop'.format(self._ags_url, folder, service_name, service_type)
+        return self.post(url, self.params)
+
+    def get_service_status(self, service_name, folder='', service_type='MapServer'):
+        folder = self.build_folder_string(folder)
+        url = '{0}/services/{1}{2}.{3}/status'.format(self._ags_url, folder, service_name, service_type)
+        return self.get(url, self.params)
+
+    def is_service_started(self, service_name, folder='', service_type='MapServer'):
+        return self.get_service_status(service_name, folder, service_type).get('realTimeState') == 'STARTED'
+
+    def wait_for_service(self, service_name, folder='', service_type='MapServer', timeout=300, poll_interval=1):
+        # A service that was just uploaded can take a while to start all of its instances; False if it didn't in time
+        deadline = time.time() + timeout
+        while not self.is_service_started(service_name, folder, service_type):
+            if time.time() > deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def upload_item(self, path):
+        # Register, upload each part, then commit: each part is read into memory on its own, and a retried part is
+        # sent again in full
+        item_name = os.path.basename(path)
+        new_params = self.params.copy()
+        new_params['itemName'] = item_name
+        item_id = self.post('{0}/uploads/register'.format(self._ags_url), new_params)['item']['itemID']
+        part_numbers = []
+        with open(path, 'rb') as item_file:
+            while True:
+                part = item_file.read(self.upload_part_size)
+                if not part and part_numbers:
+                    break
+                part_numbers.append(str(len(part_numbers) + 1))
+                self.upload_part(item_id, part_numbers[-1], item_name, part)
+                if len(part) < self.upload_part_size:
+                    break
+        new_params = self.params.copy()
+        new_params['parts'] = ','.join(part_numbers)
+        return self.post('{0}/uploads/{1}/commit'.format(self._ags_url, item_id), new_params)
+
+    def upload_part(self, item_id, part_number, item_name, part):
+        new_params = self.params.copy()
+        new_params['partNumber'] = part_number
+        return self.post('{0}/uploads/{1}/uploadPart'.format(self._ags_url, item_id), new_params,
+                         files={'partFile': (item_name, part)})
+
+    @property
+    def rest_url(self):
+        return re.sub('/admin/?$', '/rest', self._ags_url)
+
+    def publish_item(self, item_id):
+        # Runs the same geoprocessing tool that UploadServiceDefinition uses, without needing arcpy
+        url = '{0}/services/System/PublishingTools/GPServer/Publish%20Service%20Definition/submitJob'.format(
+            self.rest_url)
+        new_params = self.params.copy()
+        new_params['in_sdp_id'] = item_id
+        return self.post(url, new_params)
+
+    def get_publishing_job(self, job_id):
+        url = '{0}/services/System/PublishingTools/GPServer/Publish%20Service%20Definition/jobs/{1}'.format(
+            self.rest_url, job_id)
+        return self.get(url, self.params)
+
+    def upload_service_definition(self, path, timeout=3600, poll_interval=2):
+        item = self.upload_item(path)['item']
+        job = self.publish_item(item['itemID'])
+        deadline = time.time() + timeout
+        while job['jobStatus'] not in ('esriJobSucceeded', 'esriJobFailed', 'esriJobCancelled', 'esriJobTimedOut'):
+            if time.time() > deadline:
+                raise requests.exceptions.RequestException('Publishing {0} did not finish within {1}s ({2})'.format(
+                    os.path.basename(path), timeout, job['jobStatus']))
+            time.sleep(poll_interval)
+            job = self.get_publishing_job(job['jobId'])
+        if job['jobStatus'] != 'esriJobSucceeded':
+            messages = [message['description'] for message in job.get('messages', [])]
+            raise requests.exceptions.RequestException('Publishing {0} failed: {1}'.format(
+                os.path.basename(path), '; '.join(messages) if messages else job['jobStatus']))
+        return job
+
+    def find_data_items(self, parent_path):
+        url = '{0}/data/findItems'.format(self._ags_url)
+        new_params = self.params.copy()
+        new_params['parentPath'] = parent_path
+        return self.get(url, new_params)
+
+    def register_data_item(self, item):
+        url = '{0}/data/registerItem'.format(self._ags_url)
+        new_params = self.params.copy()
+        new_params['item'] = json.dumps(item)
+        return self.post(url, new_params)
+
     def create_site(self, username, password, params):
         new_params = params.copy()
         new_params['username'] = username
@@ -164,3 +450,58 @@ class Api:
         params['token'] = self.token
         return params
 
+
+class ConcurrentApi(Api):
+
+    def __init__(self, *args, **kwargs):
+        max_workers = kwargs.pop('max_workers', 8)
+        # When set, an AdaptiveLimiter decides how many of the workers may call the server at once
+        self.limiter = kwargs.pop('limiter', None)
+        # Keep a pooled connection for every worker, so none of them has to open its own
+        kwargs['pool_size'] = max(kwargs.get('pool_size', 10), max_workers)
+        Api.__init__(self, *args, **kwargs)
+        self._max_workers = max_workers
+        self._pool = None
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def close(self):
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        Api.close(self)
+
+    def map(self, method, items):
+        # Each item is a dict of keyword arguments for method; results come back in input order
+        if not items:
+            return []
+        if self._pool is None:
+            self._pool = ThreadPool(self._max_workers)
+        if self.limiter is None:
+            return self._pool.map(lambda item: method(**item), items)
+        return self._pool.map(lambda item: self._call_limited(method, item), items)
+
+    def _call_limited(self, method, item):
+        with self.limiter.slot(method.__name__):
+            return method(**item)
+
+    def exists_many(self, services):
+        return self.map(self.service_exists, services)
+
+    def delete_many(self, services):
+        return self.map(self.delete_service, services)
+
+    def get_params_many(self, services):
+        return self.map(self.get_service_params, services)
+
+    def edit_many(self, services):
+        return self.map(self.edit_service, services)
+
+    def find_data_items_many(self, parent_paths):
+        return self.map(self.find_data_items, [{'parent_path': parent_path} for parent_path in parent_paths])
+
+    def register_data_items_many(self, items):
+        return self.map(self.register_data_item, [{'item': item} for item in items])
@@ -0,0 +1,79 @@
+import os
+import errno
+import shutil
+import hashlib
+import tempfile
+import threading
+from slap.cache import get_cache_directory, make_directory, replace_file
+
+
+class ArtifactCache:
+    # Staged service definitions, keyed by what went into them, so an unchanged service is never staged twice.
+    # Files are written atomically and evicted least recently used first, so several workers can share a cache.
+
+    def __init__(self, directory=None, max_size=2 * 1024 ** 3):
+        self.directory = make_directory(directory) if directory else get_cache_directory('artifacts')
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(fingerprint, server_type, service_type):
+        return hashlib.sha256('{0}\0{1}\0{2}'.format(fingerprint, server_type, service_type)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.sd')
+
+    def get(self, key, destination):
+        path = self.path(key)
+        try:
+            # Mark it recently used before copying, so a concurrent eviction picks something else
+            os.utime(path, None)
+            self._copy(path, destination)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        return True
+
+    def put(self, key, source):
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(handle)
+        try:
+            shutil.copyfile(source, temp_path)
+            replace_file(temp_path, self.path(key))
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            artifacts = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.sd'):
+                    try:
+                        stat = os.stat(os.path.join(self.directory, name))
+                    except OSError:
+                        continue  # evicted by another worker
+                    artifacts.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for mtime, size, name in artifacts)
+            for mtime, size, name in sorted(artifacts):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
+
+    @staticmethod
+    def _copy(source, destination):
+        make_directory(os.path.dirname(os.path.abspath(destination)))
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except (AttributeError, OSError):
+            # No hard links on Windows under Python 2, or the cache is on another drive
+            shutil.copyfile(source, destination)
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from slap.cache import get_cache_directory, write_atomic
+
+
+class TokenManager:
+
+    refresh_margin = 120  # seconds before expiry at which a token is renewed
+
+    def __init__(self, token_url, username, password, post, expiration=60, cache=None):
+        self._token_url = token_url
+        self._username = username
+        self._password = password
+        self._post = post
+        self._expiration = expiration
+        self._cache = cache
+        self._token = None
+        self._expires = 0
+        self._lock = threading.Lock()
+        self.clock = time.time
+
+    @property
+    def expires(self):
+        return self._expires
+
+    def is_valid(self):
+        return self._token is not None and self.clock() < self._expires - self.refresh_margin
+
+    def get_token(self):
+        with self._lock:
+            if not self.is_valid() and not self._load_from_cache():
+                self._request_token()
+            return self._token
+
+    def refresh(self, invalid_token=None):
+        with self._lock:
+            # Another thread may already have replaced the rejected token
+            if invalid_token is None or invalid_token == self._token or not self.is_valid():
+                if self._cache:
+                    self._cache.clear()
+                self._request_token()
+            return self._token
+
+    def set_token(self, token, expires):
+        self._token = token
+        self._expires = expires
+
+    def _load_from_cache(self):
+        if not self._cache:
+            return False
+        cached = self._cache.load()
+        if not cached:
+            return False
+        self.set_token(cached['token'], cached['expires'])
+        return self.is_valid()
+
+    def _request_token(self):
+        params = {
+            'username': self._username,
+            'password': self._password,
+            'client': 'requestip',
+            'expiration': self._expiration,
+            'f': 'json'
+        }
+        response = self._post(self._token_url, params)
+        self.set_token(response['token'], self._get_expiry(response))
+        if self._cache:
+            self._cache.save(self._token, self._expires)
+        return self._token
+
+    def _get_expiry(self, response):
+        if 'expires' in response:
+            return float(response['expires']) / 1000  # milliseconds since epoch
+        return self.clock() + self._expiration * 60
+
+
+class TokenCache:
+
+    iterations = 100000
+
+    def __init__(self, token_url, username, password, directory=None):
+        # Imported here so commands that never cache a token don't pay for loading cryptography
+        try:
+            from cryptography.fernet import Fernet, InvalidToken
+        except ImportError:
+            raise RuntimeError("The token cache requires the 'cryptography' package; "
+                               "install it with 'pip install slap[cache]'")
+        self._invalid_token = InvalidToken
+        self._directory = directory if directory else get_cache_directory('tokens')
+        self._path = os.path.join(self._directory, self.get_cache_key(token_url, username) + '.token')
+        self._fernet = Fernet(self.derive_key(token_url, username, password))
+
+    @property
+    def path(self):
+        return self._path
+
+    @staticmethod
+    def get_cache_key(token_url, username):
+        return hashlib.sha256(_to_bytes(token_url) + b'\n' + _to_bytes(username)).hexdigest()
+
+    @classmethod
+    def derive_key(cls, token_url, username, password):
+        # Only someone holding the password can read the cached token
+        salt = _to_bytes(token_url) + b'\n' + _to_bytes(username)
+        key = hashlib.pbkdf2_hmac('sha256', _to_bytes(password), salt, cls.iterations, 32)
+        return base64.urlsafe_b64encode(key)
+
+    def load(self):
+        if not os.path.exists(self._path):
+            return None
+        try:
+            with open(self._path, 'rb') as cache_file:
+                return json.loads(self._fernet.decrypt(cache_file.read()).decode('utf-8'))
+        except (IOError, ValueError, self._invalid_token):
+            # Unreadable, corrupt, or encrypted with an old password
+            return None
+
+    def save(self, token, expires):
+        data = json.dumps({'token': token, 'expires': expires}).encode('utf-8')
+        write_atomic(self._path, self._fernet.encrypt(data))
+
+    def clear(self):
+        if os.path.exists(self._path):
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else value.encode('utf-8')
@@ -0,0 +1,87 @@
+import os
+import time
+import errno
+import tempfile
+
+
+def get_cache_root():
+    return os.environ.get('SLAP_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.slap')
+
+
+def get_cache_directory(*parts):
+    path = os.path.join(get_cache_root(), *parts)
+    make_directory(path)
+    return path
+
+
+def make_directory(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        # Another process may have created it first
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+    return path
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    make_directory(directory)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(data)
+        replace_file(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def replace_file(source, destination):
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # Windows won't rename over an existing file
+        if not os.path.exists(destination):
+            raise
+        os.remove(destination)
+        os.rename(source, destination)
+
+
+def create_once(path, create, timeout=120, poll_interval=0.2):
+    # Calls create(temp_path) to build path unless it already exists. Concurrent callers (e.g. parallel workers)
+    # wait for whichever got the lock first, instead of each building their own copy.
+    lock_path = path + '.lock'
+    while not os.path.exists(path):
+        try:
+            handle = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            _remove_stale_lock(lock_path, timeout)
+            time.sleep(poll_interval)
+            continue
+        os.close(handle)
+        try:
+            if not os.path.exists(path):
+                directory, name = os.path.split(path)
+                temp_path = os.path.join(directory, '.tmp-{0}-{1}'.format(os.getpid(), name))
+                try:
+                    create(temp_path)
+                    replace_file(temp_path, path)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+        finally:
+            os.remove(lock_path)
+    return path
+
+
+def _remove_stale_lock(lock_path, timeout):
+    # A lock this old belongs to a process that died part way through
+    try:
+        if os.path.getmtime(lock_path) < time.time() - timeout:
+            os.remove(lock_path)
+    except OSError:
+        pass
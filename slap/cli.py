@@ -1,12 +1,26 @@
 import os
 import sys
+import time
 import argparse
 from slap.publisher import Publisher
-from slap import git, config_builder
+from slap.parallel import ParallelPublisher
+from slap.pipeline import PublishPipeline
+from slap.manifest import Manifest
+from slap.journal import Journal
+from slap.plan import Planner, format_plan
+from slap.transport import create_transport
+from slap import git, config_builder, profiling, report
 
 
 def _create_parser():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--profile",
+                        metavar="TRACE_FILE",
+                        help="write a Chrome trace of every publishing phase, admin API call and arcpy call; open it "
+                             "in chrome://tracing or ui.perfetto.dev (ex: slap --profile trace.json publish ...)")
+    parser.add_argument("--cprofile",
+                        action="store_true",
+                        help="with --profile, also write a cProfile dump per process next to the trace")
     subparsers = parser.add_subparsers(help='commands')
 
     publish_parser = subparsers.add_parser('publish', help='publish services')
@@ -15,6 +29,15 @@ def _create_parser():
     init_parser = subparsers.add_parser('init', help='initialize config from a list of files')
     _add_init_arguments(init_parser)
 
+    plan_parser = subparsers.add_parser('plan', help='show what publish would do, without publishing')
+    _add_plan_arguments(plan_parser)
+
+    update_json_parser = subparsers.add_parser('update-json', help='re-apply json overrides to existing services')
+    _add_update_json_arguments(update_json_parser)
+
+    merge_reports_parser = subparsers.add_parser('merge-reports', help='combine the reports of sharded publish runs')
+    _add_merge_reports_arguments(merge_reports_parser)
+
     return parser
 
 
@@ -23,6 +46,127 @@ def _add_publish_arguments(parser):
     parser.add_argument("inputs",
                         nargs="*",
                         help="inputs to publish")
+    _add_server_arguments(parser)
+    parser.add_argument("-g", "--git",
+                        help="publish all files that have changed between HEAD and this commit "
+                             "(ex: -g b45e095834af1bc8f4c348bb4aad66bddcadeab4)")
+    parser.add_argument("-s", "--site",
+                        action="store_true",
+                        help="create a site before publishing")
+    parser.add_argument("-f", "--force",
+                        action="store_true",
+                        help="publish every service, even those unchanged since they were last published")
+    parser.add_argument("--manifest",
+                        help="file recording what was last published (ex: --manifest build/manifest.json); "
+                             "defaults to slap-manifest.json")
+    parser.add_argument("--journal",
+                        metavar="FILE",
+                        help="file recording each service's progress, for --resume; defaults to slap-journal.jsonl")
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="continue an interrupted run: skip services it published and reuse what it staged "
+                             "or uploaded")
+    parser.add_argument("--keep-going",
+                        action="store_true",
+                        help="keep publishing after a service fails, and report every failure at the end")
+    parser.add_argument("--overwrite",
+                        action="store_true",
+                        help="overwrite existing services in place instead of deleting them first, so they stay "
+                             "available while they are replaced")
+    parser.add_argument("-j", "--jobs",
+                        type=int,
+                        default=1,
+                        help="number of services to publish at once, each in its own process (ex: --jobs 4)")
+    parser.add_argument("--batch-start",
+                        type=int,
+                        metavar="SIZE",
+                        help="upload services stopped, then start them together at the end, SIZE at a time "
+                             "(ex: --batch-start 20)")
+    parser.add_argument("--pipeline",
+                        action="store_true",
+                        help="overlap local drafting and staging with uploads to the server")
+    parser.add_argument("--workers",
+                        action="append",
+                        type=_parse_workers,
+                        default=[],
+                        metavar="STAGE=N",
+                        help="number of threads for a pipeline stage: draft, stage, upload or configure "
+                             "(ex: --workers upload=4)")
+    parser.add_argument("--queue-size",
+                        type=int,
+                        default=2,
+                        help="services that may wait between pipeline stages (ex: --queue-size 4)")
+    parser.add_argument("--timings",
+                        metavar="FILE",
+                        help="write how long each phase of each service took to a .json or .csv file "
+                             "(ex: --timings timings.csv)")
+    parser.add_argument("--shard",
+                        type=_parse_shard,
+                        metavar="I/N",
+                        help="publish only part I of the services, split into N parts of about the same cost, "
+                             "for running on N machines at once (ex: --shard 2/4)")
+    parser.add_argument("--report",
+                        metavar="FILE",
+                        help="write what happened to each service, for merge-reports; defaults to "
+                             "slap-report-I-of-N.json with --shard")
+    parser.add_argument("--record",
+                        help="record every admin API request and response to a file (ex: --record session.jsonl)")
+    parser.add_argument("--replay",
+                        help="answer admin API requests from a recording instead of the server "
+                             "(ex: --replay session.jsonl)")
+
+
+def _add_plan_arguments(parser):
+    parser.set_defaults(func=plan)
+    parser.add_argument("inputs",
+                        nargs="*",
+                        help="inputs to plan for; defaults to all")
+    _add_server_arguments(parser)
+    parser.add_argument("-g", "--git",
+                        help="plan to publish only files that have changed between HEAD and this commit")
+    parser.add_argument("-f", "--force",
+                        action="store_true",
+                        help="plan to publish every service, even those unchanged since they were last published")
+    parser.add_argument("--manifest",
+                        help="file recording what was last published; defaults to slap-manifest.json")
+    parser.add_argument("--exit-code",
+                        action="store_true",
+                        help="exit with status 2 if anything would be published or updated")
+
+
+def _parse_workers(value):
+    stage, separator, count = value.partition('=')
+    if stage not in PublishPipeline.stage_names or not count.isdigit() or int(count) < 1:
+        raise argparse.ArgumentTypeError("expected STAGE=N with STAGE one of {0}, got '{1}'".format(
+            ', '.join(PublishPipeline.stage_names), value))
+    return stage, int(count)
+
+
+def _parse_shard(value):
+    index, separator, count = value.partition('/')
+    if not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+        raise argparse.ArgumentTypeError("expected I/N with 1 <= I <= N, got '{0}'".format(value))
+    return int(index), int(count)
+
+
+def _add_merge_reports_arguments(parser):
+    parser.set_defaults(func=merge_reports)
+    parser.add_argument("reports",
+                        nargs="+",
+                        help="reports written by publish --shard (ex: slap-report-*.json)")
+    parser.add_argument("-o", "--output",
+                        help="write the combined report to a file (ex: --output report.json)")
+
+
+def _add_update_json_arguments(parser):
+    parser.set_defaults(func=update_json)
+    parser.add_argument("inputs",
+                        nargs="*",
+                        help="inputs whose services should be updated; defaults to all")
+    _add_server_arguments(parser)
+
+
+def _add_server_arguments(parser):
     parser.add_argument("-u", "--username",
                         required=True,
                         help="Portal or AGS username (ex: --username john)")
@@ -32,14 +176,8 @@ def _add_publish_arguments(parser):
     parser.add_argument("-c", "--config",
                         default="config.json",
                         help="path to config file (ex: --config configs/int_config.json)")
-    parser.add_argument("-g", "--git",
-                        help="publish all files that have changed between HEAD and this commit "
-                             "(ex: -g b45e095834af1bc8f4c348bb4aad66bddcadeab4)")
     parser.add_argument("-n", "--name",
                         help="override the hostname in config (ex: --name $HOSTNAME)")
-    parser.add_argument("-s", "--site",
-                        action="store_true",
-                        help="create a site before publishing")
 
 
 def _add_init_arguments(parser):
@@ -58,7 +196,38 @@ def _add_init_arguments(parser):
 
 
 def publish(args):
-    publisher = Publisher(args.username, args.password, args.config, args.name)
+    publisher = Publisher(args.username, args.password, args.config, args.name,
+                          create_transport(**_get_transport_settings(args)))
+    # Resolved now, since arcpy changes the working directory
+    report_path = os.path.abspath(args.report) if args.report else \
+        os.path.abspath('slap-report-{0}-of-{1}.json'.format(*args.shard)) if args.shard else None
+    started = time.time()
+    error = None
+    try:
+        _publish(publisher, args)
+    except Exception as e:
+        error = '{0}: {1}'.format(type(e).__name__, e)
+        raise
+    finally:
+        print_api_metrics(publisher.api)
+        print_timings(publisher.timer, args.timings)
+        publisher.record_history()
+        if report_path:
+            write_report(publisher, report_path, started, error)
+
+
+def _publish(publisher, args):
+    if args.batch_start:
+        publisher.batch_start = args.batch_start
+    if args.manifest:
+        publisher.manifest = Manifest(os.path.abspath(args.manifest))
+    publisher.force = args.force
+    if args.overwrite:
+        publisher.overwrite = True
+    journal_path = args.journal if args.journal else \
+        publisher.config['journal'] if 'journal' in publisher.config else 'slap-journal.jsonl'
+    publisher.journal = Journal(os.path.abspath(journal_path), resume=args.resume)
+    publisher.keep_going = args.keep_going
 
     if args.site:
         print "Creating site..."
@@ -70,19 +239,141 @@ def publish(args):
     print "Registering data sources..."
     publisher.register_data_sources()
 
+    try:
+        if args.jobs > 1 or args.pipeline or args.shard:
+            work_items = _get_work_items(publisher, args)
+            if args.shard:
+                work_items = publisher.select_shard(work_items, *args.shard)
+            if args.jobs > 1:
+                _publish_parallel(publisher, args, work_items)
+            elif args.pipeline:
+                _publish_pipeline(publisher, args, work_items)
+            else:
+                _schedule_serial(publisher, work_items)
+                publisher.publish_entries(work_items)
+        elif args.git:
+            print "Getting changes from git..."
+            changed_files = git.get_changed_mxds(args.git)
+            print changed_files
+            _schedule_serial(publisher, publisher.get_service_entries(changed_files))
+            for input in changed_files:
+                publisher.publish_input(input)
+        elif args.inputs:
+            _schedule_serial(publisher, publisher.get_service_entries(args.inputs))
+            for input in args.inputs:
+                print "Publishing {}...".format(input)
+                publisher.publish_input(input)
+        else:
+            print "Publishing all..."
+            _schedule_serial(publisher, publisher.get_service_entries())
+            publisher.publish_all()
+        publisher.raise_failures()
+    finally:
+        # Services that were uploaded stopped still need starting if a later one failed
+        publisher.start_deferred_services()
+
+
+def _schedule_serial(publisher, work_items):
+    # Services still publish in config order; this only predicts the total and tracks progress for an ETA. The
+    # skip check keeps each service's fingerprint, so publishing doesn't hash its input again.
+    if publisher.history is None:
+        return
+    publisher.schedule([(service_type, config_entry) for service_type, config_entry in work_items
+                        if publisher.get_skip_reason(service_type, config_entry) is None])
+
+
+def _publish_parallel(publisher, args, work_items):
+    print "Publishing {0} services with {1} jobs...".format(len(work_items), args.jobs)
+    ParallelPublisher(publisher, args.username, args.password, args.jobs,
+                      _get_transport_settings(args)).publish(work_items)
+
+
+def _publish_pipeline(publisher, args, work_items):
+    print "Publishing {0} services through the pipeline...".format(len(work_items))
+    PublishPipeline(publisher, dict(args.workers), args.queue_size).publish(work_items)
+
+
+def _get_work_items(publisher, args):
     if args.git:
         print "Getting changes from git..."
         changed_files = git.get_changed_mxds(args.git)
         print changed_files
-        for input in changed_files:
-            publisher.publish_input(input)
+        return publisher.resolve_inputs(changed_files)
+    elif args.inputs:
+        return publisher.resolve_inputs(args.inputs)
+    return publisher.get_service_entries()
+
+
+def write_report(publisher, path, started, error=None):
+    report.write_report(path, report.create_report(publisher.shard, publisher.timer.records, publisher.skipped,
+                                                   started, time.time(), error))
+    print "Wrote report to {0}".format(path)
+
+
+def merge_reports(args):
+    merged = report.merge_reports([report.load_report(path) for path in args.reports])
+    print report.format_merged(merged)
+    if args.output:
+        report.write_report(args.output, merged)
+        print "Wrote combined report to {0}".format(args.output)
+    if not merged['ok']:
+        sys.exit(1)
+
+
+def plan(args):
+    publisher = Publisher(args.username, args.password, args.config, args.name)
+    if args.manifest:
+        publisher.manifest = Manifest(os.path.abspath(args.manifest))
+    publisher.force = args.force
+    changed = None
+    if args.git:
+        work_items = publisher.get_service_entries(args.inputs if args.inputs else None)
+        changed = set(id(config_entry) for service_type, config_entry in
+                      publisher.get_service_entries(git.get_changed_mxds(args.git)))
     elif args.inputs:
-        for input in args.inputs:
-            print "Publishing {}...".format(input)
-            publisher.publish_input(input)
+        work_items = publisher.resolve_inputs(args.inputs)
     else:
-        print "Publishing all..."
-        publisher.publish_all()
+        work_items = publisher.get_service_entries()
+    actions = Planner(publisher).plan(work_items, changed)
+    print format_plan(actions)
+    if args.exit_code and any(action['action'] != 'skip' for action in actions):
+        sys.exit(2)
+
+
+def update_json(args):
+    publisher = Publisher(args.username, args.password, args.config, args.name)
+    try:
+        updated = publisher.update_json(args.inputs if args.inputs else None)
+        print "Updated {0} service(s)".format(len(updated))
+    finally:
+        print_api_metrics(publisher.api)
+
+
+def _get_transport_settings(args):
+    # Absolute, since arcpy changes the working directory; -j workers record to and replay from the same files
+    return {
+        'record': os.path.abspath(args.record) if args.record else None,
+        'replay': os.path.abspath(args.replay) if args.replay else None
+    }
+
+
+def print_api_metrics(api):
+    print "Admin API calls:"
+    print api.metrics.format_summary()
+    stats = api.connection_stats
+    print "{0} requests over {1} connections ({2} reused)".format(
+        stats['requests'], stats['connections'], stats['reused'])
+    if getattr(api, 'limiter', None) is not None:
+        print api.limiter.format_summary('Admin calls')
+
+
+def print_timings(timer, path=None):
+    if not timer.records:
+        return
+    print timer.format_summary()
+    if path:
+        timer.write(path)
+        print "Wrote timings to {0}".format(path)
 
 
 def initialize_config(args):
@@ -97,7 +388,22 @@ def initialize_config(args):
 def main(raw_args=sys.argv[1:]):
     parser = _create_parser()
     args = parser.parse_args(raw_args)
-    args.func(args)
+    if args.profile:
+        _run_profiled(args)
+    else:
+        args.func(args)
+
+
+def _run_profiled(args):
+    profile_path = os.path.splitext(args.profile)[0] + '-{pid}.prof' if args.cprofile else None
+    profiling.enable(profile_path=profile_path)
+    try:
+        args.func(args)
+    finally:
+        profiling.get_tracer().write(args.profile)
+        profiling.dump_profile()
+        profiling.disable()
+        print "Wrote trace to {0}".format(args.profile)
 
 if __name__ == "__main__":
     main()
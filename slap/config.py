@@ -1,4 +1,5 @@
 import os
+import copy
 import json
 import urlparse
 import re
@@ -7,6 +8,7 @@ import re
 class ConfigParser:
 
     service_types = ['mapServices', 'gpServices', 'imageServices']
+    ags_service_types = {'mapServices': 'MapServer', 'gpServices': 'GPServer', 'imageServices': 'ImageServer'}
     required_keys = ['input', 'agsUrl']
 
     def __init__(self):
@@ -74,9 +76,25 @@ class ConfigParser:
         if isinstance(default_json, str):
             default_json_copy = json.loads(default_json)
         else:
-            default_json_copy = default_json.copy()
+            default_json_copy = copy.deepcopy(default_json)  # merge() changes nested objects in place
         return self.merge(default_json_copy, config_json)
 
+    def diff_json(self, old_json, new_json, path=None):
+        if path is None:
+            path = []
+        changes = []
+        for key in sorted(set(old_json) | set(new_json)):
+            key_path = path + [str(key)]
+            if key not in new_json:
+                changes.append(('.'.join(key_path), old_json[key], None))
+            elif key not in old_json:
+                changes.append(('.'.join(key_path), None, new_json[key]))
+            elif isinstance(old_json[key], dict) and isinstance(new_json[key], dict):
+                changes.extend(self.diff_json(old_json[key], new_json[key], key_path))
+            elif old_json[key] != new_json[key]:
+                changes.append(('.'.join(key_path), old_json[key], new_json[key]))
+        return changes
+
     @staticmethod
     def update_hostname(url, hostname):
         url_parts = urlparse.urlsplit(url)
@@ -86,3 +104,41 @@ class ConfigParser:
     def check_required_keys(self, config):
         for key in self.required_keys:
             test = config[key]
+
+
+class ServiceIndex:
+    # Looks up config entries by input path or service name without scanning the whole config
+
+    def __init__(self, config, base_directory=None):
+        self.config = config
+        self.base_directory = base_directory if base_directory else os.getcwd()
+        self.entries = []
+        self._by_input = {}
+        self._by_name = {}
+        for service_type in ConfigParser.service_types:
+            if service_type in config:
+                for config_entry in config[service_type]['services']:
+                    self.add(service_type, config_entry)
+
+    def add(self, service_type, config_entry):
+        item = (service_type, config_entry)
+        self.entries.append(item)
+        self._by_input.setdefault(self.normalize_path(config_entry['input']), []).append(item)
+        self._by_name.setdefault(self.get_service_name(config_entry), []).append(item)
+
+    def normalize_path(self, path):
+        full_path = path if os.path.isabs(path) else os.path.join(self.base_directory, path)
+        return os.path.normcase(os.path.normpath(full_path))
+
+    @staticmethod
+    def get_service_name(config_entry):
+        if 'serviceName' in config_entry:
+            return config_entry['serviceName']
+        if 'json' in config_entry and 'serviceName' in config_entry['json']:
+            return config_entry['json']['serviceName']
+        return os.path.splitext(os.path.split(config_entry['input'])[1])[0]
+
+    def find(self, value, service_type=None):
+        # Inputs match by path first, then by service name; either can match several entries
+        items = self._by_input.get(self.normalize_path(value)) or self._by_name.get(value) or []
+        return [item for item in items if service_type is None or item[0] == service_type]
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from slap.cache import get_cache_directory, write_atomic
+
+# Where the admin API keeps each kind of data store item
+FOLDER_PATH = '/fileShares'
+DATABASE_PATH = '/enterpriseDatabases'
+
+
+def is_database(data_source):
+    return data_source['serverPath'].endswith('.sde')
+
+
+def get_item_path(data_source):
+    return '{0}/{1}'.format(DATABASE_PATH if is_database(data_source) else FOLDER_PATH, data_source['name'])
+
+
+def create_folder_item(data_source, get_full_path):
+    server_path = get_full_path(data_source['serverPath'])
+    client_path = get_full_path(data_source['clientPath']) if 'clientPath' in data_source else server_path
+    info = {'path': server_path, 'dataStoreConnectionType': 'shared'}
+    if client_path != server_path:
+        info.update(dataStoreConnectionType='replicated', clientPath=client_path)
+    return {'type': 'folder', 'path': get_item_path(data_source), 'info': info}
+
+
+class RegistrationCache:
+    # Data sources already seen registered on a server, so a steady-state publish doesn't have to list them again
+
+    def __init__(self, ags_url, ttl=3600, directory=None, clock=time.time):
+        directory = directory if directory else get_cache_directory('data-sources')
+        self.path = os.path.join(directory, hashlib.sha256(ags_url).hexdigest()[:16] + '.json')
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._items = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)['items']
+        except (ValueError, KeyError):
+            return {}
+
+    def is_registered(self, data_source):
+        with self._lock:
+            entry = self._items.get(data_source['name'])
+        # Changing a data source's paths in config means checking it again
+        return entry is not None and entry['dataSource'] == data_source and \
+            self.clock() - entry['verified'] < self.ttl
+
+    def record(self, data_sources):
+        with self._lock:
+            for data_source in data_sources:
+                self._items[data_source['name']] = {'dataSource': data_source, 'verified': self.clock()}
+            write_atomic(self.path, json.dumps({'items': self._items}, indent=2, sort_keys=True))
+
+    def clear(self):
+        with self._lock:
+            self._items = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
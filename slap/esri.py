@@ -1,38 +1,59 @@
 import arcpy
 import os
+import hashlib
+from slap.cache import get_cache_directory, create_once
+from slap.sddraft import set_replacement
+from slap.timing import PhaseTimer
+from slap.profiling import span
 
 
 class ArcpyHelper:
 
-    def __init__(self, username, password, ags_admin_url, connection_file_name='temp.ags'):
+    def __init__(self, username, password, ags_admin_url, connection_file_name=None, timer=None):
 
         arcpy.env.overwriteOutput = True
+        self.timer = timer if timer else PhaseTimer()
 
         # ESRI's tools will change the cwd, so set it at the beginning
         self._cwd = os.getcwd()
 
-        self.connection_file_path = self.create_server_connection_file(
-            username,
-            password,
-            ags_admin_url,
-            connection_file_name
-        )
+        self._username = username
+        self._password = password
+        self._ags_admin_url = ags_admin_url
+        self._connection_file_name = connection_file_name
+        self._connection_file_path = None
 
     @property
     def cwd(self):
         return self._cwd
 
+    @property
+    def connection_file_path(self):
+        # Created on first use; publishing from a cached service definition over REST never needs one
+        if self._connection_file_path is None:
+            self._connection_file_path = self.create_server_connection_file(
+                self._username,
+                self._password,
+                self._ags_admin_url,
+                self._connection_file_name
+            )
+        return self._connection_file_path
+
     def get_full_path(self, config_path):
         return os.path.normpath(config_path) if os.path.isabs(config_path) \
             else os.path.normpath(os.path.join(self.cwd, config_path))
 
     @staticmethod
     def stage_service_definition(sddraft, sd):
-        arcpy.StageService_server(sddraft, sd)
+        with span('arcpy.StageService_server', 'arcpy'):
+            arcpy.StageService_server(sddraft, sd)
 
     def register_data_sources(self, data_sources):
-        existing_data_sources = arcpy.ListDataStoreItems(self.connection_file_path, "FOLDER") + \
-                                arcpy.ListDataStoreItems(self.connection_file_path, "DATABASE")
+        with span('arcpy.ListDataStoreItems', 'arcpy'):
+            items = arcpy.ListDataStoreItems(self.connection_file_path, "FOLDER") + \
+                arcpy.ListDataStoreItems(self.connection_file_path, "DATABASE")
+        # Each item is [name, server path, client path, status]
+        existing_data_sources = set(item[0] if isinstance(item, (list, tuple)) else item for item in items)
         for data_source in data_sources:
             if data_source["name"] not in existing_data_sources:
                 self.register_data_source(data_source)
@@ -71,36 +92,66 @@ class ArcpyHelper:
         server_path = data_source["serverPath"]
         client_path = data_source["clientPath"] if "clientPath" in data_source else server_path
         name = data_source["name"]
-        arcpy.AddDataStoreItem(
-            connection_file=self.connection_file_path,
-            datastore_type='DATABASE' if server_path.endswith('.sde') else 'FOLDER',
-            connection_name=name,
-            server_path=self.get_full_path(server_path),
-            client_path=self.get_full_path(client_path)
-        )
+        with span('arcpy.AddDataStoreItem', 'arcpy', connection_name=name):
+            arcpy.AddDataStoreItem(
+                connection_file=self.connection_file_path,
+                datastore_type='DATABASE' if server_path.endswith('.sde') else 'FOLDER',
+                connection_name=name,
+                server_path=self.get_full_path(server_path),
+                client_path=self.get_full_path(client_path)
+            )
 
     def upload_service_definition(self, sd, initial_state="STARTED"):
-        arcpy.UploadServiceDefinition_server(
-            in_sd_file=sd,
-            in_server=self.connection_file_path,
-            in_startupType=initial_state
-        )
+        with span('arcpy.UploadServiceDefinition_server', 'arcpy'):
+            arcpy.UploadServiceDefinition_server(
+                in_sd_file=sd,
+                in_server=self.connection_file_path,
+                in_startupType=initial_state
+            )
 
-    def create_server_connection_file(self, username, password, ags_admin_url, connection_file_name='temp.ags'):
-        output_path = self.get_full_path('./')
-        arcpy.mapping.CreateGISServerConnectionFile(
-            connection_type='PUBLISH_GIS_SERVICES',
-            out_folder_path=output_path,
-            out_name=connection_file_name,
-            server_url=ags_admin_url,
-            server_type='ARCGIS_SERVER',
-            use_arcgis_desktop_staging_folder=False,
-            staging_folder_path=output_path,
-            username=username,
-            password=password,
-            save_username_password=True
-        )
-        return os.path.join(output_path, connection_file_name)
+    def create_server_connection_file(self, username, password, ags_admin_url, connection_file_name=None):
+        if connection_file_name:
+            output_path = self.get_full_path('./')
+            self._create_server_connection_file(username, password, ags_admin_url, output_path,
+                                                connection_file_name, output_path)
+            return os.path.join(output_path, connection_file_name)
+
+        # Shared by every run and worker process with the same server and credentials
+        directory = get_cache_directory('connections')
+        prefix, key = self.get_connection_file_key(ags_admin_url, username, password)
+        path = os.path.join(directory, '{0}-{1}.ags'.format(prefix, key))
+        if not os.path.exists(path):
+            create_once(path, lambda temp_path: self._create_server_connection_file(
+                username, password, ags_admin_url, directory, os.path.basename(temp_path),
+                get_cache_directory('staging')))
+            # Files for the same server and user with an old password will never be used again
+            for name in os.listdir(directory):
+                if name.startswith(prefix + '-') and name.endswith('.ags') and name != os.path.basename(path):
+                    os.remove(os.path.join(directory, name))
+        return path
+
+    @staticmethod
+    def get_connection_file_key(ags_admin_url, username, password, server_type='ARCGIS_SERVER'):
+        prefix = hashlib.sha256('\n'.join([ags_admin_url, username, server_type])).hexdigest()[:16]
+        key = hashlib.sha256('\n'.join([ags_admin_url, username, server_type, password])).hexdigest()[:16]
+        return prefix, key
+
+    @staticmethod
+    def _create_server_connection_file(username, password, ags_admin_url, out_folder_path, out_name,
+                                       staging_folder_path):
+        with span('arcpy.mapping.CreateGISServerConnectionFile', 'arcpy'):
+            arcpy.mapping.CreateGISServerConnectionFile(
+                connection_type='PUBLISH_GIS_SERVICES',
+                out_folder_path=out_folder_path,
+                out_name=out_name,
+                server_url=ags_admin_url,
+                server_type='ARCGIS_SERVER',
+                use_arcgis_desktop_staging_folder=False,
+                staging_folder_path=staging_folder_path,
+                username=username,
+                password=password,
+                save_username_password=True
+            )
 
     def set_workspaces(self, path_to_mxd, workspaces):
         mxd = self._get_mxd_from_path(path_to_mxd)
@@ -121,12 +172,17 @@ class ArcpyHelper:
         full_mxd_path = self.get_full_path(path_to_mxd)
         return arcpy.mapping.MapDocument(full_mxd_path)
 
-    def publish_gp(self, config_entry, filename, sddraft):
+    def publish_gp(self, config_entry, filename, sddraft, replace=False):
         if "result" in config_entry:
             result = self.get_full_path(config_entry["result"])
         else:
             raise Exception("Result must be included in config for publishing a GP tool")
 
+        with self.timer.phase('draft'), span('arcpy.CreateGPSDDraft', 'arcpy'):
+            self._create_gp_sddraft(config_entry, filename, sddraft, result)
+        return self.analyze(sddraft, replace)
+
+    def _create_gp_sddraft(self, config_entry, filename, sddraft, result):
         arcpy.CreateGPSDDraft(
             result=result,
             out_sddraft=sddraft,
@@ -147,12 +203,17 @@ class ArcpyHelper:
             maxWaitTime=10,
             maxIdleTime=180
         )
-        return arcpy.mapping.AnalyzeForSD(sddraft)
 
-    def publish_mxd(self, config_entry, filename, sddraft):
+    def publish_mxd(self, config_entry, filename, sddraft, replace=False):
         if "workspaces" in config_entry:
-            self.set_workspaces(config_entry["input"], config_entry["workspaces"])
+            with self.timer.phase('workspaces'):
+                self.set_workspaces(config_entry["input"], config_entry["workspaces"])
+
+        with self.timer.phase('draft'), span('arcpy.mapping.CreateMapSDDraft', 'arcpy'):
+            self._create_map_sddraft(config_entry, filename, sddraft)
+        return self.analyze(sddraft, replace)
 
+    def _create_map_sddraft(self, config_entry, filename, sddraft):
         mxd = arcpy.mapping.MapDocument(self.get_full_path(config_entry["input"]))
         arcpy.mapping.CreateMapSDDraft(
             map_document=mxd,
@@ -165,9 +226,13 @@ class ArcpyHelper:
             summary=config_entry["summary"] if "summary" in config_entry else None,
             tags=config_entry["tags"] if "tags" in config_entry else None
         )
-        return arcpy.mapping.AnalyzeForSD(sddraft)
 
-    def publish_image_service(self, config_entry, filename, sddraft):
+    def publish_image_service(self, config_entry, filename, sddraft, replace=False):
+        with self.timer.phase('draft'), span('arcpy.CreateImageSDDraft', 'arcpy'):
+            self._create_image_sddraft(config_entry, filename, sddraft)
+        return self.analyze(sddraft, replace)
+
+    def _create_image_sddraft(self, config_entry, filename, sddraft):
         arcpy.CreateImageSDDraft(
             raster_or_mosaic_layer=config_entry["input"],
             out_sddraft=sddraft,
@@ -179,4 +244,10 @@ class ArcpyHelper:
             summary=config_entry["summary"] if "summary" in config_entry else None,
             tags=config_entry["tags"] if "tags" in config_entry else None
         )
-        return arcpy.mapping.AnalyzeForSD(sddraft)
\ No newline at end of file
+
+    def analyze(self, sddraft, replace=False):
+        # A replacement draft has to be marked as one before it is analyzed
+        if replace:
+            set_replacement(sddraft)
+        with self.timer.phase('analyze'), span('arcpy.mapping.AnalyzeForSD', 'arcpy'):
+            return arcpy.mapping.AnalyzeForSD(sddraft)
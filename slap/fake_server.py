@@ -0,0 +1,345 @@
+import os
+import sys
+import cgi
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import urllib
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class FakeArcGISServer:
+    # A local stand-in for the parts of the ArcGIS Server admin API that slap uses,
+    # for benchmarking and soak-testing without a live server
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=502, require_token=True, token_expiration=60):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.require_token = require_token
+        self.token_expiration = token_expiration
+        self.services = {}
+        self.folders = set()
+        self.tokens = set()
+        self.uploads = {}
+        self.expected_services = {}
+        self.jobs = {}
+        self.data_items = {}
+        self.site_created = False
+        self.requests = []
+        self._scheduled_errors = []
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _create_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}/arcgis/admin'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def add_service(self, service_name, folder='', service_type='MapServer', json_properties=None, state='STARTED'):
+        with self._lock:
+            if folder:
+                self.folders.add(folder)
+            properties = {'serviceName': service_name, 'type': service_type}
+            properties.update(json_properties if json_properties else {})
+            self.services[(folder, service_name, service_type)] = {'json': properties, 'state': state}
+
+    def expect_service(self, sd_name, service_name, folder='', service_type='MapServer'):
+        # The real server reads the service from inside the SD; here, say what publishing sd_name should create
+        with self._lock:
+            self.expected_services[sd_name] = (folder, service_name, service_type)
+
+    def fail_next(self, count=1, status=None):
+        with self._lock:
+            self._scheduled_errors.extend([status if status else self.error_status] * count)
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens.add(token)
+        return token
+
+    def revoke_tokens(self):
+        with self._lock:
+            self.tokens.clear()
+
+    def handle(self, method, path, params):
+        with self._lock:
+            self.requests.append((method, path))
+            scheduled_error = self._scheduled_errors.pop(0) if self._scheduled_errors else None
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if scheduled_error:
+            return scheduled_error, {'error': 'Injected failure'}
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, {'error': 'Injected failure'}
+
+        route = self.get_route(path)
+        if route == 'generateToken':
+            return 200, self._generate_token(params)
+        if self.require_token and params.get('token') not in self.tokens and route != 'createNewSite':
+            return 200, {'status': 'error', 'messages': ['Invalid token.'], 'code': 498}
+        return 200, self.route(method, route, params)
+
+    @staticmethod
+    def get_route(path):
+        path = urllib.unquote(path)
+        if path.startswith('/arcgis/rest/'):
+            return 'rest/' + path[len('/arcgis/rest/'):].strip('/')
+        return path.split('/arcgis/admin', 1)[-1].strip('/')
+
+    def route(self, method, route, params):
+        segments = route.split('/')
+        if route == 'createNewSite':
+            self.site_created = True
+            return {'status': 'success'}
+        if segments[0] == 'uploads':
+            return self._route_upload(segments[1:], params)
+        if route.startswith(self.publishing_tool_route):
+            return self._route_publishing_job(route[len(self.publishing_tool_route):], params)
+        if route == 'services/exists/exists':
+            key = (params.get('folderName', ''), params.get('serviceName'), params.get('type', 'MapServer'))
+            return {'exists': key in self.services}
+        if route == 'services/startServices':
+            return self._start_services(json.loads(params['services'])['services'])
+        if route == 'data/findItems':
+            return self._find_data_items(params.get('parentPath', '/'))
+        if route == 'data/registerItem':
+            return self._register_data_item(json.loads(params['item']))
+        if segments[0] != 'services':
+            return self._error('Unsupported resource: ' + route)
+        segments = segments[1:]
+        if not segments:
+            return self._list_services('')
+        if len(segments) == 1 and '.' not in segments[0]:
+            return self._list_services(segments[0])
+        return self._route_service(segments, params)
+
+    def _route_service(self, segments, params):
+        operation = None
+        if '.' not in segments[-1]:
+            operation = segments.pop()
+        folder = segments[0] if len(segments) > 1 else ''
+        service_name, service_type = segments[-1].rsplit('.', 1)
+        key = (folder, service_name, service_type)
+        with self._lock:
+            if key not in self.services:
+                return self._error('Service {0}.{1} not found.'.format(service_name, service_type))
+            if operation is None:
+                return self.services[key]['json']
+            if operation == 'edit':
+                self.services[key]['json'] = json.loads(params['service'])
+                return {'status': 'success'}
+            if operation == 'delete':
+                del self.services[key]
+                return {'status': 'success'}
+            if operation == 'stop':
+                self.services[key]['state'] = 'STOPPED'
+                return {'status': 'success'}
+            if operation == 'status':
+                state = self.services[key]['state']
+                return {'configuredState': state, 'realTimeState': state}
+        return self._error('Unsupported operation: ' + operation)
+
+    publishing_tool_route = 'rest/services/System/PublishingTools/GPServer/Publish Service Definition/'
+
+    def _route_upload(self, segments, params):
+        if segments == ['register']:
+            item_id = uuid.uuid4().hex
+            with self._lock:
+                self.uploads[item_id] = {'itemName': params.get('itemName'), 'parts': {}, 'committed': False}
+            return {'status': 'success', 'item': {'itemID': item_id}}
+        with self._lock:
+            upload = self.uploads.get(segments[0])
+            if upload is None or len(segments) != 2:
+                return self._error('Item not found.')
+            if segments[1] == 'uploadPart':
+                upload['parts'][params['partNumber']] = params['partFile'][1]
+                return {'status': 'success'}
+            if segments[1] == 'commit':
+                parts = params.get('parts', '').split(',')
+                if any(part not in upload['parts'] for part in parts):
+                    return self._error('Missing parts.')
+                upload['size'] = sum(len(upload['parts'][part]) for part in parts)
+                upload['committed'] = True
+                return {'status': 'success', 'item': {'itemID': segments[0], 'itemName': upload['itemName'],
+                                                      'size': upload['size']}}
+        return self._error('Unsupported operation: ' + segments[1])
+
+    def _route_publishing_job(self, route, params):
+        # Publishing finishes as soon as the job is submitted. Unless expect_service said otherwise, the SD's file name
+        # becomes the name of a map service in the root folder.
+        if route == 'submitJob':
+            with self._lock:
+                upload = self.uploads.pop(params.get('in_sdp_id'), None)
+            if upload is None or not upload['committed']:
+                return {'error': {'code': 400, 'message': 'Unable to complete operation.',
+                                  'details': ['Item not found.']}}
+            with self._lock:
+                folder, service_name, service_type = self.expected_services.get(
+                    upload['itemName'], ('', os.path.splitext(upload['itemName'])[0], 'MapServer'))
+            self.add_service(service_name, folder, service_type)
+            job_id = uuid.uuid4().hex
+            with self._lock:
+                self.jobs[job_id] = 'esriJobSucceeded'
+            return {'jobId': job_id, 'jobStatus': 'esriJobSucceeded'}
+        job_id = route.split('/')[-1]
+        if job_id not in self.jobs:
+            return {'error': {'code': 400, 'message': 'Job {0} not found.'.format(job_id), 'details': []}}
+        return {'jobId': job_id, 'jobStatus': self.jobs[job_id], 'messages': []}
+
+    def _start_services(self, services):
+        with self._lock:
+            for service in services:
+                key = (service['folderName'].strip('/'), service['serviceName'], service['type'])
+                if key not in self.services:
+                    return self._error('Service {0}.{1} not found.'.format(service['serviceName'], service['type']))
+                self.services[key]['state'] = 'STARTED'
+        return {'status': 'success'}
+
+    def _find_data_items(self, parent_path):
+        with self._lock:
+            return {'items': [item for path, item in sorted(self.data_items.items())
+                              if path.rsplit('/', 1)[0] == parent_path.rstrip('/')]}
+
+    def _register_data_item(self, item):
+        with self._lock:
+            if item['path'] in self.data_items:
+                return self._error('Item {0} already exists.'.format(item['path']))
+            self.data_items[item['path']] = item
+        return {'status': 'success', 'success': True}
+
+    def _generate_token(self, params):
+        expiration = int(params.get('expiration', self.token_expiration))
+        return {
+            'token': self.issue_token(),
+            'expires': int((time.time() + min(expiration, self.token_expiration) * 60) * 1000)
+        }
+
+    def _list_services(self, folder):
+        with self._lock:
+            if folder and folder not in self.folders:
+                return self._error("Folder '{0}' does not exist.".format(folder))
+            return {
+                'folderName': folder if folder else '/',
+                'folders': sorted(self.folders) if not folder else [],
+                'services': [
+                    {'folderName': f if f else '/', 'serviceName': name, 'type': service_type}
+                    for (f, name, service_type) in sorted(self.services) if f == folder
+                ]
+            }
+
+    @staticmethod
+    def _error(message):
+        return {'status': 'error', 'messages': [message]}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _create_handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'  # keep-alive, like the real server
+
+        def do_GET(self):
+            url = urlparse.urlsplit(self.path)
+            self._respond(*server.handle('GET', url.path, _parse_params(url.query)))
+
+        def do_POST(self):
+            if self.headers.gettype() == 'multipart/form-data':
+                params = _parse_multipart(self.rfile, self.headers)
+            else:
+                length = int(self.headers.getheader('content-length', 0))
+                params = _parse_params(self.rfile.read(length))
+            params.update(_parse_params(urlparse.urlsplit(self.path).query))
+            self._respond(*server.handle('POST', urlparse.urlsplit(self.path).path, params))
+
+        def _respond(self, status, body):
+            content = json.dumps(body)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def _parse_params(query):
+    return dict(urlparse.parse_qsl(query, keep_blank_values=True))
+
+
+def _parse_multipart(rfile, headers):
+    form = cgi.FieldStorage(fp=rfile, headers=headers, environ={'REQUEST_METHOD': 'POST'})
+    params = {}
+    for field in form.list:
+        params[field.name] = (field.filename, field.value) if field.filename else field.value
+    return params
+
+
+def _parse_expected_service(value):
+    try:
+        sd_name, service = value.split('=', 1)
+        folder, _, service = service.rpartition('/')
+        service_name, service_type = service.rsplit('.', 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected SD=[FOLDER/]NAME.TYPE, got ' + value)
+    return sd_name, folder, service_name, service_type
+
+
+def main(raw_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the ArcGIS Server admin API')
+    parser.add_argument('--port', type=int, default=6080, help='port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail')
+    parser.add_argument('--service', action='append', default=[], type=_parse_expected_service,
+                        metavar='SD=[FOLDER/]NAME.TYPE',
+                        help='the service that publishing SD creates, instead of a root map service named after it; '
+                             'can be repeated')
+    args = parser.parse_args(raw_args)
+    server = FakeArcGISServer(port=args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    for sd_name, folder, service_name, service_type in args.service:
+        server.expect_service(sd_name, service_name, folder, service_type)
+    print "Serving fake ArcGIS Server admin API at {0}".format(server.url)
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import heapq
+import sqlite3
+import threading
+from timeit import default_timer
+from slap.cache import get_cache_root, make_directory
+
+# Runs kept per service; estimates average the most recent few
+KEEP_RUNS = 10
+RECENT_RUNS = 5
+
+
+class History:
+    # How long each service took to publish in past runs, keyed by service and input size, in a small sqlite database
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path if path else os.path.join(get_cache_root(), 'history.sqlite')
+        self.clock = clock
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self, create=False):
+        if self._connection is None:
+            if not create and not os.path.exists(self.path):
+                return None  # Nothing recorded yet, and no reason to leave an empty database behind
+            make_directory(os.path.dirname(os.path.abspath(self.path)))
+            # Other slap runs may be recording too; sqlite locks the file, so wait for them instead of failing
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            with self._connection:
+                self._connection.execute('CREATE TABLE IF NOT EXISTS runs (service TEXT NOT NULL, input_size INTEGER, '
+                                         'total REAL NOT NULL, phases TEXT NOT NULL, recorded REAL NOT NULL)')
+                self._connection.execute('CREATE INDEX IF NOT EXISTS runs_service ON runs (service, recorded)')
+        return self._connection
+
+    def record(self, records):
+        # Takes PhaseTimer records
+        with self._lock:
+            connection = self._connect(create=True)
+            with connection:
+                for record in records:
+                    connection.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?)', (
+                        record['service'], record['input_size'], record['total'], json.dumps(record['phases']),
+                        self.clock()))
+                    connection.execute(
+                        'DELETE FROM runs WHERE service = ? AND rowid NOT IN '
+                        '(SELECT rowid FROM runs WHERE service = ? ORDER BY recorded DESC LIMIT ?)',
+                        (record['service'], record['service'], KEEP_RUNS))
+
+    def estimate(self, service, input_size=None):
+        # Returns {'total', 'phases'} in seconds, or None for a service that has never been published
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return None
+            rows = connection.execute('SELECT input_size, total, phases FROM runs WHERE service = ? '
+                                      'ORDER BY recorded DESC', (service,)).fetchall()
+        if not rows:
+            return None
+        same_size = [row for row in rows if row[0] == input_size]
+        if same_size:
+            return average([{'total': total, 'phases': json.loads(phases)}
+                            for size, total, phases in same_size[:RECENT_RUNS]])
+        # The input changed since; assume the time grows with its size
+        samples = []
+        for size, total, phases in rows[:RECENT_RUNS]:
+            scale = float(input_size) / size if input_size and size else 1.0
+            phases = json.loads(phases)
+            samples.append({'total': total * scale,
+                            'phases': dict((phase, duration * scale) for phase, duration in phases.items())})
+        return average(samples)
+
+
+def average(estimates):
+    phases = {}
+    for estimate in estimates:
+        for phase, duration in estimate['phases'].items():
+            phases[phase] = phases.get(phase, 0) + duration
+    return {
+        'total': sum(estimate['total'] for estimate in estimates) / len(estimates),
+        'phases': dict((phase, duration / len(estimates)) for phase, duration in phases.items())
+    }
+
+
+def order_longest_first(items, durations):
+    # Stable, so services with the same estimate keep their config order
+    order = sorted(range(len(items)), key=lambda index: -durations[index])
+    return [items[index] for index in order]
+
+
+def predict_duration(durations, workers=1):
+    # Each service, longest first, goes to whichever worker frees up first
+    loads = [0.0] * max(workers, 1)
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(loads, loads[0] + duration)
+    return max(loads)
+
+
+class Progress:
+    # Estimates the time left in a run from the expected duration of the services still to go, scaled by how long
+    # the finished ones actually took compared with theirs
+
+    def __init__(self, durations, predicted=None, clock=default_timer):
+        self._durations = dict(durations)
+        self.predicted = predicted
+        self.clock = clock
+        self.total = len(self._durations)
+        self.completed = 0
+        self._done = 0.0
+        self._start = clock()
+
+    def complete(self, key):
+        if key not in self._durations:
+            return False
+        self._done += self._durations.pop(key)
+        self.completed += 1
+        return True
+
+    def skip(self, key):
+        # Skipped services take no time, so they don't count towards the pace
+        if self._durations.pop(key, None) is not None:
+            self.total -= 1
+
+    def eta(self):
+        elapsed = self.clock() - self._start
+        remaining = sum(self._durations.values())
+        if not self._done:
+            return max(self.predicted - elapsed, 0) if self.predicted is not None else None
+        return elapsed * remaining / self._done
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '{0}h {1:02d}m'.format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return '{0}m {1:02d}s'.format(seconds // 60, seconds % 60)
+    return '{0}s'.format(seconds)
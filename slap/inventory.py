@@ -0,0 +1,89 @@
+import threading
+
+
+class ServiceInventory:
+
+    def __init__(self, api):
+        self._api = api
+        self._folders = {}
+        self._root_folders = None
+        self._lock = threading.RLock()
+
+    @property
+    def loaded_folders(self):
+        return list(self._folders.keys())
+
+    def exists(self, service_name, folder=None, service_type=None):
+        types = self.get_types(service_name, folder)
+        return service_type in types if service_type else len(types) > 0
+
+    def get_types(self, service_name, folder=None):
+        return set(self._get_folder(folder).get(service_name, set()))
+
+    def list_services(self, folder=None):
+        return sorted(
+            (name, service_type)
+            for name, types in self._get_folder(folder).items()
+            for service_type in types
+        )
+
+    def add(self, service_name, folder=None, service_type='MapServer'):
+        # Folders that haven't been listed yet will pick up the change when they are
+        with self._lock:
+            services = self._folders.get(self._get_folder_key(folder))
+            if services is not None:
+                services.setdefault(service_name, set()).add(service_type)
+
+    def remove(self, service_name, folder=None, service_type='MapServer'):
+        with self._lock:
+            services = self._folders.get(self._get_folder_key(folder))
+            if services is not None and service_name in services:
+                services[service_name].discard(service_type)
+                if not services[service_name]:
+                    del services[service_name]
+
+    def invalidate(self, folder=None):
+        with self._lock:
+            if folder is None:
+                self._folders = {}
+                self._root_folders = None
+            else:
+                self._folders.pop(self._get_folder_key(folder), None)
+
+    def _get_folder(self, folder):
+        key = self._get_folder_key(folder)
+        with self._lock:
+            if key not in self._folders:
+                self._folders[key] = self._load_folder(key)
+            return self._folders[key]
+
+    def _load_folder(self, folder):
+        if folder:
+            # Listing a folder that doesn't exist is an error, so check the root listing first
+            if folder not in self._get_root_folders():
+                return {}
+            response = self._api.list_services(folder)
+        else:
+            response = self._list_root()
+        return self._parse_services(response)
+
+    def _get_root_folders(self):
+        if self._root_folders is None:
+            self._folders[''] = self._parse_services(self._list_root())
+        return self._root_folders
+
+    def _list_root(self):
+        response = self._api.list_services('')
+        self._root_folders = set(response.get('folders', []))
+        return response
+
+    @staticmethod
+    def _parse_services(response):
+        services = {}
+        for service in response.get('services', []):
+            services.setdefault(service['serviceName'], set()).add(service['type'])
+        return services
+
+    @staticmethod
+    def _get_folder_key(folder):
+        return folder.strip('/') if folder else ''
@@ -0,0 +1,69 @@
+import os
+import json
+import time
+import threading
+
+# Phases a service goes through, in order; a resumed run picks up after the last one completed
+PHASES = ['staged', 'uploaded', 'published']
+
+
+class Journal:
+    # Append-only record of the phases each service has finished, so an interrupted run can be resumed.
+    # Every entry is one JSON line, appended in a single write, so worker processes can share the file.
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        if resume:
+            self._services = self.load()
+        else:
+            # A new run starts a new journal
+            if os.path.exists(path):
+                os.remove(path)
+            self._services = {}
+
+    def load(self):
+        services = {}
+        if not os.path.exists(self.path):
+            return services
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short when the last run was killed
+                self._apply(services, entry)
+        return services
+
+    @staticmethod
+    def _apply(services, entry):
+        state = services.get(entry['service'])
+        if state is None or state['fingerprint'] != entry['fingerprint']:
+            state = services[entry['service']] = {'fingerprint': entry['fingerprint'], 'phase': None}
+        if entry['phase'] == 'failed':
+            state['error'] = entry.get('error')
+        else:
+            state.update(entry)
+            state.pop('error', None)
+
+    def get(self, service, fingerprint):
+        # What the journal knows about this version of a service, or None if it has changed since
+        with self._lock:
+            state = self._services.get(service)
+            return dict(state) if state is not None and state['fingerprint'] == fingerprint else None
+
+    def get_phase(self, service, fingerprint):
+        state = self.get(service, fingerprint)
+        return state['phase'] if state else None
+
+    def record(self, service, phase, fingerprint, **details):
+        entry = dict(details, service=service, phase=phase, fingerprint=fingerprint, time=time.time())
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self._lock:
+            handle = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(handle, line)
+                os.fsync(handle)
+            finally:
+                os.close(handle)
+            self._apply(self._services, entry)
@@ -0,0 +1,97 @@
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+
+class AdaptiveLimiter:
+    # Limits how many calls run at once, adjusting the limit the way TCP adjusts its window (AIMD): it grows while calls
+    # succeed about as fast as usual, and is cut back when one fails or takes much longer than usual.
+
+    def __init__(self, floor=1, ceiling=8, tolerance=2.0, backoff=0.5, smoothing=0.1, warmup=3, clock=default_timer):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.warmup = warmup
+        self.clock = clock
+        self.highest = self.floor
+        self.decreases = 0
+        self._limit = float(self.floor)
+        self._slow_start = True
+        self._last_decrease = None
+        self._in_flight = 0
+        self._closed = False
+        # Usual latency per kind of call, as (samples, moving average)
+        self._baselines = {}
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        # Returns when the call started, for record()
+        with self._condition:
+            while self._in_flight >= int(self._limit) and not self._closed:
+                self._condition.wait()
+            self._in_flight += 1
+            return self.clock()
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def close(self):
+        # Lets everything waiting through, e.g. while shutting down after a failure
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, key='call', size=None):
+        # size: what the call's latency is proportional to, like the bytes uploaded
+        start = self.acquire()
+        try:
+            yield
+        except Exception:
+            self.record(key, self.clock() - start, start, error=True)
+            raise
+        else:
+            self.record(key, self.clock() - start, start, size=size)
+        finally:
+            self.release()
+
+    def record(self, key, duration, start, size=None, error=False):
+        with self._condition:
+            if error:
+                self._decrease(start)
+            else:
+                latency = float(duration) / size if size else duration
+                samples, baseline = self._baselines.get(key, (0, latency))
+                if samples >= self.warmup and latency > baseline * self.tolerance:
+                    self._decrease(start)
+                else:
+                    self._increase()
+                # Slow calls still move the average, so a server that stays slower is eventually taken as normal
+                self._baselines[key] = (samples + 1, baseline + (latency - baseline) * self.smoothing)
+            self._condition.notify_all()
+
+    def _increase(self):
+        # Grows by one per call until the first slowdown (doubling each round of calls), then by one per round
+        self._limit = min(float(self.ceiling), self._limit + (1 if self._slow_start else 1.0 / self._limit))
+        self.highest = max(self.highest, self.limit)
+
+    def _decrease(self, start):
+        # Calls already running when the limit came down saw the same overload, so it only counts once
+        if self._last_decrease is not None and start < self._last_decrease:
+            return
+        self._slow_start = False
+        self._limit = max(float(self.floor), self._limit * self.backoff)
+        self._last_decrease = self.clock()
+        self.decreases += 1
+
+    def format_summary(self, name):
+        return '{0} ran up to {1} at once, between {2} and {3}; backed off {4} time(s), ending at {5}'.format(
+            name, self.highest, self.floor, self.ceiling, self.decreases, self.limit)
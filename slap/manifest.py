@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import slap
+from slap.cache import write_atomic
+
+# Service settings that can also be given once for every service at the top of the config; the other top-level keys
+# only change how slap runs and talks to the server
+SERVICE_KEYS = ['input', 'output', 'result', 'serviceName', 'folderName', 'serverType', 'copyDataToServer', 'summary',
+                'tags', 'executionType', 'initialState', 'workspaces', 'json']
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    # Read in chunks so large documents never have to fit in memory
+    digest = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_path(path):
+    if os.path.isfile(path):
+        return hash_file(path)
+    if os.path.isdir(path):
+        # File geodatabases and other workspaces are directories
+        digest = hashlib.sha256()
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).replace(os.sep, '/') + '\0')
+                digest.update(hash_file(file_path) + '\0')
+        return digest.hexdigest()
+    return None
+
+
+def get_fingerprint(service_type, settings, paths, server=None):
+    # settings: the keys of a config entry that describe the service; server: where it's published to, if that counts
+    digest = hashlib.sha256()
+    digest.update('slap {0}\0{1}\0{2}\0'.format(slap.__version__, server, service_type))
+    digest.update(json.dumps(settings, sort_keys=True) + '\0')
+    for path in paths:
+        digest.update('{0}\0{1}\0'.format(path, hash_path(path)))
+    return digest.hexdigest()
+
+
+class Manifest:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._services = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as manifest_file:
+                return json.load(manifest_file)['services']
+        except (ValueError, KeyError):
+            # A corrupt manifest only costs a full publish
+            return {}
+
+    def get(self, key):
+        with self._lock:
+            return self._services.get(key)
+
+    def is_current(self, key, fingerprint):
+        entry = self.get(key)
+        return entry is not None and entry['fingerprint'] == fingerprint
+
+    def record(self, key, fingerprint):
+        with self._lock:
+            self._services[key] = {'fingerprint': fingerprint, 'published': time.time()}
+            self._save()
+
+    def remove(self, key):
+        # Forget a service whose publish failed part way, since its old copy may already be deleted
+        with self._lock:
+            if self._services.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        write_atomic(self.path, json.dumps({'version': 1, 'services': self._services}, indent=2, sort_keys=True))
@@ -0,0 +1,85 @@
+import math
+import threading
+
+
+class Metrics:
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, duration, status=None, size=0, retries=0, error=False):
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = {
+                    'durations': [], 'statuses': {}, 'bytes': 0, 'retries': 0, 'errors': 0
+                }
+            stats['durations'].append(duration)
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['bytes'] += size
+            stats['retries'] += retries
+            stats['errors'] += 1 if error else 0
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+
+    def pop_stats(self):
+        # The raw stats recorded so far, e.g. for a worker process to send to the parent to merge
+        with self._lock:
+            operations, self._operations = self._operations, {}
+        return operations
+
+    def merge(self, operations):
+        with self._lock:
+            for operation, other in operations.items():
+                stats = self._operations.setdefault(operation, {
+                    'durations': [], 'statuses': {}, 'bytes': 0, 'retries': 0, 'errors': 0
+                })
+                stats['durations'].extend(other['durations'])
+                for status, count in other['statuses'].items():
+                    stats['statuses'][status] = stats['statuses'].get(status, 0) + count
+                stats['bytes'] += other['bytes']
+                stats['retries'] += other['retries']
+                stats['errors'] += other['errors']
+
+    def summary(self):
+        with self._lock:
+            return dict(
+                (operation, self._summarize(stats)) for operation, stats in self._operations.items()
+            )
+
+    @staticmethod
+    def _summarize(stats):
+        durations = sorted(stats['durations'])
+        return {
+            'count': len(durations),
+            'errors': stats['errors'],
+            'retries': stats['retries'],
+            'bytes': stats['bytes'],
+            'statuses': stats['statuses'].copy(),
+            'total': sum(durations),
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'max': durations[-1]
+        }
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = ['{0:<16}{1:>8}{2:>8}{3:>9}{4:>10}{5:>10}{6:>10}{7:>12}'.format(
+            'operation', 'calls', 'errors', 'retries', 'p50 (s)', 'p95 (s)', 'max (s)', 'bytes')]
+        for operation in sorted(summary, key=lambda op: summary[op]['total'], reverse=True):
+            stats = summary[operation]
+            lines.append('{0:<16}{1:>8}{2:>8}{3:>9}{4:>10.3f}{5:>10.3f}{6:>10.3f}{7:>12}'.format(
+                operation, stats['count'], stats['errors'], stats['retries'],
+                stats['p50'], stats['p95'], stats['max'], stats['bytes']))
+        return '\n'.join(lines)
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
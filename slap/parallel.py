@@ -0,0 +1,144 @@
+import os
+import traceback
+import multiprocessing
+from timeit import default_timer
+from slap.publisher import PublishError
+from slap.journal import Journal
+from slap.history import predict_duration
+from slap.transport import create_transport
+from slap import profiling
+
+# Each worker process owns one Publisher, and with it its own arcpy; they share a cached connection file
+_publisher = None
+
+
+def _init_worker(username, password, config, batch_start, overwrite, journal_path, profiling_settings,
+                 transport_settings=None):
+    global _publisher
+    profiling.enable_from_settings(profiling_settings)
+    from slap.publisher import Publisher
+    # Add to the parent's recording (or replay it) rather than talking to the server unrecorded
+    transport = create_transport(append=True, **transport_settings) if transport_settings else None
+    _publisher = Publisher(username, password, config, transport=transport)
+    _publisher.batch_start = batch_start
+    _publisher.overwrite = overwrite
+    # The parent has already started a new journal if this isn't a resumed run
+    _publisher.journal = Journal(journal_path, resume=True) if journal_path else None
+    # Only the parent writes the manifest; it has already skipped unchanged services
+    _publisher.manifest = None
+
+
+def _publish_in_worker(work_item):
+    service_type, config_entry = work_item
+    start = default_timer()
+    result = {
+        'input': config_entry['input'],
+        'service_type': service_type,
+        'config_entry': config_entry,
+        'pid': os.getpid()
+    }
+    try:
+        _publisher.publish_service(service_type, config_entry)
+        result.update(ok=True, error=None)
+    except Exception as e:
+        result.update(ok=False, error='{0}: {1}'.format(type(e).__name__, e), traceback=traceback.format_exc())
+    # The parent starts deferred services once every worker is done
+    result['deferred_starts'] = _publisher.pop_deferred_starts()
+    result['timings'] = _publisher.timer.pop_records()
+    result['metrics'] = _publisher.api.metrics.pop_stats()
+    result['connection_stats'] = _publisher.api.pop_connection_stats()
+    tracer = profiling.get_tracer()
+    result['trace_events'] = tracer.pop_events() if tracer else []
+    profiling.dump_profile()
+    result['duration'] = default_timer() - start
+    return result
+
+
+class ParallelPublisher:
+
+    def __init__(self, publisher, username, password, jobs, transport_settings=None):
+        self._publisher = publisher
+        self._username = username
+        self._password = password
+        self._jobs = jobs
+        # record/replay file paths for each worker's transport, as for slap.transport.create_transport
+        self._transport_settings = transport_settings
+
+    def publish(self, work_items):
+        work_items = self._publisher.schedule(self._publisher.filter_unchanged(work_items), self.predict)
+        if not work_items:
+            return []
+        pool = multiprocessing.Pool(
+            processes=min(self._jobs, len(work_items)) or 1,
+            initializer=_init_worker,
+            initargs=(self._username, self._password, self._publisher.config, self._publisher.batch_start,
+                      self._publisher.overwrite, self._publisher.journal.path if self._publisher.journal else None,
+                      profiling.get_settings(), self._transport_settings)
+        )
+        # With a limiter, the pool's task thread waits for a free slot before handing out each service
+        limiter = self._publisher.create_limiter(self._jobs)
+        started = {}
+        results = []
+        try:
+            for result in pool.imap_unordered(_publish_in_worker, self._dispatch(work_items, limiter, started)):
+                if limiter is not None:
+                    self._record_load(limiter, result, started[(result['service_type'], result['input'])].pop(0))
+                self.report(result, len(results) + 1, len(work_items))
+                self._update_manifest(result)
+                self._publisher.queue_deferred_starts(result['deferred_starts'])
+                self._publisher.timer.add_records(result['timings'])
+                self._publisher.api.metrics.merge(result['metrics'])
+                self._publisher.api.merge_connection_stats(result['connection_stats'])
+                if profiling.get_tracer():
+                    profiling.get_tracer().add_events(result['trace_events'])
+                results.append(result)
+            pool.close()
+        except:
+            if limiter is not None:
+                limiter.close()
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        if limiter is not None:
+            self._publisher.message(limiter.format_summary('Publish jobs'))
+        failures = [result for result in results if not result['ok']]
+        if failures:
+            raise PublishError(failures)
+        return results
+
+    @staticmethod
+    def _dispatch(work_items, limiter, started):
+        for service_type, config_entry in work_items:
+            if limiter is not None:
+                started.setdefault((service_type, config_entry['input']), []).append(limiter.acquire())
+            yield service_type, config_entry
+
+    @staticmethod
+    def _record_load(limiter, result, start):
+        # Only the upload says how the server is coping; drafting and staging happen on this machine
+        for record in result['timings']:
+            if 'upload' in record['phases']:
+                limiter.record('upload', record['phases']['upload'], start, size=record['sd_size'],
+                               error=not result['ok'])
+        limiter.release()
+
+    def predict(self, estimates):
+        return predict_duration([estimate['total'] for estimate in estimates], self._jobs)
+
+    def _update_manifest(self, result):
+        # The worker may have saved the map document while drafting
+        self._publisher.forget_fingerprint(result['service_type'], result['config_entry'])
+        if result['ok']:
+            self._publisher.record_published(result['service_type'], result['config_entry'])
+        else:
+            self._publisher.forget_published(result['service_type'], result['config_entry'], result['error'])
+
+    def report(self, result, completed, total):
+        if result['ok']:
+            self._publisher.message("[{0}/{1}] {2} published successfully in {3:.1f}s".format(
+                completed, total, result['input'], result['duration']))
+        else:
+            self._publisher.message("[{0}/{1}] {2} failed: {3}".format(completed, total, result['input'],
+                                                                       result['error']))
@@ -0,0 +1,185 @@
+import os
+import threading
+import traceback
+import Queue
+from timeit import default_timer
+from slap.publisher import PublishError
+from slap.history import predict_duration
+from slap.profiling import span
+
+_DONE = object()
+
+
+class Pipeline:
+    # Runs items through a series of (name, function, workers) stages, each with its own threads.
+    # Bounded queues between stages keep a fast stage from running too far ahead of a slow one.
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(self, items, on_complete=None):
+        queues = [Queue.Queue(maxsize=self.queue_size) for stage in self.stages] + [Queue.Queue()]
+        threads = []
+        for index, (name, function, workers) in enumerate(self.stages):
+            remaining = [workers]
+            lock = threading.Lock()
+            for worker in range(workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(name, function, queues[index], queues[index + 1], remaining, lock,
+                          self._get_workers(index + 1))
+                )
+                thread.daemon = True
+                threads.append(thread)
+
+        producer = threading.Thread(target=self._produce, args=(items, queues[0], self._get_workers(0)))
+        producer.daemon = True
+        for thread in [producer] + threads:
+            thread.start()
+
+        jobs = []
+        while True:
+            job = queues[-1].get()
+            if job is _DONE:
+                break
+            jobs.append(job)
+            if on_complete:
+                on_complete(job)
+        for thread in [producer] + threads:
+            thread.join()
+        return sorted(jobs, key=lambda job: job['index'])
+
+    def _get_workers(self, index):
+        return self.stages[index][2] if index < len(self.stages) else 1
+
+    @staticmethod
+    def _produce(items, queue, consumers):
+        for index, item in enumerate(items):
+            queue.put({'index': index, 'item': item, 'value': item, 'error': None, 'stage': None, 'timings': {}})
+        for consumer in range(consumers):
+            queue.put(_DONE)
+
+    @staticmethod
+    def _work(name, function, in_queue, out_queue, remaining, lock, consumers):
+        while True:
+            job = in_queue.get()
+            if job is _DONE:
+                break
+            # A job that failed in an earlier stage passes straight through to the end
+            if job['error'] is None:
+                start = default_timer()
+                try:
+                    with span(name, 'stage'):
+                        job['value'] = function(job['value'])
+                except Exception as e:
+                    job.update(error='{0}: {1}'.format(type(e).__name__, e), stage=name,
+                               traceback=traceback.format_exc())
+                job['timings'][name] = default_timer() - start
+            out_queue.put(job)
+        # The last worker out tells the next stage there is nothing more coming
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for consumer in range(consumers):
+                    out_queue.put(_DONE)
+
+
+class PublishPipeline:
+
+    stage_names = ['draft', 'stage', 'upload', 'configure']
+    default_workers = {'draft': 1, 'stage': 1, 'upload': 2, 'configure': 2}
+    # The timed phases each stage spends its time in
+    stage_phases = {
+        'draft': ['workspaces', 'draft', 'analyze'],
+        'stage': ['stage'],
+        'upload': ['delete', 'upload', 'wait'],
+        'configure': ['edit', 'stop']
+    }
+
+    def __init__(self, publisher, workers=None, queue_size=2):
+        self._publisher = publisher
+        self.workers = self.default_workers.copy()
+        self.workers.update(workers if workers else {})
+        self.queue_size = queue_size
+        # arcpy isn't thread-safe, so drafting and staging take turns; uploads and edits only talk to the server
+        self._arcpy_lock = threading.Lock()
+        # Upload threads beyond the limiter's current limit wait their turn
+        self.upload_limiter = publisher.create_limiter(self.workers['upload'])
+
+    def publish(self, work_items):
+        work_items = self._publisher.schedule(self._publisher.filter_unchanged(work_items), self.predict)
+        pipeline = Pipeline([
+            ('draft', self._draft, self.workers['draft']),
+            ('stage', self._stage, self.workers['stage']),
+            ('upload', self._upload, self.workers['upload']),
+            ('configure', self._configure, self.workers['configure'])
+        ], self.queue_size)
+        start = default_timer()
+        jobs = pipeline.run(work_items, self._complete)
+        self._publisher.message("Finished {0} services in {1:.1f}s".format(len(jobs), default_timer() - start))
+        if self.upload_limiter is not None:
+            self._publisher.message(self.upload_limiter.format_summary('Uploads'))
+
+        failures = [{'input': job['item'][1]['input'], 'error': job['error']} for job in jobs if job['error']]
+        if failures:
+            raise PublishError(failures)
+        return jobs
+
+    def predict(self, estimates):
+        # The slowest stage sets the pace; drafting and staging take turns with arcpy, so they count as one
+        def get_durations(stages):
+            return [sum(estimate['phases'].get(phase, 0) for stage in stages for phase in self.stage_phases[stage])
+                    for estimate in estimates]
+        return max(predict_duration(get_durations(['draft', 'stage'])),
+                   predict_duration(get_durations(['upload']), self.workers['upload']),
+                   predict_duration(get_durations(['configure']), self.workers['configure']))
+
+    def _draft(self, work_item):
+        service_type, config_entry = work_item
+        key = self._publisher.get_service_key(service_type, config_entry)
+        with self._publisher.timer.service(key, config_entry['input']):
+            # A resumed or cached service definition is already staged, so it doesn't wait for arcpy
+            job = self._publisher.resume_job(service_type, config_entry) or \
+                self._publisher.reuse_staged(service_type, config_entry)
+            if job:
+                return job
+            with self._arcpy_lock:
+                return self._publisher.draft_service(service_type, config_entry)
+
+    def _stage(self, job):
+        if job.get('staged'):
+            return job
+        with self._arcpy_lock, self._publisher.timer.service(job['key']):
+            return self._publisher.stage_service(job)
+
+    def _upload(self, job):
+        if job.get('uploaded'):
+            return job
+        with self._publisher.timer.service(job['key']):
+            if self.upload_limiter is None:
+                return self._publisher.upload_service(job)
+            with self.upload_limiter.slot('upload', os.path.getsize(job['sd'])):
+                return self._publisher.upload_service(job)
+
+    def _configure(self, job):
+        with self._publisher.timer.service(job['key']):
+            return self._publisher.configure_service(job)
+
+    def _complete(self, job):
+        service_type, config_entry = job['item']
+        if job['error']:
+            self._publisher.forget_published(service_type, config_entry, job['error'])
+        else:
+            self._publisher.record_published(service_type, config_entry)
+        self.report(job)
+
+    def report(self, job):
+        input_path = job['item'][1]['input']
+        timings = ', '.join('{0} {1:.1f}s'.format(name, job['timings'][name])
+                            for name in self.stage_names if name in job['timings'])
+        if job['error']:
+            self._publisher.message("{0} failed in {1}: {2}".format(input_path, job['stage'], job['error']))
+        else:
+            self._publisher.message("{0} published successfully ({1})".format(input_path, timings))
+
@@ -0,0 +1,58 @@
+class Planner:
+    # Works out what `slap publish` would do to each service, using only config, the manifest and the admin API
+
+    def __init__(self, publisher):
+        self._publisher = publisher
+
+    def plan(self, work_items, changed=None):
+        # changed: entries selected some other way (e.g. git); None means compare against the manifest
+        actions = []
+        json_checks = []
+        for service_type, config_entry in work_items:
+            action = self._get_action(service_type, config_entry, changed)
+            actions.append(action)
+            if action['action'] == 'skip' and action['exists'] and 'json' in config_entry and config_entry['json']:
+                json_checks.append((action, config_entry['json']))
+
+        # Unchanged services can still have drifted from their json overrides on the server
+        current_jsons = self._publisher.api.get_params_many([action['target'] for action, json in json_checks])
+        for (action, json), current_json in zip(json_checks, current_jsons):
+            new_json = self._publisher.config_parser.merge_json(current_json, json)
+            changes = self._publisher.config_parser.diff_json(current_json, new_json)
+            if changes:
+                action.update(action='update-json', reason=', '.join(key for key, old, new in changes))
+        return actions
+
+    def _get_action(self, service_type, config_entry, changed):
+        publisher = self._publisher
+        input_path, output_path, service_name, folder_name, json, initial_state = \
+            publisher._get_publishing_params_from_config(config_entry)
+        ags_service_type = publisher.config_parser.ags_service_types[service_type]
+        action = {
+            'input': input_path,
+            'service': publisher.get_service_key(service_type, config_entry),
+            'target': {'service_name': service_name, 'folder': folder_name, 'service_type': ags_service_type}
+        }
+        action['exists'] = exists = publisher.inventory.exists(service_name, folder_name, ags_service_type)
+        # Mirrors publish: git and the manifest decide what gets published, the server decides how
+        if changed is not None and id(config_entry) not in changed:
+            action.update(action='skip', reason='not changed in git')
+        elif publisher.is_unchanged(service_type, config_entry):
+            action.update(action='skip', reason='unchanged')
+        elif exists:
+            action.update(action='replace', reason='forced' if publisher.force else 'changed')
+        elif publisher.matches_manifest(service_type, config_entry):
+            action.update(action='create', reason='unchanged, but missing on server')
+        else:
+            action.update(action='create', reason='not on server')
+        return action
+
+
+def format_plan(actions):
+    lines = ['{0:<13}{1:<40}{2}'.format(action['action'], action['service'], action['reason']) for action in actions]
+    counts = {}
+    for action in actions:
+        counts[action['action']] = counts.get(action['action'], 0) + 1
+    lines.append('Plan: ' + ', '.join('{0} {1}'.format(counts.get(name, 0), name)
+                                      for name in ['create', 'replace', 'update-json', 'skip']))
+    return '\n'.join(lines)
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from slap.cache import write_atomic
+
+# Set by enable(); until then span() is a no-op
+_tracer = None
+_profiler = None
+_profile_path = None
+
+
+class Tracer:
+    # Collects spans as Chrome trace events (chrome://tracing, ui.perfetto.dev)
+
+    def __init__(self):
+        self._events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, category, **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.time() - start, args)
+
+    def add(self, name, category, start, duration, args=None):
+        pid, thread = os.getpid(), threading.current_thread()
+        event = {
+            'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': thread.ident,
+            # Wall clock microseconds, so events from worker processes line up
+            'ts': int(start * 1e6), 'dur': int(duration * 1e6), 'args': args if args else {}
+        }
+        with self._lock:
+            if (pid, thread.ident) not in self._threads:
+                self._threads.add((pid, thread.ident))
+                self._events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread.ident,
+                                     'args': {'name': thread.name}})
+            self._events.append(event)
+
+    @property
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def add_events(self, events):
+        with self._lock:
+            self._events.extend(events)
+
+    def pop_events(self):
+        with self._lock:
+            events, self._events = self._events, []
+            self._threads = set()
+            return events
+
+    def write(self, path):
+        write_atomic(path, json.dumps({'traceEvents': self.events, 'displayTimeUnit': 'ms'}))
+
+
+class _NullSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_span = _NullSpan()
+
+
+def span(name, category, **args):
+    if _tracer is None:
+        return _null_span
+    return _tracer.span(name, category, **args)
+
+
+def get_tracer():
+    return _tracer
+
+
+def enable(trace=True, profile_path=None):
+    # profile_path may contain {pid}, so each worker process writes its own cProfile dump
+    global _tracer, _profiler, _profile_path
+    _tracer = Tracer() if trace else None
+    _profile_path = profile_path
+    if profile_path:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def disable():
+    global _tracer, _profiler, _profile_path
+    if _profiler is not None:
+        _profiler.disable()
+    _tracer = _profiler = _profile_path = None
+
+
+def get_settings():
+    # What a worker process needs to profile itself the same way as its parent
+    return {'trace': _tracer is not None, 'profile_path': _profile_path}
+
+
+def enable_from_settings(settings):
+    if settings['trace'] or settings['profile_path']:
+        enable(settings['trace'], settings['profile_path'])
+
+
+def dump_profile():
+    if _profiler is not None:
+        _profiler.dump_stats(_profile_path.format(pid=os.getpid()))
+        _profiler.enable()  # dump_stats stops the profiler
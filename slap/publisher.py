@@ -1,11 +1,33 @@
 import os
-from slap.api import Api
-from slap.config import ConfigParser
+import sys
+import sqlite3
+from timeit import default_timer
+from slap.api import ConcurrentApi
+from slap.artifacts import ArtifactCache
+from slap.config import ConfigParser, ServiceIndex
+from slap.data_sources import RegistrationCache, is_database, get_item_path, create_folder_item
+from slap.history import History, Progress, average, format_duration, order_longest_first, predict_duration
+from slap.inventory import ServiceInventory
+from slap.limiter import AdaptiveLimiter
+from slap.manifest import Manifest, SERVICE_KEYS, get_fingerprint
+from slap.retry import RetryPolicy, CircuitBreaker
+from slap.shard import assign_shards, get_costs, get_plan_id
+from slap.timing import PhaseTimer, AvailabilityMonitor
+
+
+class PublishError(RuntimeError):
+
+    def __init__(self, failures):
+        self.failures = failures
+        RuntimeError.__init__(self, '{0} service(s) failed to publish:\n{1}'.format(
+            len(failures), '\n'.join('  {0}: {1}'.format(failure['input'], failure['error']) for failure in failures)))
 
 
 class Publisher:
 
-    def __init__(self, username, password, config, hostname=None):
+    def __init__(self, username, password, config, hostname=None, transport=None, connection_file_name=None):
+        self._cwd = os.getcwd()
+        self._index = None
         self.config_parser = ConfigParser()
         self.config = self.config_parser.load_config(config) if isinstance(config, basestring) else config
 
@@ -13,23 +35,137 @@ class Publisher:
         if hostname:
             self.config['agsUrl'] = self.config_parser.update_hostname(self.config['agsUrl'], hostname)
 
-        self.api = Api(
+        self.api = self._create_api(username, password, transport)
+        self.inventory = ServiceInventory(self.api)
+
+        # When set, services are uploaded stopped and started this many at a time by start_deferred_services
+        self.batch_start = self.config['batchStart'] if 'batchStart' in self.config else None
+        self._deferred_starts = []
+        self._first_deferred_upload = None
+
+        # Services whose fingerprint matches the one recorded at their last publish are skipped, unless forced.
+        # Resolve the path now, since arcpy changes the working directory.
+        manifest_path = self.config['manifest'] if 'manifest' in self.config else 'slap-manifest.json'
+        self.manifest = Manifest(os.path.abspath(manifest_path))
+        self.force = False
+        # Each service's fingerprint from earlier in the run, since hashing its input is slow
+        self._fingerprints = {}
+
+        # Set to a Journal to record each service's progress, so an interrupted run can be resumed
+        self.journal = None
+        # When set, publish_all and publish_input carry on past a failed service and raise_failures reports them all
+        self.keep_going = False
+        self.failures = []
+        self.artifact_cache = self._create_artifact_cache()
+
+        # Overwrite existing services in place instead of deleting them first, so they stay up while replaced
+        self.overwrite = self.config['overwrite'] if 'overwrite' in self.config else False
+        # Watch replaced services until they start, to report how long they were down; always done when overwriting
+        self.measure_downtime = self.config['measureDowntime'] if 'measureDowntime' in self.config else False
+        self.start_timeout = self.config['startTimeout'] if 'startTimeout' in self.config else 300
+        # Seconds an upload through the admin API waits for its publishing job
+        self.publish_timeout = self.config['publishTimeout'] if 'publishTimeout' in self.config else 3600
+        self._data_source_cache = None
+        self._history = None
+        # Set by schedule, to report an ETA as services finish
+        self.progress = None
+        # Set by select_shard to this runner's part of the config
+        self.shard = None
+        self.skipped = []
+
+        self._username = username
+        self._password = password
+        self.timer = PhaseTimer()
+        self._ags_admin_url = self.config['agsUrl']
+        self._connection_file_name = connection_file_name
+        self._arcpy_helper = None
+
+    @property
+    def arcpy_helper(self):
+        # This is a S-L-O-W import, so defer until something actually needs arcpy
+        if self._arcpy_helper is None:
+            from slap.esri import ArcpyHelper
+            self._arcpy_helper = ArcpyHelper(
+                username=self._username,
+                password=self._password,
+                ags_admin_url=self._ags_admin_url,
+                connection_file_name=self._connection_file_name,
+                timer=self.timer
+            )
+        return self._arcpy_helper
+
+    def _create_api(self, username, password, transport=None):
+        retry = self.config['retry'] if 'retry' in self.config else {}
+        circuit_breaker = self.config['circuitBreaker'] if 'circuitBreaker' in self.config else {}
+        max_workers = self.config['maxWorkers'] if 'maxWorkers' in self.config else 8
+        return ConcurrentApi(
             ags_url=self.config['agsUrl'],
             token_url=self.config['tokenUrl'] if 'tokenUrl' in self.config else None,
             portal_url=self.config['portalUrl'] if 'portalUrl' in self.config else None,
             username=username,
             password=password,
-            verify_certs=self.config['verifyCerts'] if 'verifyCerts' in self.config else False
+            verify_certs=self.config['verifyCerts'] if 'verifyCerts' in self.config else False,
+            pool_size=self.config['poolSize'] if 'poolSize' in self.config else 10,
+            connect_timeout=self.config['connectTimeout'] if 'connectTimeout' in self.config else None,
+            read_timeout=self.config['readTimeout'] if 'readTimeout' in self.config else None,
+            token_cache=self.config['tokenCache'] if 'tokenCache' in self.config else False,
+            max_workers=max_workers,
+            limiter=self.create_limiter(max_workers),
+            retry_policy=RetryPolicy(
+                max_retries=retry['maxRetries'] if 'maxRetries' in retry else 3,
+                backoff_factor=retry['backoffFactor'] if 'backoffFactor' in retry else 0.5,
+                max_backoff=retry['maxBackoff'] if 'maxBackoff' in retry else 30
+            ),
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=circuit_breaker['failureThreshold'] if 'failureThreshold' in circuit_breaker else 5,
+                reset_timeout=circuit_breaker['resetTimeout'] if 'resetTimeout' in circuit_breaker else 30
+            ),
+            transport=transport
         )
 
-        # This is a S-L-O-W import, so defer as long as possible
-        from slap.esri import ArcpyHelper
-        self.arcpy_helper = ArcpyHelper(
-            username=username,
-            password=password,
-            ags_admin_url=self.config['agsUrl']
+    def create_limiter(self, workers):
+        # Lets up to `workers` calls adapt to how the server copes, if "adaptiveConcurrency" is set in config
+        settings = self.config['adaptiveConcurrency'] if 'adaptiveConcurrency' in self.config else False
+        if not settings:
+            return None
+        settings = settings if isinstance(settings, dict) else {}
+        return AdaptiveLimiter(
+            floor=settings['floor'] if 'floor' in settings else 1,
+            ceiling=min(settings['ceiling'], workers) if 'ceiling' in settings else workers,
+            tolerance=settings['latencyTolerance'] if 'latencyTolerance' in settings else 2.0,
+            backoff=settings['backoff'] if 'backoff' in settings else 0.5
+        )
+
+    def _create_artifact_cache(self):
+        settings = self.config['artifactCache'] if 'artifactCache' in self.config else False
+        if not settings:
+            return None
+        settings = settings if isinstance(settings, dict) else {}
+        return ArtifactCache(
+            directory=settings['directory'] if 'directory' in settings else None,
+            max_size=(settings['maxSizeMb'] if 'maxSizeMb' in settings else 2048) * 1024 * 1024
         )
 
+    @property
+    def data_source_cache(self):
+        # Seconds a registration stays trusted without asking the server; false to always check
+        ttl = self.config['dataSourceCache'] if 'dataSourceCache' in self.config else 3600
+        if ttl is False:
+            return None
+        if self._data_source_cache is None:
+            self._data_source_cache = RegistrationCache(self.config['agsUrl'], ttl=3600 if ttl is True else ttl)
+        return self._data_source_cache
+
+    @property
+    def history(self):
+        # Past durations, for publishing the slowest services first and estimating how long a run will take
+        path = self.config['history'] if 'history' in self.config else None
+        if path is False:
+            return None
+        if self._history is None:
+            self._history = History(self.get_full_path(path) if path and path is not True else None)
+        return self._history
+
     @staticmethod
     def analysis_successful(analysis_errors):
         if analysis_errors == {}:
@@ -37,23 +173,25 @@ class Publisher:
         else:
             raise RuntimeError('Analysis contained errors: ', analysis_errors)
 
+    @property
+    def index(self):
+        # Built once per config; rebuilt if the config is replaced
+        if self._index is None or self._index.config is not self.config:
+            self._index = ServiceIndex(self.config, self._cwd)
+        return self._index
+
     def publish_input(self, input_value):
         input_was_published = False
         for service_type in self.config_parser.service_types:
-            if not input_was_published:
-                input_was_published = self._check_service_type(service_type, input_value)
+            input_was_published = self._check_service_type(service_type, input_value) or input_was_published
         if not input_was_published:
             raise ValueError('Input ' + input_value + ' was not found in config.')
 
     def _check_service_type(self, service_type, value):
-        ret = False
-        if service_type in self.config:
-            for config in self.config[service_type]['services']:
-                if config["input"] == value:
-                    self.publish_service(service_type, config)
-                    ret = True
-                    break
-        return ret
+        config_entries = [config_entry for entry_type, config_entry in self.index.find(value, service_type)]
+        for config_entry in config_entries:
+            self._publish_service_or_continue(service_type, config_entry)
+        return len(config_entries) > 0
 
     def publish_all(self):
         for service_type in self.config_parser.service_types:
@@ -61,18 +199,339 @@ class Publisher:
 
     def publish_services(self, service_type):
         for config_entry in self.config[service_type]['services']:
+            self._publish_service_or_continue(service_type, config_entry)
+
+    def publish_entries(self, work_items):
+        for service_type, config_entry in work_items:
+            self._publish_service_or_continue(service_type, config_entry)
+
+    def _publish_service_or_continue(self, service_type, config_entry):
+        if not self.keep_going:
+            return self.publish_service(service_type, config_entry)
+        try:
             self.publish_service(service_type, config_entry)
+        except Exception as e:
+            error = '{0}: {1}'.format(type(e).__name__, e)
+            self.failures.append({'input': config_entry['input'], 'error': error})
+            self.message("{0} failed, continuing: {1}".format(config_entry['input'], error))
+
+    def raise_failures(self):
+        if self.failures:
+            failures, self.failures = self.failures, []
+            raise PublishError(failures)
 
     def publish_service(self, service_type, config_entry):
+        if self._skip_unchanged(service_type, config_entry):
+            return
+        try:
+            with self.timer.service(self.get_service_key(service_type, config_entry), config_entry['input']):
+                job = self.resume_job(service_type, config_entry) or \
+                    self.reuse_staged(service_type, config_entry) or \
+                    self.draft_service(service_type, config_entry)
+                self.stage_service(job)
+                if job.get('uploaded'):
+                    self.configure_service(job)
+                else:
+                    self.publish_sd_draft(job['sddraft'], job['sd'], job['service_name'], job['folder_name'],
+                                          job['initial_state'], job['json'], job['service_type'], staged=True,
+                                          replace=job.get('replace', False))
+        except:
+            error = sys.exc_info()[1]
+            self.forget_published(service_type, config_entry, '{0}: {1}'.format(type(error).__name__, error))
+            raise
+        self.record_published(service_type, config_entry)
+        self.message(job['input'] + " published successfully")
+
+    def get_fingerprint(self, service_type, config_entry):
+        # The same service on another server (e.g. with --name) is a different publish
+        settings = (self.config['agsUrl'], self.get_service_settings(service_type, config_entry))
+        key = self.get_service_key(service_type, config_entry)
+        cached = self._fingerprints.get(key)
+        if cached is None or cached[0] != settings:
+            cached = self._fingerprints[key] = (settings, self._get_fingerprint(service_type, settings[1],
+                                                                                settings[0]))
+        return cached[1]
+
+    def forget_fingerprint(self, service_type, config_entry):
+        # Drafting may save the map document, so its fingerprint has to be worked out again afterwards
+        self._fingerprints.pop(self.get_service_key(service_type, config_entry), None)
+
+    def _get_fingerprint(self, service_type, settings, server=None):
+        paths = [self.get_full_path(settings[key]) for key in ['input', 'result'] if key in settings]
+        return get_fingerprint(service_type, settings, paths, server)
+
+    def get_service_settings(self, service_type, config_entry):
+        # Every top-level key is merged into each entry; only keep the ones set for this service or its type, and
+        # top-level service settings
+        root_keys = set(key for key in self.config if key not in self.config_parser.service_types)
+        type_keys = set(self.config[service_type]) if service_type in self.config else set()
+        return dict((key, value) for key, value in config_entry.items()
+                    if key in SERVICE_KEYS or key in type_keys or key not in root_keys)
+
+    def get_artifact_key(self, service_type, config_entry, replace=False):
+        # Settings applied after the upload don't change the staged service definition, so leave them out. Nor does
+        # the server, so one environment can reuse what another staged.
+        settings = dict((key, value) for key, value in self.get_service_settings(service_type, config_entry).items()
+                        if key not in ['json', 'initialState', 'output'])
+        fingerprint = self._get_fingerprint(service_type, settings)
+        server_type = config_entry['serverType'] if 'serverType' in config_entry else 'ARCGIS_SERVER'
+        return ArtifactCache.get_key(fingerprint + ('/replace' if replace else ''), server_type,
+                                     self.config_parser.ags_service_types[service_type])
+
+    def get_full_path(self, config_path):
+        # Same as ArcpyHelper.get_full_path, without loading arcpy
+        return os.path.normpath(config_path) if os.path.isabs(config_path) \
+            else os.path.normpath(os.path.join(self._cwd, config_path))
+
+    def get_service_key(self, service_type, config_entry):
+        service_name = self._get_service_name_from_config(config_entry)
+        folder_name = config_entry["folderName"] if "folderName" in config_entry else None
+        return '{0}{1}.{2}'.format(folder_name + '/' if folder_name else '', service_name,
+                                   self.config_parser.ags_service_types[service_type])
+
+    def matches_manifest(self, service_type, config_entry):
+        if self.force or self.manifest is None:
+            return False
+        key = self.get_service_key(service_type, config_entry)
+        return self.manifest.is_current(key, self.get_fingerprint(service_type, config_entry))
+
+    def is_unchanged(self, service_type, config_entry):
+        if not self.matches_manifest(service_type, config_entry):
+            return False
+        # A service deleted on the server since, or whose upload never finished, is published again
+        service_name = self._get_service_name_from_config(config_entry)
+        folder_name = config_entry['folderName'] if 'folderName' in config_entry else None
+        return self.inventory.exists(service_name, folder_name, self.config_parser.ags_service_types[service_type])
+
+    def filter_unchanged(self, work_items):
+        return [(service_type, config_entry) for service_type, config_entry in work_items
+                if not self._skip_unchanged(service_type, config_entry)]
+
+    def _skip_unchanged(self, service_type, config_entry):
+        reason = self.get_skip_reason(service_type, config_entry)
+        if reason is None:
+            return False
+        self.message("Skipping {0}, {1}".format(config_entry['input'], reason))
+        key = self.get_service_key(service_type, config_entry)
+        self.skipped.append(key)
+        if self.progress is not None:
+            self.progress.skip(key)
+        return True
+
+    def get_skip_reason(self, service_type, config_entry):
+        if self.is_unchanged(service_type, config_entry):
+            return "unchanged since it was last published"
+        if self.get_journal_phase(service_type, config_entry) == 'published':
+            return "already published before the run was interrupted"
+        return None
+
+    def get_input_size(self, config_entry):
+        input_path = self.get_full_path(config_entry['input'])
+        return os.path.getsize(input_path) if os.path.isfile(input_path) else None
+
+    def estimate_duration(self, service_type, config_entry):
+        return self.history.estimate(self.get_service_key(service_type, config_entry),
+                                     self.get_input_size(config_entry))
+
+    def select_shard(self, work_items, index, count):
+        # Splits the work into count shards of about the same cost and returns shard index (from 1). History only
+        # counts when config names its file, so every runner reads the same one from the checkout; each runner's own
+        # ~/.slap history would give each of them a different split.
+        shared_history = 'history' in self.config and isinstance(self.config['history'], basestring)
+        estimates = [self.estimate_duration(service_type, config_entry) if shared_history else None
+                     for service_type, config_entry in work_items]
+        sizes = [self.get_input_size(config_entry) for service_type, config_entry in work_items]
+        assignments = assign_shards(get_costs(estimates, sizes), count)
+        keys = [self.get_service_key(service_type, config_entry) for service_type, config_entry in work_items]
+        self.shard = {
+            'index': index,
+            'count': count,
+            'plan': get_plan_id(keys, assignments),
+            'services': [key for key, shard in zip(keys, assignments) if shard == index - 1]
+        }
+        self.message("Shard {0}/{1}: {2} of {3} services (plan {4})".format(
+            index, count, len(self.shard['services']), len(work_items), self.shard['plan']))
+        return [work_item for work_item, shard in zip(work_items, assignments) if shard == index - 1]
+
+    def schedule(self, work_items, predict=None):
+        # Orders work longest expected first, predicts how long it will take (by default one service at a time)
+        # and starts tracking progress, so each finished service reports an ETA
+        if self.history is None or not work_items:
+            return work_items
+        keys = [self.get_service_key(service_type, config_entry) for service_type, config_entry in work_items]
+        estimates = [self.estimate_duration(service_type, config_entry) for service_type, config_entry in work_items]
+        known = [estimate for estimate in estimates if estimate is not None]
+        if not known:
+            # Without any history every service counts the same, which still gives an ETA once some finish
+            self.progress = Progress(dict((key, 1.0) for key in keys))
+            return work_items
+
+        # Services without history are expected to take as long as the average one with some
+        typical = average(known)
+        estimates = [estimate if estimate is not None else typical for estimate in estimates]
+        durations = [estimate['total'] for estimate in estimates]
+        predicted = predict(estimates) if predict else predict_duration(durations)
+        self.progress = Progress(dict(zip(keys, durations)), predicted)
+        unknown = len(estimates) - len(known)
+        self.message("Expecting {0} services to take about {1}{2}".format(
+            len(work_items), format_duration(predicted),
+            ' ({0} never published before)'.format(unknown) if unknown else ''))
+        return order_longest_first(work_items, durations)
+
+    def _update_progress(self, service_type, config_entry):
+        if self.progress is None or not self.progress.complete(self.get_service_key(service_type, config_entry)):
+            return
+        eta = self.progress.eta()
+        self.message("{0}/{1} services done{2}".format(
+            self.progress.completed, self.progress.total,
+            ', about {0} left'.format(format_duration(eta)) if eta is not None else ''))
+
+    def record_history(self):
+        # Resumed services only did part of the work, so their times would throw estimates off
+        records = [record for record in self.timer.records if record['ok'] and not record.get('resumed')]
+        if not records or self.history is None:
+            return
+        try:
+            self.history.record(records)
+        except sqlite3.Error as e:
+            self.message("Couldn't record publish history in {0}: {1}".format(self.history.path, e))
+
+    def record_published(self, service_type, config_entry):
+        self._update_progress(service_type, config_entry)
+        # Fingerprint after publishing, since replacing workspaces saves the map document
+        if self.manifest is None and self.journal is None:
+            return
+        key = self.get_service_key(service_type, config_entry)
+        fingerprint = self.get_fingerprint(service_type, config_entry)
+        if self.manifest is not None:
+            self.manifest.record(key, fingerprint)
+        if self.journal is not None:
+            self.journal.record(key, 'published', fingerprint)
+
+    def forget_published(self, service_type, config_entry, error=None):
+        self._update_progress(service_type, config_entry)
+        key = self.get_service_key(service_type, config_entry)
+        if self.manifest is not None:
+            self.manifest.remove(key)
+        if self.journal is not None:
+            self.journal.record(key, 'failed', self.get_fingerprint(service_type, config_entry), error=error)
+
+    def get_journal_phase(self, service_type, config_entry):
+        if self.journal is None:
+            return None
+        return self.journal.get_phase(self.get_service_key(service_type, config_entry),
+                                      self.get_fingerprint(service_type, config_entry))
+
+    def resume_job(self, service_type, config_entry):
+        # Returns a job that continues after the last phase an interrupted run finished, if its SD is still there
+        if self.journal is None:
+            return None
+        fingerprint = self.get_fingerprint(service_type, config_entry)
+        state = self.journal.get(self.get_service_key(service_type, config_entry), fingerprint)
+        if state is None or state['phase'] not in ('staged', 'uploaded') or not os.path.exists(state['sd']):
+            return None
+        job = self._create_job(service_type, config_entry)
+        job.update(staged=True, resumed=True, uploaded=state['phase'] == 'uploaded', sd=state['sd'],
+                   replace=state.get('replace', False), fingerprint=fingerprint)
+        self.message("Publishing {0} (resuming after it was {1})".format(job['input'], state['phase']))
+        self.timer.set('resumed', True)
+        self.timer.record_file_size('sd_size', job['sd'])
+        return job
+
+    def _journal(self, job, phase, **details):
+        if self.journal is None:
+            return
+        if 'fingerprint' not in job:
+            # Not until now, since drafting may have saved the map document
+            job['fingerprint'] = self.get_fingerprint(*job['entry'])
+        self.journal.record(job['key'], phase, job['fingerprint'], **details)
+
+    def draft_service(self, service_type, config_entry):
+        job = self._create_job(service_type, config_entry)
+        self.message("Publishing " + job['input'])
+        self.timer.record_file_size('input_size', self.get_full_path(job['input']))
+        analysis = self._get_method_by_service_type(service_type)(config_entry, job['filename'], job['sddraft'],
+                                                                  replace=job['replace'])
+        self.forget_fingerprint(service_type, config_entry)
+        if job['artifact_key']:
+            # Cache the staged SD under the map document as drafting left it, which is what the next run will find
+            job['artifact_key'] = self.get_artifact_key(service_type, config_entry, job['replace'])
+        self.analysis_successful(analysis['errors'])  # This may throw an exception
+        return job
+
+    def reuse_staged(self, service_type, config_entry):
+        # Returns a job that is ready to upload if the artifact cache has this exact service definition
+        if self.artifact_cache is None:
+            return None
+        job = self._create_job(service_type, config_entry)
+        if not self.artifact_cache.get(job['artifact_key'], job['sd']):
+            return None
+        self.message("Publishing {0} (reusing staged service definition)".format(job['input']))
+        self.timer.record_file_size('input_size', self.get_full_path(job['input']))
+        self.timer.record_file_size('sd_size', job['sd'])
+        job['staged'] = True
+        return job
+
+    def _create_job(self, service_type, config_entry):
         input_path, output_path, service_name, folder_name, json, initial_state = \
             self._get_publishing_params_from_config(config_entry)
         filename, sddraft, sd = self._get_service_definition_paths(input_path, output_path)
+        ags_service_type = self.config_parser.ags_service_types[service_type]
+        # Only a service that already exists can be overwritten
+        replace = bool(self.overwrite) and self.inventory.exists(service_name, folder_name, ags_service_type)
+        return {
+            'key': self.get_service_key(service_type, config_entry),
+            'artifact_key': self.get_artifact_key(service_type, config_entry, replace) if self.artifact_cache else None,
+            'staged': False,
+            'replace': replace,
+            'entry': (service_type, config_entry),
+            'input': input_path,
+            'filename': filename,
+            'sddraft': sddraft,
+            'sd': sd,
+            'service_name': service_name,
+            'folder_name': folder_name,
+            'initial_state': initial_state,
+            'json': json,
+            'service_type': ags_service_type
+        }
+
+    # The steps below split publish_sd_draft up so a PublishPipeline can run each one in its own stage
 
-        self.message("Publishing " + input_path)
-        analysis = self._get_method_by_service_type(service_type)(config_entry, filename, sddraft)
-        if self.analysis_successful(analysis['errors']):  # This may throw an exception
-            self.publish_sd_draft(sddraft, sd, service_name, folder_name, initial_state, json)
-            self.message(input_path + " published successfully")
+    def stage_service(self, job):
+        if not job.get('staged'):
+            with self.timer.phase('stage'):
+                self.arcpy_helper.stage_service_definition(sddraft=job['sddraft'], sd=job['sd'])
+            if job.get('artifact_key'):
+                self.artifact_cache.put(job['artifact_key'], job['sd'])
+            job['staged'] = True
+        if not job.get('resumed'):
+            self._journal(job, 'staged', sd=job['sd'], replace=job.get('replace', False))
+        self.timer.record_file_size('sd_size', job['sd'])
+        return job
+
+    def upload_service(self, job):
+        # Uploads through the admin API rather than arcpy, so an upload can run while arcpy stages the next service.
+        # The publishing job always starts the service, so its start isn't deferred with --batch-start.
+        job['initial_state'] = self.replace_service(
+            job['service_name'], job['folder_name'], job['service_type'], job['initial_state'],
+            lambda initial_state: self.api.upload_service_definition(job['sd'], timeout=self.publish_timeout),
+            job.get('replace', False),
+            can_upload_stopped=False)
+        job['uploaded'] = True
+        self._journal(job, 'uploaded')
+        return job
+
+    def configure_service(self, job):
+        if job['json']:
+            self.update_service(service_name=job['service_name'], json=job['json'], folder_name=job['folder_name'],
+                                service_type=job['service_type'])
+        # Services published through the admin API always come up started
+        if job['initial_state'] == 'STOPPED':
+            with self.timer.phase('stop'):
+                self.api.stop_service(service_name=job['service_name'], folder=job['folder_name'],
+                                      service_type=job['service_type'])
+        return job
 
     def _get_publishing_params_from_config(self, config_entry):
         input_path = config_entry['input']
@@ -85,12 +544,7 @@ class Publisher:
 
     @staticmethod
     def _get_service_name_from_config(config_entry):
-        if "serviceName" in config_entry:
-            return config_entry['serviceName']
-        elif 'json' in config_entry and 'serviceName' in config_entry['json']:
-            return config_entry['json']['serviceName']
-        else:
-            return os.path.splitext(os.path.split(config_entry["input"])[1])[0]
+        return ServiceIndex.get_service_name(config_entry)
 
     def _get_service_definition_paths(self, input_path, output_path):
         filename = os.path.splitext(os.path.split(input_path)[1])[0]
@@ -100,7 +554,7 @@ class Publisher:
         return filename, sddraft, sd
 
     def _create_output_directory(self, output_path):
-        output_directory = self.arcpy_helper.get_full_path(output_path)
+        output_directory = self.get_full_path(output_path)
         if not os.path.exists(output_directory):
             os.makedirs(output_directory)
         return output_directory
@@ -114,27 +568,193 @@ class Publisher:
             return self.arcpy_helper.publish_gp
         raise ValueError('Invalid type: ' + service_type)
 
-    def publish_sd_draft(self, path_to_sddraft, path_to_sd, service_name, folder_name=None, initial_state='STARTED', json=None):
-        self.arcpy_helper.stage_service_definition(sddraft=path_to_sddraft, sd=path_to_sd)
-        self.delete_service(service_name=service_name, folder_name=folder_name)
-        self.arcpy_helper.upload_service_definition(sd=path_to_sd, initial_state=initial_state)
+    def publish_sd_draft(self, path_to_sddraft, path_to_sd, service_name, folder_name=None, initial_state='STARTED',
+                         json=None, service_type='MapServer', staged=False, replace=False):
+        if not staged:
+            with self.timer.phase('stage'):
+                self.arcpy_helper.stage_service_definition(sddraft=path_to_sddraft, sd=path_to_sd)
+            self.timer.record_file_size('sd_size', path_to_sd)
+        self.replace_service(
+            service_name, folder_name, service_type, initial_state,
+            lambda initial_state: self.arcpy_helper.upload_service_definition(sd=path_to_sd,
+                                                                              initial_state=initial_state),
+            replace)
         if json:
-            self.update_service(service_name=service_name, json=json, folder_name=folder_name)
+            self.update_service(service_name=service_name, json=json, folder_name=folder_name,
+                                service_type=service_type)
+
+    def replace_service(self, service_name, folder_name, service_type, initial_state, upload, replace=False,
+                        can_upload_stopped=True):
+        # Puts a new copy of a service on the server with upload(initial_state). While an existing service is
+        # overwritten (or replaced, with measure_downtime), its availability is watched, so the time clients couldn't
+        # reach it can be reported.
+        monitor = None
+        started = False
+        if (replace or self.measure_downtime) and self.inventory.exists(service_name, folder_name, service_type):
+            monitor = AvailabilityMonitor(lambda: self.api.is_service_started(service_name, folder_name,
+                                                                              service_type)).start()
+        try:
+            if not replace:
+                self.delete_service(service_name=service_name, folder_name=folder_name, service_type=service_type)
+            # An overwritten service stays live until its upload, so it's never held back for the batch start
+            if self.batch_start and initial_state == 'STARTED' and can_upload_stopped and not replace:
+                initial_state = 'STOPPED'
+                self._defer_start(service_name, folder_name, service_type)
+            with self.timer.phase('upload'):
+                upload(initial_state)
+            self.inventory.add(service_name, folder_name, service_type)
+            if monitor and initial_state == 'STARTED':
+                with self.timer.phase('wait'):
+                    started = self.api.wait_for_service(service_name, folder_name, service_type,
+                                                        timeout=self.start_timeout)
+                if not started:
+                    # It was published; it may just be slow to start its instances
+                    self.message("{0} hadn't started {1}s after it was {2}; carrying on".format(
+                        service_name, self.start_timeout, 'overwritten' if replace else 'replaced'))
+        finally:
+            if monitor:
+                # A service left stopped (or a failed upload) is still down once this returns
+                unavailable = monitor.stop(available=started)
+                self.timer.set('unavailable', unavailable)
+                self.message("{0} was unavailable for {1:.1f}s while it was {2}".format(
+                    service_name, unavailable, 'overwritten' if replace else 'replaced'))
+        return initial_state
+
+    def _defer_start(self, service_name, folder_name, service_type):
+        self.queue_deferred_starts([{
+            'service_name': service_name,
+            'folder': folder_name,
+            'service_type': service_type
+        }])
 
-    def delete_service(self, service_name, folder_name=None):
-        service_exists = self.api.service_exists(service_name=service_name, folder=folder_name)
-        if service_exists['exists']:
+    def queue_deferred_starts(self, services):
+        if services and self._first_deferred_upload is None:
+            self._first_deferred_upload = default_timer()
+        self._deferred_starts.extend(services)
+
+    def pop_deferred_starts(self):
+        services, self._deferred_starts = self._deferred_starts, []
+        return services
+
+    def start_deferred_services(self):
+        if not self._deferred_starts:
+            return None
+        services = self.pop_deferred_starts()
+        group_size = int(self.batch_start)
+        self.message("Starting {0} services, {1} at a time...".format(len(services), group_size))
+        start = default_timer()
+        for i in range(0, len(services), group_size):
+            self.api.start_services(services[i:i + group_size])
+        finish = default_timer()
+        timings = {
+            'services': len(services),
+            'start_duration': finish - start,
+            'time_to_all_available': finish - self._first_deferred_upload
+        }
+        self._first_deferred_upload = None
+        self.message("Started {services} services in {start_duration:.1f}s; all were available "
+                     "{time_to_all_available:.1f}s after the first upload".format(**timings))
+        return timings
+
+    def delete_service(self, service_name, folder_name=None, service_type='MapServer'):
+        if self.inventory.exists(service_name, folder_name, service_type):
             self.message("Deleting old service...")
-            self.api.delete_service(service_name=service_name, folder=folder_name)
+            with self.timer.phase('delete'):
+                self.api.delete_service(service_name=service_name, folder=folder_name, service_type=service_type)
+            self.inventory.remove(service_name, folder_name, service_type)
+
+    def update_service(self, service_name, folder_name=None, json=None, service_type='MapServer'):
+        with self.timer.phase('edit'):
+            current_json = self.api.get_service_params(service_name=service_name, folder=folder_name,
+                                                       service_type=service_type)
+            new_json, changes = self._get_json_changes(service_name, current_json, json)
+            if changes:
+                self.api.edit_service(service_name=service_name, folder=folder_name, params=new_json,
+                                      service_type=service_type)
+        return changes
 
-    def update_service(self, service_name, folder_name=None, json=None):
-        default_json = self.api.get_service_params(service_name=service_name, folder=folder_name)
-        json = self.config_parser.merge_json(default_json, json if json else {})
-        self.api.edit_service(service_name=service_name, folder=folder_name, params=json)
+    def update_json(self, inputs=None):
+        # Re-apply json overrides to services that already exist, without staging anything
+        targets = []
+        for service_type, config_entry in self.get_service_entries(inputs):
+            input_path, output_path, service_name, folder_name, json, initial_state = \
+                self._get_publishing_params_from_config(config_entry)
+            ags_service_type = self.config_parser.ags_service_types[service_type]
+            if not json:
+                continue
+            if not self.inventory.exists(service_name, folder_name, ags_service_type):
+                self.message("Skipping " + service_name + ", service does not exist")
+                continue
+            targets.append(({'service_name': service_name, 'folder': folder_name, 'service_type': ags_service_type},
+                            json))
+
+        current_jsons = self.api.get_params_many([target for target, json in targets])
+        edits = []
+        for (target, json), current_json in zip(targets, current_jsons):
+            new_json, changes = self._get_json_changes(target['service_name'], current_json, json)
+            if changes:
+                edit = target.copy()
+                edit['params'] = new_json
+                edits.append(edit)
+        self.api.edit_many(edits)
+        return [edit['service_name'] for edit in edits]
+
+    def _get_json_changes(self, service_name, current_json, json):
+        new_json = self.config_parser.merge_json(current_json, json if json else {})
+        changes = self.config_parser.diff_json(current_json, new_json)
+        if changes:
+            self.message("Updating {0}: {1}".format(service_name, ', '.join(key for key, old, new in changes)))
+        else:
+            self.message("No changes to {0}, skipping edit".format(service_name))
+        return new_json, changes
+
+    def resolve_inputs(self, inputs):
+        for input_value in inputs:
+            if not self.index.find(input_value):
+                raise ValueError('Input ' + input_value + ' was not found in config.')
+        return self.get_service_entries(inputs)
+
+    def get_service_entries(self, inputs=None):
+        if inputs is None:
+            return list(self.index.entries)
+        entries = []
+        seen = set()
+        for input_value in inputs:
+            for service_type, config_entry in self.index.find(input_value):
+                # Two inputs can name the same entry, e.g. by path and by service name
+                if id(config_entry) not in seen:
+                    seen.add(id(config_entry))
+                    entries.append((service_type, config_entry))
+        return entries
 
     def register_data_sources(self):
-        if "dataSources" in self.config:
-            self.arcpy_helper.register_data_sources(self.config["dataSources"])
+        if "dataSources" not in self.config:
+            return []
+        data_sources = self.config["dataSources"]
+        cache = self.data_source_cache
+        if cache is not None:
+            data_sources = [data_source for data_source in data_sources if not cache.is_registered(data_source)]
+        if not data_sources:
+            self.message("Data sources are already registered")
+            return []
+
+        parent_paths = sorted(set(get_item_path(data_source).rsplit('/', 1)[0] for data_source in data_sources))
+        registered = set(item['path'] for response in self.api.find_data_items_many(parent_paths)
+                         for item in response.get('items', []))
+        missing = [data_source for data_source in data_sources if get_item_path(data_source) not in registered]
+
+        # Folders register over REST, all at once; a database needs arcpy to read its connection file
+        self.api.register_data_items_many([create_folder_item(data_source, self.get_full_path)
+                                           for data_source in missing if not is_database(data_source)])
+        for data_source in missing:
+            if is_database(data_source):
+                self.arcpy_helper.register_data_source(data_source)
+        for data_source in missing:
+            self.message("Registered data source " + data_source['name'])
+
+        if cache is not None:
+            cache.record(data_sources)
+        return [data_source['name'] for data_source in missing]
 
     @staticmethod
     def message(message):
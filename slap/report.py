@@ -0,0 +1,99 @@
+import json
+from slap.cache import write_atomic
+from slap.history import format_duration
+from slap.timing import PhaseTimer
+
+
+def create_report(shard, records, skipped, started, finished, error=None):
+    # shard: Publisher.shard, or None for a run that wasn't sharded
+    by_service = dict((record['service'], record) for record in records)
+    services = shard['services'] if shard else [record['service'] for record in records] + skipped
+    results = []
+    for service in services:
+        record = by_service.get(service)
+        if record is not None:
+            status = 'published' if record['ok'] else 'failed'
+        else:
+            status = 'skipped' if service in skipped else 'not published'
+        results.append({
+            'service': service, 'status': status,
+            'error': record['error'] if record is not None else None,
+            'total': record['total'] if record is not None else None
+        })
+    return {
+        'version': 1,
+        'shard': shard['index'] if shard else 1,
+        'shards': shard['count'] if shard else 1,
+        'plan': shard['plan'] if shard else None,
+        'started': started,
+        'duration': finished - started,
+        'error': error,
+        'services': results,
+        'timings': records
+    }
+
+
+def write_report(path, report):
+    write_atomic(path, json.dumps(report, indent=2, sort_keys=True))
+
+
+def load_report(path):
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+def merge_reports(reports):
+    counts = set(report['shards'] for report in reports)
+    plans = sorted(set(report['plan'] for report in reports))
+    seen = [report['shard'] for report in reports]
+    missing = sorted(set(range(1, max(counts) + 1)) - set(seen)) if counts else []
+    services = [dict(result, shard=report['shard'])
+                for report in sorted(reports, key=lambda report: report['shard']) for result in report['services']]
+    problems = []
+    if len(counts) > 1 or len(plans) > 1:
+        problems.append('Shards were split differently (plans {0}); run every shard from the same config and '
+                        'history'.format(', '.join(str(plan) for plan in plans)))
+    if missing:
+        problems.append('Missing shard(s): {0}'.format(', '.join(str(shard) for shard in missing)))
+    duplicates = sorted(set(shard for shard in seen if seen.count(shard) > 1))
+    if duplicates:
+        problems.append('Shard(s) reported more than once: {0}'.format(', '.join(str(shard) for shard in duplicates)))
+    for report in reports:
+        if report['error']:
+            problems.append('Shard {0} stopped: {1}'.format(report['shard'], report['error']))
+    return {
+        'version': 1,
+        'shards': sorted(({'shard': report['shard'], 'plan': report['plan'], 'started': report['started'],
+                           'duration': report['duration'], 'error': report['error']} for report in reports),
+                         key=lambda shard: shard['shard']),
+        'problems': problems,
+        'ok': not problems and all(result['status'] in ('published', 'skipped') for result in services),
+        'services': services,
+        'timings': [record for report in reports for record in report['timings']]
+    }
+
+
+def format_merged(merged):
+    lines = ['{0:<8}{1:>10}{2:>11}{3:>8}{4:>9}{5:>15}{6:>12}'.format(
+        'shard', 'services', 'published', 'failed', 'skipped', 'not published', 'duration')]
+    for shard in merged['shards']:
+        statuses = [result['status'] for result in merged['services'] if result['shard'] == shard['shard']]
+        lines.append('{0:<8}{1:>10}{2:>11}{3:>8}{4:>9}{5:>15}{6:>12}'.format(
+            shard['shard'], len(statuses), statuses.count('published'), statuses.count('failed'),
+            statuses.count('skipped'), statuses.count('not published'), format_duration(shard['duration'])))
+    durations = [shard['duration'] for shard in merged['shards']]
+    if durations and sum(durations):
+        lines.append('Longest shard took {0}, {1:.2f}x the average'.format(
+            format_duration(max(durations)), float(max(durations)) * len(durations) / sum(durations)))
+
+    failures = [result for result in merged['services'] if result['status'] == 'failed']
+    if failures:
+        lines.append('Failed:')
+        lines.extend('  {0} (shard {1}): {2}'.format(result['service'], result['shard'], result['error'])
+                     for result in failures)
+    lines.extend(merged['problems'])
+    if merged['timings']:
+        timer = PhaseTimer()
+        timer.add_records(merged['timings'])
+        lines.append(timer.format_summary())
+    return '\n'.join(lines)
@@ -0,0 +1,85 @@
+import time
+import random
+import threading
+import calendar
+from email.utils import parsedate_tz, mktime_tz
+import requests
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+
+class RetryPolicy:
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=30, jitter=True,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = retry_statuses
+        self.sleep = time.sleep
+
+    def is_retryable(self, error):
+        if isinstance(error, CircuitOpenError):
+            return False
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code in self.retry_statuses
+        return False
+
+    def get_backoff(self, attempt, error=None):
+        retry_after = self.get_retry_after(error)
+        if retry_after is not None:
+            # Never wait longer than max_backoff, whatever the server asks for
+            return min(self.max_backoff, retry_after)
+        delay = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        # "Full jitter" keeps many clients from retrying in lock step
+        return random.uniform(0, delay) if self.jitter else delay
+
+    @staticmethod
+    def get_retry_after(error):
+        response = getattr(error, 'response', None)
+        if response is None or not response.headers.get('Retry-After'):
+            return None
+        value = response.headers['Retry-After'].strip()
+        if value.isdigit():
+            return float(value)
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, mktime_tz(parsed) - calendar.timegm(time.gmtime()))
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = time.time
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None and self.clock() < self._opened_at + self.reset_timeout
+
+    def before_call(self):
+        # Once reset_timeout has passed, calls go through again; one more failure re-opens the circuit
+        if self.is_open:
+            raise CircuitOpenError('Server appears to be down after {0} consecutive failures; '
+                                   'not retrying for {1} seconds'.format(self._failures, self.reset_timeout))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
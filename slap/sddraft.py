@@ -0,0 +1,15 @@
+from xml.dom import minidom
+from slap.cache import write_atomic
+
+
+def set_replacement(path):
+    # Turns a draft for a new service into one that overwrites the existing service in place, so it never has
+    # to be deleted first; see "Modify SDDraft example 7" in the arcpy docs
+    document = minidom.parse(path)
+    for element in document.getElementsByTagName('Type'):
+        if element.firstChild is not None and element.firstChild.data == 'esriServiceDefinitionType_New':
+            element.firstChild.data = 'esriServiceDefinitionType_Replacement'
+    for element in document.getElementsByTagName('State'):
+        if element.firstChild is not None and element.firstChild.data == 'esriSDState_Unpublished':
+            element.firstChild.data = 'esriSDState_Published'
+    write_atomic(path, document.toxml(encoding='utf-8'))
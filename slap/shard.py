@@ -0,0 +1,35 @@
+import json
+import heapq
+import hashlib
+
+
+def get_costs(estimates, sizes):
+    # Seconds from history where there is some, the rest from input size at the rate the known services published.
+    # Without any history, input size alone.
+    known = [(estimate['total'], size) for estimate, size in zip(estimates, sizes) if estimate is not None]
+    if known:
+        sized = [(total, size) for total, size in known if size]
+        rate = sum(total for total, size in sized) / sum(size for total, size in sized) if sized else None
+        typical = sum(total for total, size in known) / len(known)
+        return [estimate['total'] if estimate is not None else size * rate if size and rate else typical
+                for estimate, size in zip(estimates, sizes)]
+    known_sizes = [size for size in sizes if size]
+    typical = float(sum(known_sizes)) / len(known_sizes) if known_sizes else 1.0
+    return [float(size) if size else typical for size in sizes]
+
+
+def assign_shards(costs, count):
+    # Costliest first onto the least loaded shard. Ties go to the earlier item and the lower shard, so every runner
+    # works out the same split from the same costs.
+    loads = [(0.0, shard) for shard in range(count)]
+    assignments = [None] * len(costs)
+    for index in sorted(range(len(costs)), key=lambda index: (-costs[index], index)):
+        load, shard = heapq.heappop(loads)
+        assignments[index] = shard
+        heapq.heappush(loads, (load + costs[index], shard))
+    return assignments
+
+
+def get_plan_id(keys, assignments):
+    # The same for every shard of a split, so merged reports can tell if runners split the config differently
+    return hashlib.sha256(json.dumps(sorted(zip(keys, assignments)))).hexdigest()[:12]
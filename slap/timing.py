@@ -0,0 +1,176 @@
+import os
+import csv
+import json
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+from slap.cache import write_atomic
+from slap.profiling import span
+
+PHASES = ['workspaces', 'draft', 'analyze', 'stage', 'delete', 'upload', 'wait', 'edit', 'stop']
+
+
+class PhaseTimer:
+    # Times each publishing phase against whichever service the current thread is working on
+
+    def __init__(self):
+        self._records = {}
+        self._order = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def service(self, service, input_path=None):
+        record = self._get_record(service, input_path)
+        previous = getattr(self._local, 'record', None)
+        self._local.record = record
+        start = default_timer()
+        try:
+            with span(service, 'service'):
+                yield record
+        except Exception as e:
+            record.update(ok=False, error='{0}: {1}'.format(type(e).__name__, e))
+            raise
+        finally:
+            with self._lock:
+                record['total'] += default_timer() - start
+            self._local.record = previous
+
+    @contextmanager
+    def phase(self, name):
+        start = default_timer()
+        try:
+            with span(name, 'phase'):
+                yield
+        finally:
+            record = getattr(self._local, 'record', None)
+            # Calls made outside of a service, like registering data sources, aren't reported
+            if record is not None:
+                with self._lock:
+                    record['phases'][name] = record['phases'].get(name, 0) + default_timer() - start
+
+    def set(self, key, value):
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record[key] = value
+
+    def record_file_size(self, key, path):
+        if path and os.path.isfile(path):
+            self.set(key, os.path.getsize(path))
+
+    def _get_record(self, service, input_path):
+        with self._lock:
+            if service not in self._records:
+                self._records[service] = {
+                    'service': service, 'input': input_path, 'ok': True, 'error': None,
+                    'input_size': None, 'sd_size': None, 'unavailable': None, 'total': 0.0, 'phases': {}
+                }
+                self._order.append(service)
+            return self._records[service]
+
+    @property
+    def records(self):
+        with self._lock:
+            return [self._records[service] for service in self._order]
+
+    def add_records(self, records):
+        # Merges timings sent back from worker processes
+        for record in records:
+            with self._lock:
+                if record['service'] not in self._records:
+                    self._order.append(record['service'])
+                self._records[record['service']] = record
+
+    def pop_records(self):
+        with self._lock:
+            records = [self._records[service] for service in self._order]
+            self._records = {}
+            self._order = []
+            return records
+
+    def write(self, path):
+        if os.path.splitext(path)[1].lower() == '.csv':
+            self.write_csv(path)
+        else:
+            write_atomic(path, json.dumps({'services': self.records}, indent=2, sort_keys=True))
+
+    def write_csv(self, path):
+        columns = ['service', 'input', 'ok', 'error', 'input_size', 'sd_size', 'unavailable', 'total']
+        with open(path, 'wb') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(columns + PHASES)
+            for record in self.records:
+                writer.writerow([record[column] for column in columns] +
+                                [record['phases'].get(phase, '') for phase in PHASES])
+
+    def format_summary(self, limit=10):
+        records = self.records
+        lines = ['Slowest services:', '{0:<40}{1:>10}  {2}'.format('service', 'total (s)', 'slowest phase')]
+        for record in sorted(records, key=lambda record: record['total'], reverse=True)[:limit]:
+            phases = record['phases']
+            slowest = max(phases, key=phases.get) if phases else None
+            lines.append('{0:<40}{1:>10.1f}  {2}'.format(
+                record['service'], record['total'],
+                '{0} ({1:.1f}s)'.format(slowest, phases[slowest]) if slowest else '-'))
+
+        totals = {}
+        for record in records:
+            for phase, duration in record['phases'].items():
+                totals[phase] = totals.get(phase, 0) + duration
+        replaced = [record for record in records if record.get('unavailable') is not None]
+        if replaced:
+            lines.append('Unavailable while replaced: {0:.1f}s longest ({1}), {2:.1f}s total over {3} services'.format(
+                max(record['unavailable'] for record in replaced),
+                max(replaced, key=lambda record: record['unavailable'])['service'],
+                sum(record['unavailable'] for record in replaced), len(replaced)))
+        lines.extend(['Time by phase:', '{0:<16}{1:>10}'.format('phase', 'total (s)')])
+        for phase in sorted(totals, key=totals.get, reverse=True):
+            lines.append('{0:<16}{1:>10.1f}'.format(phase, totals[phase]))
+        return '\n'.join(lines)
+
+
+class AvailabilityMonitor:
+    # Polls a service in the background while it is replaced, adding up how long it was seen unavailable
+
+    def __init__(self, is_available, interval=0.5, clock=default_timer):
+        self._is_available = is_available
+        self.interval = interval
+        self.clock = clock
+        self.unavailable = 0.0
+        self._last = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self.record(self._check())
+        self._thread = threading.Thread(target=self._run, name='availability-monitor')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, available=True):
+        # Called once the new service is known to be up, which ends any outage in progress
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.record(available)
+        return self.unavailable
+
+    def record(self, available):
+        # Time between two checks counts as down when the earlier check found the service down
+        with self._lock:
+            now = self.clock()
+            if self._last is not None and not self._last[1]:
+                self.unavailable += now - self._last[0]
+            self._last = (now, available)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.record(self._check())
+
+    def _check(self):
+        try:
+            return self._is_available()
+        except Exception:
+            return False
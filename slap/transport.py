@@ -0,0 +1,149 @@
+import os
+import json
+import threading
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+class SessionTransport:
+
+    def __init__(self, pool_size=10):
+        self.session = self.create_session(pool_size)
+
+    @staticmethod
+    def create_session(pool_size):
+        # A single keep-alive session, so repeated admin calls reuse the same TCP/TLS connection
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def send(self, method, url, params, verify, timeout, files=None):
+        if method == 'GET':
+            return self.session.get(url, params=params, verify=verify, timeout=timeout)
+        if files:
+            return self.session.post(url, data=params, files=files, verify=verify, timeout=timeout)
+        return self.session.post(url, data=params, verify=verify, timeout=timeout)
+
+    def get_connection_pools(self):
+        pools = []
+        for adapter in set(self.session.adapters.values()):
+            pool_manager = adapter.poolmanager
+            pools.extend(pool_manager.pools[key] for key in pool_manager.pools.keys())
+        return pools
+
+    def close(self):
+        self.session.close()
+
+
+class RecordingTransport:
+
+    # Never write credentials to a recording
+    redacted_keys = ['token', 'password', 'confirmPassword']
+
+    def __init__(self, transport, path, append=False):
+        # append: add to a recording another process (e.g. the -j parent) has started
+        self._transport = transport
+        self._path = path
+        self._lock = threading.Lock()
+        if not append:
+            open(self._path, 'w').close()
+
+    def send(self, method, url, params, verify, timeout, files=None):
+        response = self._transport.send(method, url, params, verify, timeout, files)
+        self.record(method, url, params, response)
+        return response
+
+    def record(self, method, url, params, response):
+        exchange = {
+            'method': method,
+            'url': url,
+            'params': self.redact(params),
+            'status': response.status_code,
+            'headers': dict(response.headers),
+            'body': self.redact_body(response.content)
+        }
+        line = json.dumps(exchange, sort_keys=True) + '\n'
+        with self._lock:
+            # A single O_APPEND write, so lines from several processes don't interleave
+            handle = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(handle, line)
+            finally:
+                os.close(handle)
+
+    @classmethod
+    def redact(cls, params):
+        params = params if params else {}
+        return dict((key, '***' if key in cls.redacted_keys else value) for key, value in params.items())
+
+    @staticmethod
+    def redact_body(content):
+        try:
+            body = json.loads(content)
+        except ValueError:
+            return content
+        if isinstance(body, dict) and 'token' in body:
+            body['token'] = 'recorded-token'
+        return json.dumps(body)
+
+    def get_connection_pools(self):
+        return self._transport.get_connection_pools()
+
+    def close(self):
+        self._transport.close()
+
+
+class ReplayTransport:
+
+    def __init__(self, path):
+        self._exchanges = {}
+        self._lock = threading.Lock()
+        with open(path) as recording:
+            for line in recording:
+                if line.strip():
+                    exchange = json.loads(line)
+                    key = self.get_key(exchange['method'], exchange['url'], exchange['params'])
+                    self._exchanges.setdefault(key, []).append(exchange)
+
+    @staticmethod
+    def get_key(method, url, params):
+        params = RecordingTransport.redact(params)
+        return method, url, json.dumps(params, sort_keys=True)
+
+    def send(self, method, url, params, verify, timeout, files=None):
+        key = self.get_key(method, url, params)
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                raise requests.exceptions.ConnectionError('No recorded response for {0} {1}'.format(method, url))
+            # Replay repeated calls in the order they were recorded; keep answering with the last one
+            exchange = exchanges.pop(0) if len(exchanges) > 1 else exchanges[0]
+        return self.create_response(url, exchange)
+
+    @staticmethod
+    def create_response(url, exchange):
+        response = Response()
+        response.url = url
+        response.status_code = exchange['status']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        response._content = exchange['body'].encode('utf-8')
+        return response
+
+    def get_connection_pools(self):
+        return []
+
+    def close(self):
+        pass
+
+
+def create_transport(record=None, replay=None, append=False):
+    # None leaves the Api to create its own SessionTransport
+    if replay:
+        return ReplayTransport(replay)
+    if record:
+        return RecordingTransport(SessionTransport(), record, append)
+    return None
@@ -1,10 +1,25 @@
+import os
 import unittest
 import json
+import tempfile
+import time
+import threading
 import requests
 from requests import Response
 from unittest import TestCase
-from slap.api import Api
-from mock import PropertyMock, patch
+from slap.api import Api, ConcurrentApi, InvalidTokenError
+from slap.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+from slap.limiter import AdaptiveLimiter
+from mock import MagicMock, PropertyMock, patch
+
+INVALID_TOKEN = {'status': 'error', 'messages': ['Invalid token.'], 'code': 498}
+
+
+def create_response(body, status_code=200):
+    response = Response()
+    response.status_code = status_code
+    response._content = json.dumps(body)
+    return response
 
 
 class TestApi(TestCase):
@@ -42,9 +57,8 @@ class TestApi(TestCase):
 
     def test_token(self):
         api = self.create_api()
-        api._token = 'my_token_value'
+        api._token_manager.set_token('my_token_value', time.time() + 3600)
         self.assertEqual(api.token, 'my_token_value')
-        api._token = None
 
     def test_get_token(self):
         with patch('slap.api.Api.post') as mock_post:
@@ -63,20 +77,76 @@ class TestApi(TestCase):
             self.assertEqual(token, token_value)
 
     def test_get(self):
-        with patch('requests.get') as mock_request:
+        with patch('requests.Session.get') as mock_request:
             api = self.create_api()
             url = 'my/url'
             params = {'foo': 'bar'}
             api.get(url=url, params=params)
-            mock_request.assert_called_once_with(url, params=params, verify=api._verify_certs)
+            mock_request.assert_called_once_with(url, params=params, verify=api._verify_certs, timeout=(None, None))
 
     def test_post(self):
-        with patch('requests.post') as mock_request:
+        with patch('requests.Session.post') as mock_request:
             api = self.create_api()
             url = 'my/url'
             params = {'foo': 'bar'}
             api.post(url=url, params=params)
-            mock_request.assert_called_once_with(url, data=params, verify=api._verify_certs)
+            mock_request.assert_called_once_with(url, data=params, verify=api._verify_certs, timeout=(None, None))
+
+    def test_post_with_timeouts(self):
+        with patch('requests.Session.post') as mock_request:
+            api = Api(
+                ags_url='http://myserver/arcgis/admin',
+                token_url=None,
+                portal_url=None,
+                username='user',
+                password='pass',
+                connect_timeout=5,
+                read_timeout=120
+            )
+            api.post(url='my/url', params={})
+            mock_request.assert_called_once_with('my/url', data={}, verify=api._verify_certs, timeout=(5, 120))
+
+    def test_session_is_reused(self):
+        api = self.create_api()
+        session = api.transport.session
+        with patch('requests.Session.post'):
+            api.post(url='my/url', params={})
+            api.post(url='my/url', params={})
+        self.assertIs(session, api.transport.session)
+
+    def test_session_pool_size(self):
+        api = Api(
+            ags_url='http://myserver/arcgis/admin',
+            token_url=None,
+            portal_url=None,
+            username='user',
+            password='pass',
+            pool_size=4
+        )
+        adapter = api.transport.session.get_adapter('https://myserver:6443/arcgis/admin')
+        self.assertEqual(adapter._pool_maxsize, 4)
+
+    def test_connection_stats(self):
+        api = self.create_api()
+        pool = MagicMock(num_requests=5, num_connections=2)
+        with patch('slap.api.Api._get_connection_pools') as mock_pools:
+            mock_pools.return_value = [pool]
+            self.assertEqual(api.connection_stats, {'requests': 5, 'connections': 2, 'reused': 3})
+
+    def test_pop_and_merge_connection_stats(self):
+        api = self.create_api()
+        pool = MagicMock(num_requests=5, num_connections=2)
+        with patch('slap.api.Api._get_connection_pools') as mock_pools:
+            mock_pools.return_value = [pool]
+            self.assertEqual(api.pop_connection_stats(), {'requests': 5, 'connections': 2, 'reused': 3})
+            pool.num_requests = 7
+            self.assertEqual(api.pop_connection_stats(), {'requests': 2, 'connections': 0, 'reused': 2})
+            api.merge_connection_stats({'requests': 4, 'connections': 1, 'reused': 3})
+            self.assertEqual(api.connection_stats, {'requests': 11, 'connections': 3, 'reused': 8})
+
+    def test_connection_stats_without_requests(self):
+        api = self.create_api()
+        self.assertEqual(api.connection_stats, {'requests': 0, 'connections': 0, 'reused': 0})
 
     def test_parse_response_with_bad_return_code(self):
         api = self.create_api()
@@ -90,6 +160,129 @@ class TestApi(TestCase):
         response = {'status': 'error', 'messages': ['an error occurred']}
         self.assertRaises(requests.exceptions.RequestException, api.check_parsed_response, response)
 
+    def test_check_parsed_response_with_invalid_token(self):
+        api = self.create_api()
+        response = {'status': 'error', 'messages': ['Invalid token.'], 'code': 498}
+        self.assertRaises(InvalidTokenError, api.check_parsed_response, response)
+
+    def test_check_parsed_response_with_error_object(self):
+        api = self.create_api()
+        response = {'error': {'code': 400, 'message': 'Unable to generate token.'}}
+        self.assertRaises(requests.exceptions.RequestException, api.check_parsed_response, response)
+
+    def test_retries_once_with_new_token_when_token_is_invalid(self):
+        api = self.create_api()
+        api._token_manager.set_token('old_token', time.time() + 3600)
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = [create_response(INVALID_TOKEN), create_response({'token': 'new_token'}),
+                                     create_response({'foo': 'bar'})]
+            actual = api.post('my/url', {'token': 'old_token', 'f': 'json'})
+        self.assertEqual(actual, {'foo': 'bar'})
+        mock_send.assert_called_with('POST', 'my/url', {'token': 'new_token', 'f': 'json'}, None)
+
+    def test_does_not_retry_twice_when_token_is_invalid(self):
+        api = self.create_api()
+        api._token_manager.set_token('old_token', time.time() + 3600)
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = [create_response(INVALID_TOKEN), create_response({'token': 'new_token'}),
+                                     create_response(INVALID_TOKEN)]
+            self.assertRaises(InvalidTokenError, api.post, 'my/url', {'token': 'old_token'})
+
+    @staticmethod
+    def create_retrying_api(max_retries=2, failure_threshold=5):
+        policy = RetryPolicy(max_retries=max_retries, jitter=False)
+        policy.sleep = MagicMock()
+        return Api(
+            ags_url='http://myserver/arcgis/admin',
+            token_url=None,
+            portal_url=None,
+            username='user',
+            password='pass',
+            retry_policy=policy,
+            circuit_breaker=CircuitBreaker(failure_threshold=failure_threshold)
+        )
+
+    def test_retries_idempotent_calls(self):
+        api = self.create_retrying_api()
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = [requests.exceptions.ConnectionError(), create_response({'exists': True})]
+            actual = api.post('http://myserver/arcgis/admin/services/exists/exists', {})
+        self.assertEqual(actual, {'exists': True})
+        self.assertEqual(api.retry_stats, {'exists': {'retries': 1, 'backoff': 0.5}})
+        api._retry_policy.sleep.assert_called_once_with(0.5)
+
+    def test_gives_up_after_max_retries(self):
+        api = self.create_retrying_api(max_retries=2)
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = requests.exceptions.ConnectionError()
+            self.assertRaises(requests.exceptions.ConnectionError, api.get,
+                              'http://myserver/arcgis/admin/services/myService.MapServer', {})
+            self.assertEqual(mock_send.call_count, 3)
+        self.assertEqual(api.retry_stats['service']['retries'], 2)
+
+    def test_does_not_retry_non_idempotent_calls(self):
+        api = self.create_retrying_api()
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = requests.exceptions.ConnectionError()
+            self.assertRaises(requests.exceptions.ConnectionError, api.post,
+                              'http://myserver/arcgis/admin/services/myService.MapServer/delete', {})
+            mock_send.assert_called_once()
+
+    def test_does_not_retry_application_errors(self):
+        api = self.create_retrying_api()
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = requests.exceptions.RequestException('Service not found')
+            self.assertRaises(requests.exceptions.RequestException, api.get,
+                              'http://myserver/arcgis/admin/services/myService.MapServer', {})
+            mock_send.assert_called_once()
+
+    def test_circuit_breaker_stops_calls(self):
+        api = self.create_retrying_api(max_retries=5, failure_threshold=2)
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = requests.exceptions.ConnectionError()
+            self.assertRaises(requests.exceptions.ConnectionError, api.get, 'http://myserver/arcgis/admin/services', {})
+            self.assertEqual(mock_send.call_count, 2)
+            self.assertRaises(CircuitOpenError, api.get, 'http://myserver/arcgis/admin/services', {})
+            self.assertEqual(mock_send.call_count, 2)
+
+    def test_records_metrics(self):
+        api = self.create_retrying_api()
+        with patch('slap.api.Api._send') as mock_send:
+            mock_send.side_effect = [
+                requests.exceptions.ConnectionError(),
+                create_response({'exists': True}),
+                create_response({'status': 'error', 'messages': ['Service not found']}),
+                create_response({}, 502)
+            ]
+            api.post('http://myserver/arcgis/admin/services/exists/exists', {})
+            self.assertRaises(requests.exceptions.RequestException, api.post,
+                              'http://myserver/arcgis/admin/services/myService.MapServer/delete', {})
+            self.assertRaises(requests.exceptions.HTTPError, api.post,
+                              'http://myserver/arcgis/admin/services/myService.MapServer/delete', {})
+        summary = api.metrics.summary()
+        self.assertEqual(summary['exists']['count'], 1)
+        self.assertEqual(summary['exists']['retries'], 1)
+        self.assertEqual(summary['exists']['statuses'], {200: 1})
+        self.assertEqual(summary['exists']['bytes'], len('{"exists": true}'))
+        self.assertEqual(summary['delete']['count'], 2)
+        self.assertEqual(summary['delete']['errors'], 2)
+        self.assertEqual(summary['delete']['statuses'], {200: 1, 502: 1})
+
+    def test_get_operation(self):
+        base = 'http://myserver/arcgis/admin'
+        self.assertEqual(Api.get_operation('POST', 'http://myserver/arcgis/tokens/generateToken'), 'generateToken')
+        self.assertEqual(Api.get_operation('POST', base + '/services/exists/exists'), 'exists')
+        self.assertEqual(Api.get_operation('POST', base + '/services/folder/name.MapServer/edit'), 'edit')
+        self.assertEqual(Api.get_operation('POST', base + '/services/name.MapServer/delete'), 'delete')
+        self.assertEqual(Api.get_operation('GET', base + '/services/folder/name.MapServer'), 'service')
+        self.assertEqual(Api.get_operation('GET', base + '/services/'), 'services')
+        self.assertEqual(Api.get_operation('GET', base + '/services/folder'), 'services')
+        self.assertEqual(Api.get_operation('POST', base + '/createNewSite'), 'createNewSite')
+        self.assertEqual(Api.get_operation('POST', base + '/uploads/register'), 'register')
+        self.assertEqual(Api.get_operation('POST', base + '/uploads/i1/uploadPart'), 'uploadPart')
+        self.assertEqual(Api.get_operation('GET', 'http://myserver/arcgis/rest/services/System/PublishingTools/'
+                                                  'GPServer/Publish%20Service%20Definition/jobs/j1'), 'job')
+
     def test_check_parsed_token_response(self):
         api = self.create_api()
         response = {'messages': ['an error occurred']}  # no 'status'
@@ -163,6 +356,145 @@ class TestApi(TestCase):
                         'type': 'MapServer'},
                        'myService', 'myFolder')
 
+    def test_list_root_services(self):
+        self.get_mock('http://myserver/arcgis/admin/services/', 'list_services')
+
+    def test_list_folder_services(self):
+        self.get_mock('http://myserver/arcgis/admin/services/myFolder', 'list_services', 'myFolder')
+
+    def test_start_services(self):
+        self.post_mock('http://myserver/arcgis/admin/services/startServices',
+                       'start_services',
+                       {'f': 'json', 'token': 'my_token_value', 'services': json.dumps({'services': [
+                           {'folderName': 'myFolder', 'serviceName': 'a', 'type': 'MapServer'},
+                           {'folderName': '', 'serviceName': 'b', 'type': 'ImageServer'}
+                       ]})},
+                       [{'service_name': 'a', 'folder': 'myFolder', 'service_type': 'MapServer'},
+                        {'service_name': 'b', 'folder': None, 'service_type': 'ImageServer'}])
+
+    def test_stop_service(self):
+        self.post_mock('http://myserver/arcgis/admin/services/myFolder/myService.MapServer/stop',
+                       'stop_service',
+                       {'f': 'json', 'token': 'my_token_value'},
+                       'myService', 'myFolder')
+
+    def test_get_service_status(self):
+        self.get_mock('http://myserver/arcgis/admin/services/myFolder/myService.MapServer/status',
+                      'get_service_status',
+                      'myService', 'myFolder')
+
+    def test_wait_for_service(self):
+        api = self.create_api()
+        with patch('slap.api.Api.get_service_status') as mock_status:
+            mock_status.side_effect = [{'realTimeState': 'STOPPED'}, {'realTimeState': 'STARTED'}]
+            self.assertTrue(api.wait_for_service('myService', 'myFolder', poll_interval=0))
+            self.assertEqual(mock_status.call_count, 2)
+
+    def test_wait_for_service_times_out(self):
+        api = self.create_api()
+        with patch('slap.api.Api.get_service_status') as mock_status:
+            mock_status.return_value = {'realTimeState': 'STOPPED'}
+            self.assertFalse(api.wait_for_service('myService', timeout=0, poll_interval=0))
+
+    def test_rest_url(self):
+        self.assertEqual(self.create_api().rest_url, 'http://myserver/arcgis/rest')
+
+    def test_publish_item(self):
+        self.post_mock('http://myserver/arcgis/rest/services/System/PublishingTools/GPServer/'
+                       'Publish%20Service%20Definition/submitJob',
+                       'publish_item',
+                       {'f': 'json', 'token': 'my_token_value', 'in_sdp_id': 'item1'},
+                       'item1')
+
+    def test_register_data_item(self):
+        item = {'type': 'folder', 'path': '/fileShares/data', 'info': {'path': '/data'}}
+        self.post_mock('http://myserver/arcgis/admin/data/registerItem',
+                       'register_data_item',
+                       {'f': 'json', 'token': 'my_token_value', 'item': json.dumps(item)},
+                       item)
+
+    def test_upload_item_in_parts(self):
+        api = self.create_api()
+        api.upload_part_size = 4
+        sd = tempfile.NamedTemporaryFile(suffix='.sd', delete=False)
+        sd.write('0123456789')
+        sd.close()
+        try:
+            with patch('slap.api.Api.post') as mock_post:
+                with patch('slap.api.Api.token', new_callable=PropertyMock) as mock_token:
+                    mock_token.return_value = 'my_token_value'
+                    mock_post.return_value = {'item': {'itemID': 'i1'}}
+                    api.upload_item(sd.name)
+        finally:
+            os.remove(sd.name)
+        base = 'http://myserver/arcgis/admin/uploads/'
+        name = os.path.basename(sd.name)
+        self.assertEqual([c[0][0] for c in mock_post.call_args_list],
+                         [base + 'register'] + [base + 'i1/uploadPart'] * 3 + [base + 'i1/commit'])
+        self.assertEqual([c[1]['files']['partFile'] for c in mock_post.call_args_list[1:4]],
+                         [(name, '0123'), (name, '4567'), (name, '89')])
+        self.assertEqual([c[0][1]['partNumber'] for c in mock_post.call_args_list[1:4]], ['1', '2', '3'])
+        self.assertEqual(mock_post.call_args_list[4][0][1]['parts'], '1,2,3')
+
+    def test_upload_part_is_resent_in_full_after_invalid_token(self):
+        api = self.create_api()
+        sent = []
+        responses = [create_response(INVALID_TOKEN), create_response({'status': 'success'})]
+
+        def send(method, url, params, verify, timeout, files=None):
+            sent.append(files['partFile'][1])
+            return responses.pop(0)
+        api._transport = MagicMock()
+        api._transport.send.side_effect = send
+        with patch('slap.api.Api.token', new_callable=PropertyMock) as mock_token:
+            mock_token.return_value = 'my_token_value'
+            with patch.object(api._token_manager, 'refresh', return_value='new_token'):
+                api.upload_part('i1', '1', 'my.sd', 'content')
+        self.assertEqual(sent, ['content', 'content'])
+
+    def test_upload_service_definition(self):
+        api = self.create_api()
+        with patch('slap.api.Api.upload_item') as mock_upload:
+            with patch('slap.api.Api.publish_item') as mock_publish:
+                with patch('slap.api.Api.get_publishing_job') as mock_job:
+                    with patch('slap.api.time.sleep'):
+                        mock_upload.return_value = {'item': {'itemID': 'item1'}}
+                        mock_publish.return_value = {'jobId': 'j1', 'jobStatus': 'esriJobSubmitted'}
+                        mock_job.side_effect = [{'jobId': 'j1', 'jobStatus': 'esriJobExecuting'},
+                                                {'jobId': 'j1', 'jobStatus': 'esriJobSucceeded'}]
+                        job = api.upload_service_definition('my.sd')
+                        mock_upload.assert_called_once_with('my.sd')
+                        mock_publish.assert_called_once_with('item1')
+                        self.assertEqual(mock_job.call_count, 2)
+                        self.assertEqual(job['jobStatus'], 'esriJobSucceeded')
+
+    def test_upload_service_definition_raises_when_job_fails(self):
+        api = self.create_api()
+        with patch('slap.api.Api.upload_item') as mock_upload:
+            with patch('slap.api.Api.publish_item') as mock_publish:
+                mock_upload.return_value = {'item': {'itemID': 'item1'}}
+                mock_publish.return_value = {'jobId': 'j1', 'jobStatus': 'esriJobFailed',
+                                             'messages': [{'type': 'esriJobMessageTypeError',
+                                                           'description': 'Service already exists'}]}
+                with self.assertRaises(requests.exceptions.RequestException) as context:
+                    api.upload_service_definition('path/my.sd')
+                self.assertIn('Service already exists', str(context.exception))
+
+    def test_upload_service_definition_times_out(self):
+        api = self.create_api()
+        with patch('slap.api.Api.upload_item') as mock_upload:
+            with patch('slap.api.Api.publish_item') as mock_publish:
+                with patch('slap.api.Api.get_publishing_job') as mock_job:
+                    mock_upload.return_value = {'item': {'itemID': 'item1'}}
+                    mock_publish.return_value = {'jobId': 'j1', 'jobStatus': 'esriJobSubmitted'}
+                    mock_job.return_value = {'jobId': 'j1', 'jobStatus': 'esriJobExecuting'}
+                    with patch('slap.api.time.time', side_effect=[0, 1, 10]):
+                        with patch('slap.api.time.sleep'):
+                            with self.assertRaises(requests.exceptions.RequestException) as context:
+                                api.upload_service_definition('path/my.sd', timeout=5)
+                    self.assertIn('did not finish within 5s (esriJobExecuting)', str(context.exception))
+                    mock_job.assert_called_once_with('j1')
+
     def test_build_params(self):
         with patch('slap.api.Api.token', new_callable=PropertyMock) as mock_token:
             mock_token.return_value = 'my-token'
@@ -244,6 +576,124 @@ class TestApi(TestCase):
         self.assertEqual(json.loads(expected['directories']), json.loads(actual['directories']))
 
 
+class TestConcurrentApi(TestCase):
+
+    @staticmethod
+    def create_api(max_workers=4):
+        return ConcurrentApi(
+            ags_url='http://myserver/arcgis/admin',
+            token_url=None,
+            portal_url=None,
+            username='user',
+            password='pass',
+            max_workers=max_workers
+        )
+
+    def test_pool_size_covers_workers(self):
+        api = self.create_api(max_workers=16)
+        adapter = api.transport.session.get_adapter('https://myserver:6443/arcgis/admin')
+        self.assertEqual(adapter._pool_maxsize, 16)
+
+    def test_map_returns_results_in_input_order(self):
+        api = self.create_api()
+
+        def slow_echo(value):
+            time.sleep(0.01 * (5 - value))
+            return value
+
+        self.assertEqual(api.map(slow_echo, [{'value': v} for v in range(5)]), [0, 1, 2, 3, 4])
+        api.close()
+
+    def test_map_limits_concurrency(self):
+        api = self.create_api(max_workers=2)
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def track(value):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+            return value
+
+        api.map(track, [{'value': v} for v in range(8)])
+        api.close()
+        self.assertLessEqual(state['peak'], 2)
+
+    def test_map_through_limiter(self):
+        api = self.create_api(max_workers=4)
+        # Calls this quick vary too much in latency to compare
+        api.limiter = AdaptiveLimiter(floor=1, ceiling=4, warmup=100)
+
+        def echo(value):
+            return value
+
+        self.assertEqual(api.map(echo, [{'value': v} for v in range(8)]), list(range(8)))
+        api.close()
+        self.assertEqual(api.limiter.limit, 4)
+        self.assertEqual(api.limiter._baselines['echo'][0], 8)
+
+    def test_map_backs_off_on_errors(self):
+        api = self.create_api()
+        api.limiter = AdaptiveLimiter(floor=1, ceiling=4)
+        api.limiter._limit = 4.0
+
+        def fail(value):
+            raise requests.exceptions.RequestException(value)
+
+        self.assertRaises(requests.exceptions.RequestException, api.map, fail, [{'value': 'a'}])
+        api.close()
+        self.assertEqual(api.limiter.limit, 2)
+
+    def test_map_empty(self):
+        self.assertEqual(self.create_api().map(None, []), [])
+
+    def test_map_raises_errors(self):
+        api = self.create_api()
+
+        def fail(value):
+            raise requests.exceptions.RequestException(value)
+
+        self.assertRaises(requests.exceptions.RequestException, api.map, fail, [{'value': 'a'}])
+        api.close()
+
+    def test_exists_many(self):
+        api = self.create_api()
+        services = [
+            {'service_name': 'a', 'folder': 'f'},
+            {'service_name': 'b', 'folder': 'f', 'service_type': 'ImageServer'}
+        ]
+        with patch('slap.api.Api.service_exists') as mock_exists:
+            mock_exists.side_effect = lambda **kwargs: {'exists': kwargs['service_name'] == 'a'}
+            self.assertEqual(api.exists_many(services), [{'exists': True}, {'exists': False}])
+            mock_exists.assert_any_call(service_name='b', folder='f', service_type='ImageServer')
+        api.close()
+
+    def test_delete_many(self):
+        api = self.create_api()
+        with patch('slap.api.Api.delete_service') as mock_delete:
+            api.delete_many([{'service_name': 'a'}, {'service_name': 'b'}])
+            self.assertEqual(mock_delete.call_count, 2)
+        api.close()
+
+    def test_get_params_many(self):
+        api = self.create_api()
+        with patch('slap.api.Api.get_service_params') as mock_get:
+            mock_get.side_effect = lambda **kwargs: {'serviceName': kwargs['service_name']}
+            actual = api.get_params_many([{'service_name': 'a'}, {'service_name': 'b'}])
+            self.assertEqual(actual, [{'serviceName': 'a'}, {'serviceName': 'b'}])
+        api.close()
+
+    def test_edit_many(self):
+        api = self.create_api()
+        with patch('slap.api.Api.edit_service') as mock_edit:
+            api.edit_many([{'service_name': 'a', 'params': {'foo': 'bar'}}])
+            mock_edit.assert_called_once_with(service_name='a', params={'foo': 'bar'})
+        api.close()
+
+
 if __name__ == '__main__':
 
     unittest.main()
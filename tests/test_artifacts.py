@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from slap.artifacts import ArtifactCache
+
+
+class TestArtifactCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ArtifactCache(os.path.join(self.directory, 'cache'), max_size=25)
+        self.sd = os.path.join(self.directory, 'map.sd')
+        self.write(self.sd, 'x' * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def write(path, content):
+        with open(path, 'wb') as output:
+            output.write(content)
+
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as input_file:
+            return input_file.read()
+
+    def test_key_depends_on_server_type(self):
+        self.assertNotEqual(ArtifactCache.get_key('abc', 'ARCGIS_SERVER', 'MapServer'),
+                            ArtifactCache.get_key('abc', 'MY_HOSTED_SERVICES', 'MapServer'))
+
+    def test_miss(self):
+        destination = os.path.join(self.directory, 'output', 'map.sd')
+        self.assertFalse(self.cache.get('missing', destination))
+        self.assertFalse(os.path.exists(destination))
+
+    def test_put_and_get(self):
+        self.cache.put('key', self.sd)
+        destination = os.path.join(self.directory, 'output', 'map.sd')
+        self.assertTrue(self.cache.get('key', destination))
+        self.assertEqual(self.read(destination), 'x' * 10)
+
+    def test_get_replaces_destination(self):
+        self.cache.put('key', self.sd)
+        destination = os.path.join(self.directory, 'old.sd')
+        self.write(destination, 'old')
+        self.cache.get('key', destination)
+        self.assertEqual(self.read(destination), 'x' * 10)
+
+    def test_put_leaves_no_temp_files(self):
+        self.cache.put('key', self.sd)
+        self.assertEqual(os.listdir(self.cache.directory), ['key.sd'])
+
+    def test_evicts_least_recently_used(self):
+        for index, key in enumerate(['a', 'b']):
+            self.cache.put(key, self.sd)
+            os.utime(self.cache.path(key), (index, index))
+        self.cache.get('a', os.path.join(self.directory, 'a.sd'))
+        self.cache.put('c', self.sd)
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), ['a.sd', 'c.sd'])
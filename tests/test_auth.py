@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import MagicMock
+from slap.auth import TokenManager, TokenCache
+
+
+class TestTokenManager(TestCase):
+
+    def create_manager(self, responses, cache=None):
+        post = MagicMock(side_effect=responses)
+        manager = TokenManager('http://server/generateToken', 'user', 'pass', post, cache=cache)
+        manager.clock = MagicMock(return_value=1000.0)
+        return manager, post
+
+    def test_requests_token(self):
+        manager, post = self.create_manager([{'token': 'abc', 'expires': 4600000}])
+        self.assertEqual(manager.get_token(), 'abc')
+        post.assert_called_once_with('http://server/generateToken', {
+            'username': 'user',
+            'password': 'pass',
+            'client': 'requestip',
+            'expiration': 60,
+            'f': 'json'
+        })
+
+    def test_reads_expiry_from_response(self):
+        manager, post = self.create_manager([{'token': 'abc', 'expires': 4600000}])
+        manager.get_token()
+        self.assertEqual(manager.expires, 4600.0)
+
+    def test_defaults_expiry_to_requested_expiration(self):
+        manager, post = self.create_manager([{'token': 'abc'}])
+        manager.get_token()
+        self.assertEqual(manager.expires, 1000.0 + 3600)
+
+    def test_reuses_valid_token(self):
+        manager, post = self.create_manager([{'token': 'abc', 'expires': 4600000}])
+        manager.get_token()
+        manager.get_token()
+        post.assert_called_once()
+
+    def test_refreshes_token_before_expiry(self):
+        manager, post = self.create_manager([
+            {'token': 'abc', 'expires': 4600000},
+            {'token': 'def', 'expires': 8200000}
+        ])
+        manager.get_token()
+        manager.clock.return_value = 4600.0 - manager.refresh_margin + 1
+        self.assertEqual(manager.get_token(), 'def')
+
+    def test_refresh_skips_request_if_token_was_already_replaced(self):
+        manager, post = self.create_manager([{'token': 'abc', 'expires': 4600000}])
+        manager.get_token()
+        self.assertEqual(manager.refresh(invalid_token='older'), 'abc')
+        post.assert_called_once()
+
+    def test_refresh_replaces_rejected_token(self):
+        manager, post = self.create_manager([
+            {'token': 'abc', 'expires': 4600000},
+            {'token': 'def', 'expires': 4600000}
+        ])
+        manager.get_token()
+        self.assertEqual(manager.refresh(invalid_token='abc'), 'def')
+
+    def test_loads_token_from_cache(self):
+        cache = MagicMock()
+        cache.load.return_value = {'token': 'cached', 'expires': 4600.0}
+        manager, post = self.create_manager([], cache)
+        self.assertEqual(manager.get_token(), 'cached')
+        post.assert_not_called()
+
+    def test_ignores_expired_cached_token(self):
+        cache = MagicMock()
+        cache.load.return_value = {'token': 'cached', 'expires': 1000.0}
+        manager, post = self.create_manager([{'token': 'abc', 'expires': 4600000}], cache)
+        self.assertEqual(manager.get_token(), 'abc')
+        cache.save.assert_called_once_with('abc', 4600.0)
+
+    def test_refresh_clears_cache(self):
+        cache = MagicMock()
+        manager, post = self.create_manager([{'token': 'abc', 'expires': 4600000}], cache)
+        manager.refresh()
+        cache.clear.assert_called_once()
+
+
+class TestTokenCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_cache(self, username='user', password='pass'):
+        return TokenCache('http://server/generateToken', username, password, self.directory)
+
+    def test_round_trip(self):
+        self.create_cache().save('abc', 4600.0)
+        self.assertEqual(self.create_cache().load(), {'token': 'abc', 'expires': 4600.0})
+
+    def test_cache_is_encrypted(self):
+        cache = self.create_cache()
+        cache.save('my-secret-token', 4600.0)
+        with open(cache.path, 'rb') as cache_file:
+            self.assertNotIn(b'my-secret-token', cache_file.read())
+
+    def test_cache_is_keyed_by_user(self):
+        self.create_cache().save('abc', 4600.0)
+        self.assertIsNone(self.create_cache(username='other').load())
+
+    def test_cache_unreadable_with_changed_password(self):
+        self.create_cache().save('abc', 4600.0)
+        self.assertIsNone(self.create_cache(password='changed').load())
+
+    def test_clear(self):
+        cache = self.create_cache()
+        cache.save('abc', 4600.0)
+        cache.clear()
+        self.assertFalse(os.path.exists(cache.path))
+        self.assertIsNone(cache.load())
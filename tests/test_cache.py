@@ -0,0 +1,48 @@
+import os
+import time
+import shutil
+import tempfile
+from unittest import TestCase
+from slap.cache import create_once
+
+
+class TestCreateOnce(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'file.txt')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create(self, path):
+        self.calls.append(path)
+        with open(path, 'w') as output:
+            output.write('created')
+
+    def test_creates_file(self):
+        create_once(self.path, self.create)
+        with open(self.path) as created:
+            self.assertEqual(created.read(), 'created')
+        self.assertEqual(os.listdir(self.directory), ['file.txt'])
+
+    def test_skips_existing_file(self):
+        create_once(self.path, self.create)
+        create_once(self.path, self.create)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_removes_lock_on_failure(self):
+        def fail(path):
+            raise RuntimeError('failed')
+
+        with self.assertRaises(RuntimeError):
+            create_once(self.path, fail)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_takes_over_stale_lock(self):
+        lock_path = self.path + '.lock'
+        open(lock_path, 'w').close()
+        os.utime(lock_path, (time.time() - 600, time.time() - 600))
+        create_once(self.path, self.create, timeout=60, poll_interval=0)
+        self.assertTrue(os.path.exists(self.path))
@@ -1,7 +1,13 @@
 import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
 from unittest import TestCase
-from mock import MagicMock, patch, call
-from slap import cli
+from mock import MagicMock, PropertyMock, patch, call
+from slap import cli, profiling
+from slap.fake_server import FakeArcGISServer
 mock_arcpy = MagicMock()
 module_patcher = patch.dict('sys.modules', {'arcpy': mock_arcpy})
 module_patcher.start()
@@ -56,13 +62,13 @@ class TestPublishCli(TestCase):
         with patch('slap.cli.Publisher') as mock_publisher:
             with patch('slap.publisher.ConfigParser.load_config'):
                 cli.main(['publish', '-u', 'user', '-p', 'pass'])
-                mock_publisher.assert_called_once_with('user', 'pass', 'config.json', None)
+                mock_publisher.assert_called_once_with('user', 'pass', 'config.json', None, None)
 
     def test_set_hostname(self):
         with patch('slap.cli.Publisher') as mock_publisher:
             with patch('slap.publisher.ConfigParser.load_config'):
                 cli.main(self.required_args + ['-n', 'host'])
-                mock_publisher.assert_called_once_with('user', 'pass', 'config.json', 'host')
+                mock_publisher.assert_called_once_with('user', 'pass', 'config.json', 'host', None)
 
     def test_register_data_sources(self):
         with patch('slap.publisher.Publisher.register_data_sources') as mock_register:
@@ -82,6 +88,199 @@ class TestPublishCli(TestCase):
                 cli.main(self.required_args + ['-s'])
                 mock_create_site.assert_called_once()
 
+    def test_prints_api_metrics(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.cli.print_api_metrics') as mock_print:
+                    cli.main(self.required_args)
+                    mock_print.assert_called_once()
+
+    def test_prints_api_metrics_when_publishing_fails(self):
+        with patch('slap.publisher.Publisher.publish_all') as mock_publish:
+            mock_publish.side_effect = RuntimeError('failed')
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.cli.print_api_metrics') as mock_print:
+                    with self.assertRaises(RuntimeError):
+                        cli.main(self.required_args)
+                    mock_print.assert_called_once()
+
+    def test_batch_start(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.start_deferred_services') as mock_start:
+                    cli.main(self.required_args + ['--batch-start', '5'])
+                    mock_start.assert_called_once_with()
+
+    def test_publish_with_jobs(self):
+        with patch('slap.cli.ParallelPublisher.publish') as mock_publish:
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.resolve_inputs') as mock_resolve:
+                    mock_resolve.return_value = [('mapServices', {'input': 'foo'})]
+                    cli.main(self.required_args + ['-j', '4', 'foo'])
+                    mock_resolve.assert_called_once_with(['foo'])
+                    mock_publish.assert_called_once_with([('mapServices', {'input': 'foo'})])
+
+    def test_publish_with_pipeline(self):
+        with patch('slap.cli.PublishPipeline.publish', autospec=True) as mock_publish:
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.get_service_entries') as mock_entries:
+                    mock_entries.return_value = [('mapServices', {'input': 'foo'})]
+                    cli.main(self.required_args + ['--pipeline', '--workers', 'upload=4', '--workers', 'stage=2'])
+                    pipeline, work_items = mock_publish.call_args[0]
+                    self.assertEqual(work_items, [('mapServices', {'input': 'foo'})])
+                    self.assertEqual(pipeline.workers, {'draft': 1, 'stage': 2, 'upload': 4, 'configure': 2})
+
+    def test_rejects_unknown_pipeline_stage(self):
+        with self.assertRaises(SystemExit):
+            cli.main(self.required_args + ['--pipeline', '--workers', 'bogus=2'])
+
+    def test_force(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.cli._publish', wraps=cli._publish) as mock_publish:
+                    cli.main(self.required_args + ['--force', '--manifest', 'build/manifest.json'])
+                    publisher = mock_publish.call_args[0][0]
+                    self.assertTrue(publisher.force)
+                    self.assertEqual(publisher.manifest.path, os.path.abspath('build/manifest.json'))
+
+    def test_resume_and_keep_going(self):
+        directory = tempfile.mkdtemp()
+        try:
+            journal_path = os.path.join(directory, 'journal.jsonl')
+            with patch('slap.publisher.Publisher.publish_all'):
+                with patch('slap.publisher.ConfigParser.load_config'):
+                    with patch('slap.cli._publish', wraps=cli._publish) as mock_publish:
+                        cli.main(self.required_args + ['--resume', '--keep-going', '--journal', journal_path])
+                        publisher = mock_publish.call_args[0][0]
+                        self.assertEqual(publisher.journal.path, journal_path)
+                        self.assertTrue(publisher.keep_going)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_keep_going_raises_failures_at_end(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.raise_failures') as mock_raise:
+                    cli.main(self.required_args + ['--keep-going'])
+                    mock_raise.assert_called_once_with()
+
+    def test_overwrite(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.cli._publish', wraps=cli._publish) as mock_publish:
+                    cli.main(self.required_args + ['--overwrite'])
+                    self.assertTrue(mock_publish.call_args[0][0].overwrite)
+
+    def test_publish_shard(self):
+        directory = tempfile.mkdtemp()
+        try:
+            report_path = os.path.join(directory, 'report.json')
+            work_items = [('mapServices', {'input': 'a'}), ('mapServices', {'input': 'b'})]
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.get_service_entries', return_value=work_items):
+                    with patch('slap.publisher.Publisher.select_shard', return_value=work_items[1:]) as mock_shard:
+                        with patch('slap.publisher.Publisher.publish_entries') as mock_publish:
+                            cli.main(self.required_args + ['--shard', '2/3', '--report', report_path])
+                            mock_shard.assert_called_once_with(work_items, 2, 3)
+                            mock_publish.assert_called_once_with(work_items[1:])
+            with open(report_path) as report_file:
+                self.assertIsNone(json.load(report_file)['error'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_report_records_failure(self):
+        directory = tempfile.mkdtemp()
+        try:
+            report_path = os.path.join(directory, 'report.json')
+            with patch('slap.publisher.Publisher.publish_all', side_effect=RuntimeError('failed')):
+                with patch('slap.publisher.ConfigParser.load_config'):
+                    with self.assertRaises(RuntimeError):
+                        cli.main(self.required_args + ['--report', report_path])
+            with open(report_path) as report_file:
+                self.assertEqual(json.load(report_file)['error'], 'RuntimeError: failed')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_rejects_bad_shard(self):
+        for shard in ['0/2', '3/2', '2', 'a/b']:
+            with self.assertRaises(SystemExit):
+                cli.main(self.required_args + ['--shard', shard])
+
+    def test_timings(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.timing.PhaseTimer.write') as mock_write:
+                    with patch('slap.timing.PhaseTimer.records', new_callable=PropertyMock) as mock_records, \
+                            patch('slap.publisher.Publisher.record_history'):
+                        mock_records.return_value = []
+                        cli.main(self.required_args + ['--timings', 'timings.csv'])
+                        mock_write.assert_not_called()
+                        mock_records.return_value = [{'service': 'a.MapServer', 'total': 1.0, 'phases': {}}]
+                        cli.main(self.required_args + ['--timings', 'timings.csv'])
+                        mock_write.assert_called_once_with('timings.csv')
+
+    def test_records_history_when_publishing_fails(self):
+        with patch('slap.publisher.Publisher.publish_all', side_effect=RuntimeError('failed')):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.record_history') as mock_record:
+                    with self.assertRaises(RuntimeError):
+                        cli.main(self.required_args)
+                    mock_record.assert_called_once_with()
+
+    def test_schedules_serial_publish(self):
+        with patch('slap.publisher.Publisher.publish_all'):
+            with patch('slap.publisher.ConfigParser.load_config'):
+                with patch('slap.publisher.Publisher.get_service_entries') as mock_entries:
+                    with patch('slap.publisher.Publisher.get_skip_reason') as mock_skip_reason:
+                        with patch('slap.publisher.Publisher.schedule') as mock_schedule:
+                            mock_entries.return_value = [('mapServices', {'input': 'a'}),
+                                                         ('mapServices', {'input': 'b'})]
+                            mock_skip_reason.side_effect = lambda service_type, config_entry: \
+                                'unchanged' if config_entry['input'] == 'a' else None
+                            cli.main(self.required_args)
+                            mock_schedule.assert_called_once_with([('mapServices', {'input': 'b'})])
+
+    def test_serial_publish_hashes_each_input_twice(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ['a.mxd', 'b.mxd']:
+                with open(os.path.join(directory, name), 'w') as input_file:
+                    input_file.write(name)
+            config = {
+                'agsUrl': 'my/server',
+                'manifest': os.path.join(directory, 'manifest.json'),
+                'history': os.path.join(directory, 'history.sqlite'),
+                'mapServices': {'services': [{'input': os.path.join(directory, name), 'output': directory}
+                                             for name in ['a.mxd', 'b.mxd']]}
+            }
+            publisher = cli.Publisher('user', 'pass', config)
+            with patch('slap.manifest.hash_path', return_value='abc') as mock_hash:
+                with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+                    mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
+                    with patch('slap.publisher.Publisher.stage_service'):
+                        with patch('slap.publisher.Publisher.publish_sd_draft'):
+                            cli._schedule_serial(publisher, publisher.get_service_entries())
+                            publisher.publish_services('mapServices')
+            # Once for the skip check and scheduling, once after drafting
+            self.assertEqual(mock_hash.call_count, 4)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        trace_path = os.path.join(directory, 'trace.json')
+        try:
+            with patch('slap.publisher.Publisher.publish_all'):
+                with patch('slap.publisher.ConfigParser.load_config'):
+                    with patch('slap.api.Api.get_token'):
+                        cli.main(['--profile', trace_path, '--cprofile'] + self.required_args)
+            with open(trace_path) as trace:
+                self.assertIn('traceEvents', json.load(trace))
+            self.assertTrue(os.path.exists(os.path.join(directory, 'trace-{0}.prof'.format(os.getpid()))))
+            self.assertIsNone(profiling.get_tracer())
+        finally:
+            shutil.rmtree(directory)
+
     def test_publish_inputs(self):
         with patch('slap.publisher.Publisher.publish_input') as mock_publish:
             with patch('slap.publisher.ConfigParser.load_config'):
@@ -100,3 +299,151 @@ class TestPublishCli(TestCase):
                     cli.main(self.required_args + ['-g', sha])
                     mock_git.assert_called_once_with(sha)
                     mock_publisher.assert_called_once_with(file)
+
+
+class TestPlanCli(TestCase):
+
+    required_args = ['plan', '-u', 'user', '-p', 'pass']
+
+    def test_plan_all(self):
+        with patch('slap.publisher.ConfigParser.load_config'):
+            with patch('slap.publisher.Publisher.get_service_entries') as mock_entries:
+                with patch('slap.cli.Planner.plan') as mock_plan:
+                    mock_entries.return_value = [('mapServices', {'input': 'foo'})]
+                    mock_plan.return_value = []
+                    cli.main(self.required_args)
+                    mock_plan.assert_called_once_with([('mapServices', {'input': 'foo'})], None)
+
+    def test_plan_git(self):
+        entry = {'input': 'foo.mxd'}
+        with patch('slap.publisher.ConfigParser.load_config'):
+            with patch('slap.publisher.Publisher.get_service_entries') as mock_entries:
+                with patch('slap.git.get_changed_mxds') as mock_git:
+                    with patch('slap.cli.Planner.plan') as mock_plan:
+                        mock_entries.return_value = [('mapServices', entry)]
+                        mock_git.return_value = ['foo.mxd']
+                        mock_plan.return_value = []
+                        cli.main(self.required_args + ['-g', 'some-hash'])
+                        mock_plan.assert_called_once_with([('mapServices', entry)], set([id(entry)]))
+
+    def test_exit_code(self):
+        with patch('slap.publisher.ConfigParser.load_config'):
+            with patch('slap.publisher.Publisher.get_service_entries'):
+                with patch('slap.cli.Planner.plan') as mock_plan:
+                    mock_plan.return_value = [{'action': 'create', 'service': 'a.MapServer', 'reason': ''}]
+                    with self.assertRaises(SystemExit) as context:
+                        cli.main(self.required_args + ['--exit-code'])
+                    self.assertEqual(context.exception.code, 2)
+
+
+class TestUpdateJsonCli(TestCase):
+
+    def test_update_all(self):
+        with patch('slap.publisher.Publisher.update_json') as mock_update:
+            with patch('slap.publisher.ConfigParser.load_config'):
+                cli.main(['update-json', '-u', 'user', '-p', 'pass'])
+                mock_update.assert_called_once_with(None)
+
+    def test_update_inputs(self):
+        with patch('slap.publisher.Publisher.update_json') as mock_update:
+            with patch('slap.publisher.ConfigParser.load_config'):
+                cli.main(['update-json', '-u', 'user', '-p', 'pass', 'foo', 'bar'])
+                mock_update.assert_called_once_with(['foo', 'bar'])
+
+
+class TestMergeReportsCli(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_report(self, shard, status):
+        path = os.path.join(self.directory, 'report-{0}.json'.format(shard))
+        with open(path, 'w') as report_file:
+            json.dump({'shard': shard, 'shards': 2, 'plan': 'abc', 'started': 0, 'duration': 10, 'error': None,
+                       'services': [{'service': 's{0}.MapServer'.format(shard), 'status': status, 'error': None,
+                                     'total': 10}],
+                       'timings': []}, report_file)
+        return path
+
+    def test_merge_reports(self):
+        output = os.path.join(self.directory, 'merged.json')
+        cli.main(['merge-reports', self.write_report(1, 'published'), self.write_report(2, 'skipped'), '-o', output])
+        with open(output) as merged_file:
+            self.assertTrue(json.load(merged_file)['ok'])
+
+    def test_fails_if_a_service_failed(self):
+        with self.assertRaises(SystemExit) as context:
+            cli.main(['merge-reports', self.write_report(1, 'published'), self.write_report(2, 'failed')])
+        self.assertEqual(context.exception.code, 1)
+
+
+# Runs a command in a fresh interpreter, and reports how long it took and whether anything tried to import arcpy
+_STARTUP_SCRIPT = """
+import sys, json, time
+start = time.time()
+class ArcpyWatcher(object):
+    imported = False
+    def find_module(self, name, path=None):
+        if name == 'arcpy':
+            ArcpyWatcher.imported = True
+sys.meta_path.insert(0, ArcpyWatcher())
+from slap import cli
+try:
+    cli.main(sys.argv[1:])
+except SystemExit:
+    pass
+print(json.dumps({'seconds': time.time() - start, 'arcpy': ArcpyWatcher.imported}))
+"""
+
+
+class TestStartup(TestCase):
+
+    # Commands that don't need arcpy should start well under this; the best of a few runs smooths out a busy machine
+    max_seconds = 1
+    runs = 3
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = FakeArcGISServer().start()
+        self.config = os.path.join(self.directory, 'config.json')
+        with open(self.config, 'w') as config_file:
+            json.dump({'agsUrl': self.server.url, 'history': False, 'dataSourceCache': False,
+                       'mapServices': {'services': []}}, config_file)
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def run_command(self, *args):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(cli.__file__))))
+        results = []
+        for i in range(self.runs):
+            output = subprocess.check_output([sys.executable, '-c', _STARTUP_SCRIPT] + list(args),
+                                             cwd=self.directory, env=env)
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        return {'seconds': min(result['seconds'] for result in results),
+                'arcpy': any(result['arcpy'] for result in results)}
+
+    def assert_starts_quickly(self, *args):
+        result = self.run_command(*args)
+        self.assertFalse(result['arcpy'])
+        self.assertLess(result['seconds'], self.max_seconds)
+
+    def test_help_does_not_load_arcpy(self):
+        self.assert_starts_quickly('--help')
+
+    def test_init_without_register_does_not_load_arcpy(self):
+        self.assert_starts_quickly('init', self.directory, '-c', os.path.join(self.directory, 'new.json'))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'new.json')))
+
+    def test_publish_does_not_load_arcpy(self):
+        self.assert_starts_quickly('publish', '-u', 'user', '-p', 'pass', '-c', self.config)
+
+    def test_plan_does_not_load_arcpy(self):
+        self.assert_starts_quickly('plan', '-u', 'user', '-p', 'pass', '-c', self.config)
+
+    def test_update_json_does_not_load_arcpy(self):
+        self.assert_starts_quickly('update-json', '-u', 'user', '-p', 'pass', '-c', self.config)
@@ -1,7 +1,7 @@
 from unittest import TestCase
 from mock import patch, mock_open
 import json
-from slap.config import ConfigParser
+from slap.config import ConfigParser, ServiceIndex
 
 
 class TestConfigParser(TestCase):
@@ -273,4 +273,65 @@ class TestConfigParser(TestCase):
                 "virtualOutputDir": "/rest/directories/arcgisoutput"
             }
         }
-        self.assertEqual(self.config_parser.merge_json(default_json_string, config_json), expected)
\ No newline at end of file
+        self.assertEqual(self.config_parser.merge_json(default_json_string, config_json), expected)
+
+    def test_merge_json_does_not_change_default(self):
+        default_json = {"properties": {"maxRecordCount": 1000}}
+        self.config_parser.merge_json(default_json, {"properties": {"maxRecordCount": 2000}})
+        self.assertEqual(default_json, {"properties": {"maxRecordCount": 1000}})
+
+    def test_diff_json_no_changes(self):
+        current_json = {"minInstancesPerNode": 1, "properties": {"maxRecordCount": 1000}}
+        new_json = self.config_parser.merge_json(current_json, {"properties": {"maxRecordCount": 1000}})
+        self.assertEqual(self.config_parser.diff_json(current_json, new_json), [])
+
+    def test_diff_json_reports_changed_keys(self):
+        current_json = {"minInstancesPerNode": 1, "capabilities": "Map", "properties": {"maxRecordCount": 1000}}
+        new_json = {"minInstancesPerNode": 2, "capabilities": "Map", "properties": {"maxRecordCount": 2000,
+                                                                                   "schemaLockingEnabled": False}}
+        self.assertEqual(self.config_parser.diff_json(current_json, new_json), [
+            ("minInstancesPerNode", 1, 2),
+            ("properties.maxRecordCount", 1000, 2000),
+            ("properties.schemaLockingEnabled", None, False)
+        ])
+
+    def test_diff_json_reports_removed_keys(self):
+        self.assertEqual(self.config_parser.diff_json({"foo": "bar"}, {}), [("foo", "bar", None)])
+
+
+class TestServiceIndex(TestCase):
+
+    def setUp(self):
+        self.config = {
+            'mapServices': {
+                'services': [
+                    {'input': 'maps/a.mxd'},
+                    {'input': 'maps/a.mxd', 'serviceName': 'a_copy', 'folderName': 'Copies'},
+                    {'input': '/data/b.mxd', 'json': {'serviceName': 'roads'}}
+                ]
+            },
+            'gpServices': {
+                'services': [{'input': 'tools/a.tbx', 'serviceName': 'a'}]
+            }
+        }
+        self.index = ServiceIndex(self.config, '/repo')
+
+    def test_entries_in_config_order(self):
+        self.assertEqual([entry['input'] for service_type, entry in self.index.entries],
+                         ['maps/a.mxd', 'maps/a.mxd', '/data/b.mxd', 'tools/a.tbx'])
+
+    def test_find_by_normalized_path(self):
+        self.assertEqual(len(self.index.find('./maps/a.mxd')), 2)
+        self.assertEqual(len(self.index.find('maps/../maps/a.mxd')), 2)
+        self.assertEqual(len(self.index.find('/repo/maps/a.mxd')), 2)
+
+    def test_find_by_service_name(self):
+        self.assertEqual(self.index.find('roads'), [('mapServices', self.config['mapServices']['services'][2])])
+        self.assertEqual(self.index.find('a_copy'), [('mapServices', self.config['mapServices']['services'][1])])
+
+    def test_find_service_name_across_types(self):
+        self.assertEqual([service_type for service_type, entry in self.index.find('a')], ['mapServices', 'gpServices'])
+        self.assertEqual(len(self.index.find('a', 'gpServices')), 1)
+
+    def test_find_missing(self):
+        self.assertEqual(self.index.find('missing.mxd'), [])
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from slap.data_sources import RegistrationCache, get_item_path, create_folder_item
+
+
+class TestDataSources(TestCase):
+
+    def test_get_item_path(self):
+        self.assertEqual(get_item_path({'name': 'gdb', 'serverPath': 'data.gdb'}), '/fileShares/gdb')
+        self.assertEqual(get_item_path({'name': 'db', 'serverPath': 'prod.sde'}), '/enterpriseDatabases/db')
+
+    def test_create_shared_folder_item(self):
+        item = create_folder_item({'name': 'data', 'serverPath': 'data'}, lambda path: '/root/' + path)
+        self.assertEqual(item, {'type': 'folder', 'path': '/fileShares/data',
+                                'info': {'path': '/root/data', 'dataStoreConnectionType': 'shared'}})
+
+    def test_create_replicated_folder_item(self):
+        item = create_folder_item({'name': 'data', 'serverPath': 'server', 'clientPath': 'client'},
+                                  lambda path: '/root/' + path)
+        self.assertEqual(item['info'], {'path': '/root/server', 'clientPath': '/root/client',
+                                        'dataStoreConnectionType': 'replicated'})
+
+
+class TestRegistrationCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.now = 1000
+        self.data_source = {'name': 'data', 'serverPath': 'data'}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_cache(self, ags_url='my/server'):
+        return RegistrationCache(ags_url, ttl=60, directory=self.directory, clock=lambda: self.now)
+
+    def test_records_registrations(self):
+        self.create_cache().record([self.data_source])
+        self.assertTrue(self.create_cache().is_registered(self.data_source))
+        self.assertFalse(self.create_cache('other/server').is_registered(self.data_source))
+
+    def test_expires(self):
+        cache = self.create_cache()
+        cache.record([self.data_source])
+        self.now += 61
+        self.assertFalse(cache.is_registered(self.data_source))
+
+    def test_changed_paths_are_checked_again(self):
+        cache = self.create_cache()
+        cache.record([self.data_source])
+        self.assertFalse(cache.is_registered({'name': 'data', 'serverPath': 'moved'}))
+
+    def test_clear(self):
+        cache = self.create_cache()
+        cache.record([self.data_source])
+        cache.clear()
+        self.assertFalse(self.create_cache().is_registered(self.data_source))
+        self.assertEqual(os.listdir(self.directory), [])
@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 from os import path
 from collections import namedtuple
 from slap.esri import ArcpyHelper
@@ -56,11 +58,57 @@ class TestListDataSources(TestCase):
                 self.assertEqual(expected, actual)
 
 
+@patch('slap.esri.arcpy')
+class TestServerConnectionFile(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.environment = patch.dict('os.environ', {'SLAP_CACHE_DIR': self.directory})
+        self.environment.start()
+
+    def tearDown(self):
+        self.environment.stop()
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def create_connection_file(out_folder_path, out_name, **kwargs):
+        with open(os.path.join(out_folder_path, out_name), 'w') as connection_file:
+            connection_file.write(kwargs['server_url'])
+
+    def test_created_on_first_use(self, mock_arcpy):
+        mock_arcpy.mapping.CreateGISServerConnectionFile.side_effect = self.create_connection_file
+        arcpy_helper = ArcpyHelper('user', 'pwd', 'my/ags')
+        mock_arcpy.mapping.CreateGISServerConnectionFile.assert_not_called()
+        self.assertTrue(os.path.exists(arcpy_helper.connection_file_path))
+        self.assertTrue(arcpy_helper.connection_file_path.startswith(os.path.join(self.directory, 'connections')))
+
+    def test_reused_across_helpers(self, mock_arcpy):
+        mock_arcpy.mapping.CreateGISServerConnectionFile.side_effect = self.create_connection_file
+        first = ArcpyHelper('user', 'pwd', 'my/ags').connection_file_path
+        second = ArcpyHelper('user', 'pwd', 'my/ags').connection_file_path
+        self.assertEqual(first, second)
+        self.assertEqual(mock_arcpy.mapping.CreateGISServerConnectionFile.call_count, 1)
+
+    def test_replaced_when_password_changes(self, mock_arcpy):
+        mock_arcpy.mapping.CreateGISServerConnectionFile.side_effect = self.create_connection_file
+        old = ArcpyHelper('user', 'pwd', 'my/ags').connection_file_path
+        new = ArcpyHelper('user', 'new', 'my/ags').connection_file_path
+        other_server = ArcpyHelper('user', 'pwd', 'other/ags').connection_file_path
+        self.assertNotEqual(old, new)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(other_server))
+
+    def test_named_file_in_working_directory(self, mock_arcpy):
+        arcpy_helper = ArcpyHelper('user', 'pwd', 'my/ags', connection_file_name='temp.ags')
+        self.assertEqual(arcpy_helper.connection_file_path, os.path.join(arcpy_helper.cwd, 'temp.ags'))
+
+
 @patch('slap.esri.arcpy')
 class TestRegisterDataSources(TestCase):
 
     def setUp(self):
         self.arcpy_helper = ArcpyHelper('user', 'pwd', 'my/ags')
+        self.arcpy_helper.connection_file_path = os.path.join(self.arcpy_helper.cwd, 'temp.ags')
 
     def test_does_not_add_existing_sources(self, mock_arcpy):
         mock_arcpy.ListDataStoreItems = MagicMock(return_value=["foo", "bar"])
@@ -111,6 +159,7 @@ class TestArcpyHelper(TestCase):
 
     def setUp(self):
         self.arcpy_helper = ArcpyHelper('user', 'pwd', 'my/ags')
+        self.arcpy_helper.connection_file_path = os.path.join(self.arcpy_helper.cwd, 'temp.ags')
 
     def test_get_full_path(self, mock_arcpy):
         self.assertEqual(os.path.join(os.getcwd(), 'foo'), self.arcpy_helper.get_full_path('foo'))
@@ -288,6 +337,12 @@ class TestArcpyHelper(TestCase):
             tags='Tags tags'
         )
 
+    def test_publish_mxd_times_phases(self, mock_arcpy):
+        self.arcpy_helper.set_workspaces = MagicMock()
+        with self.arcpy_helper.timer.service('myFile.MapServer'):
+            self.arcpy_helper.publish_mxd({'input': 'myFile.mxd', 'workspaces': []}, 'myFile', 'myFile.sddraft')
+        self.assertEqual(sorted(self.arcpy_helper.timer.records[0]['phases']), ['analyze', 'draft', 'workspaces'])
+
     def test_publish_image_service_with_defaults(self, mock_arcpy):
         mock_arcpy.CreateImageSDDraft = MagicMock()
         self.arcpy_helper.connection_file_path = os.path.join(self.arcpy_helper.cwd, 'some/path')
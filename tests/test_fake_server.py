@@ -0,0 +1,135 @@
+import os
+import tempfile
+from unittest import TestCase
+from slap.api import ConcurrentApi
+from slap.fake_server import FakeArcGISServer, _parse_expected_service
+from slap.retry import RetryPolicy
+
+
+class TestFakeArcGISServer(TestCase):
+
+    def setUp(self):
+        self.server = FakeArcGISServer().start()
+        self.server.add_service('Roads', 'Maps', 'MapServer', {'minInstancesPerNode': 1})
+        self.server.add_service('Root')
+        policy = RetryPolicy(jitter=False, backoff_factor=0)
+        self.api = ConcurrentApi(self.server.url, None, None, 'user', 'pass', retry_policy=policy, max_workers=4)
+
+    def tearDown(self):
+        self.api.close()
+        self.server.stop()
+
+    def test_service_exists(self):
+        self.assertTrue(self.api.service_exists('Roads', 'Maps')['exists'])
+        self.assertFalse(self.api.service_exists('Roads', 'Maps', 'ImageServer')['exists'])
+
+    def test_list_services(self):
+        root = self.api.list_services()
+        self.assertEqual(root['folders'], ['Maps'])
+        self.assertEqual([s['serviceName'] for s in root['services']], ['Root'])
+        self.assertEqual([s['serviceName'] for s in self.api.list_services('Maps')['services']], ['Roads'])
+
+    def test_get_and_edit_service(self):
+        params = self.api.get_service_params('Roads', 'Maps')
+        params['minInstancesPerNode'] = 3
+        self.api.edit_service('Roads', params, 'Maps')
+        self.assertEqual(self.api.get_service_params('Roads', 'Maps')['minInstancesPerNode'], 3)
+
+    def test_delete_service(self):
+        self.api.delete_service('Roads', 'Maps')
+        self.assertFalse(self.api.service_exists('Roads', 'Maps')['exists'])
+
+    def test_create_site(self):
+        self.api.create_default_site()
+        self.assertTrue(self.server.site_created)
+
+    def test_missing_service_is_an_error(self):
+        with self.assertRaises(Exception):
+            self.api.get_service_params('Missing')
+
+    def test_retries_injected_errors(self):
+        self.api.get_token()
+        self.server.fail_next(2)
+        self.assertTrue(self.api.service_exists('Roads', 'Maps')['exists'])
+        self.assertEqual(self.api.retry_stats['exists']['retries'], 2)
+
+    def test_gets_new_token_when_revoked(self):
+        self.api.service_exists('Roads', 'Maps')
+        self.server.revoke_tokens()
+        self.assertTrue(self.api.service_exists('Roads', 'Maps')['exists'])
+        self.assertEqual(self.api.metrics.summary()['generateToken']['count'], 2)
+
+    def test_reuses_connections(self):
+        for i in range(5):
+            self.api.service_exists('Roads', 'Maps')
+        stats = self.api.connection_stats
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 5)
+
+    def test_concurrent_exists(self):
+        services = [{'service_name': name, 'folder': 'Maps'} for name in ['Roads', 'Missing'] * 10]
+        results = self.api.exists_many(services)
+        self.assertEqual([r['exists'] for r in results], [True, False] * 10)
+
+    def test_start_services(self):
+        self.server.add_service('Stopped', 'Maps', state='STOPPED')
+        self.api.start_services([{'service_name': 'Stopped', 'folder': 'Maps', 'service_type': 'MapServer'}])
+        self.assertEqual(self.server.services[('Maps', 'Stopped', 'MapServer')]['state'], 'STARTED')
+
+    def test_upload_and_publish_service_definition(self):
+        sd = tempfile.NamedTemporaryFile(suffix='.sd', delete=False)
+        sd.write('not really a service definition')
+        sd.close()
+        try:
+            job = self.api.upload_service_definition(sd.name, poll_interval=0)
+        finally:
+            os.remove(sd.name)
+        self.assertEqual(job['jobStatus'], 'esriJobSucceeded')
+        service_name = os.path.splitext(os.path.basename(sd.name))[0]
+        self.assertTrue(self.api.service_exists(service_name)['exists'])
+
+    def test_publishes_expected_service(self):
+        sd = tempfile.NamedTemporaryFile(suffix='.sd', delete=False)
+        sd.write('not really a service definition')
+        sd.close()
+        self.server.expect_service(os.path.basename(sd.name), 'Tool', 'GP', 'GPServer')
+        try:
+            self.api.upload_service_definition(sd.name, poll_interval=0)
+        finally:
+            os.remove(sd.name)
+        self.assertTrue(self.api.service_exists('Tool', 'GP', 'GPServer')['exists'])
+        self.assertTrue(self.api.is_service_started('Tool', 'GP', 'GPServer'))
+
+    def test_parse_expected_service(self):
+        self.assertEqual(_parse_expected_service('tool.sd=GP/Tool.GPServer'), ('tool.sd', 'GP', 'Tool', 'GPServer'))
+        self.assertEqual(_parse_expected_service('map.sd=Roads.MapServer'), ('map.sd', '', 'Roads', 'MapServer'))
+
+    def test_upload_item_in_parts(self):
+        self.api.upload_part_size = 8
+        sd = tempfile.NamedTemporaryFile(suffix='.sd', delete=False)
+        sd.write('not really a service definition')
+        sd.close()
+        try:
+            item = self.api.upload_item(sd.name)['item']
+        finally:
+            os.remove(sd.name)
+        self.assertEqual(item['size'], len('not really a service definition'))
+        self.assertEqual(len(self.server.uploads[item['itemID']]['parts']), 4)
+
+    def test_stop_service(self):
+        self.api.stop_service('Roads', 'Maps')
+        self.assertEqual(self.server.services[('Maps', 'Roads', 'MapServer')]['state'], 'STOPPED')
+
+    def test_register_and_find_data_items(self):
+        self.api.register_data_items_many([
+            {'type': 'folder', 'path': '/fileShares/a', 'info': {'path': '/a'}},
+            {'type': 'folder', 'path': '/fileShares/b', 'info': {'path': '/b'}}
+        ])
+        folders, databases = self.api.find_data_items_many(['/fileShares', '/enterpriseDatabases'])
+        self.assertEqual([item['path'] for item in folders['items']], ['/fileShares/a', '/fileShares/b'])
+        self.assertEqual(databases['items'], [])
+
+    def test_service_status(self):
+        self.assertTrue(self.api.is_service_started('Roads', 'Maps'))
+        self.api.stop_service('Roads', 'Maps')
+        self.assertEqual(self.api.get_service_status('Roads', 'Maps')['realTimeState'], 'STOPPED')
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from slap.history import History, Progress, order_longest_first, predict_duration, format_duration
+
+
+def create_record(service, total, input_size=100, phases=None):
+    return {'service': service, 'input_size': input_size, 'total': total,
+            'phases': phases if phases else {'upload': total}}
+
+
+class TestHistory(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'history.sqlite')
+        self.time = [0]
+        self.history = History(self.path, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def clock(self):
+        self.time[0] += 1
+        return self.time[0]
+
+    def test_no_history(self):
+        self.assertIsNone(self.history.estimate('a.MapServer', 100))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_averages_recent_runs(self):
+        self.history.record([create_record('a.MapServer', 10, phases={'draft': 4, 'upload': 6})])
+        self.history.record([create_record('a.MapServer', 20, phases={'draft': 6, 'upload': 14})])
+        self.history.record([create_record('b.MapServer', 100)])
+        estimate = History(self.path).estimate('a.MapServer', 100)
+        self.assertEqual(estimate['total'], 15)
+        self.assertEqual(estimate['phases'], {'draft': 5, 'upload': 10})
+
+    def test_prefers_runs_with_the_same_input_size(self):
+        self.history.record([create_record('a.MapServer', 10, input_size=100)])
+        self.history.record([create_record('a.MapServer', 50, input_size=500)])
+        self.assertEqual(self.history.estimate('a.MapServer', 100)['total'], 10)
+
+    def test_scales_by_input_size(self):
+        self.history.record([create_record('a.MapServer', 10, input_size=100)])
+        estimate = self.history.estimate('a.MapServer', 300)
+        self.assertEqual(estimate['total'], 30)
+        self.assertEqual(estimate['phases'], {'upload': 30})
+
+    def test_unknown_input_size(self):
+        self.history.record([create_record('a.GPServer', 10, input_size=None)])
+        self.assertEqual(self.history.estimate('a.GPServer', None)['total'], 10)
+        self.assertEqual(self.history.estimate('a.GPServer', 100)['total'], 10)
+
+    def test_keeps_recent_runs(self):
+        for total in range(20):
+            self.history.record([create_record('a.MapServer', total)])
+        count = self.history._connect().execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+        self.assertEqual(count, 10)
+        self.assertEqual(self.history.estimate('a.MapServer', 100)['total'], 17)
+
+
+class TestScheduling(TestCase):
+
+    def test_order_longest_first(self):
+        self.assertEqual(order_longest_first(['a', 'b', 'c', 'd'], [1, 5, 1, 3]), ['b', 'd', 'a', 'c'])
+
+    def test_predict_duration(self):
+        self.assertEqual(predict_duration([1, 2, 3]), 6)
+        self.assertEqual(predict_duration([5, 4, 3, 3, 3], 2), 10)
+        self.assertEqual(predict_duration([10, 1, 1], 4), 10)
+        self.assertEqual(predict_duration([]), 0)
+
+    def test_progress(self):
+        time = [0]
+        progress = Progress({'a': 10, 'b': 10, 'c': 20}, predicted=40, clock=lambda: time[0])
+        time[0] = 5
+        self.assertEqual(progress.eta(), 35)
+        time[0] = 20
+        self.assertTrue(progress.complete('c'))
+        self.assertEqual(progress.eta(), 20)
+        self.assertFalse(progress.complete('unknown'))
+        progress.skip('b')
+        self.assertEqual(progress.eta(), 10)
+        self.assertEqual((progress.completed, progress.total), (1, 2))
+
+    def test_progress_without_prediction(self):
+        progress = Progress({'a': 1.0, 'b': 1.0}, clock=lambda: 0)
+        self.assertIsNone(progress.eta())
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(42.4), '42s')
+        self.assertEqual(format_duration(200), '3m 20s')
+        self.assertEqual(format_duration(3725), '1h 02m')
@@ -0,0 +1,80 @@
+from unittest import TestCase
+from mock import MagicMock
+from slap.inventory import ServiceInventory
+
+
+class TestServiceInventory(TestCase):
+
+    def setUp(self):
+        self.api = MagicMock()
+        listings = {
+            '': {
+                'folders': ['Maps', 'System'],
+                'services': [{'folderName': '/', 'serviceName': 'Root', 'type': 'MapServer'}]
+            },
+            'Maps': {
+                'services': [
+                    {'folderName': 'Maps', 'serviceName': 'Roads', 'type': 'MapServer'},
+                    {'folderName': 'Maps', 'serviceName': 'Imagery', 'type': 'ImageServer'},
+                    {'folderName': 'Maps', 'serviceName': 'Roads', 'type': 'FeatureServer'}
+                ]
+            }
+        }
+        self.api.list_services.side_effect = lambda folder: listings[folder]
+        self.inventory = ServiceInventory(self.api)
+
+    def test_exists_in_root(self):
+        self.assertTrue(self.inventory.exists('Root'))
+        self.assertTrue(self.inventory.exists('Root', None, 'MapServer'))
+        self.assertFalse(self.inventory.exists('Missing'))
+
+    def test_exists_in_folder(self):
+        self.assertTrue(self.inventory.exists('Roads', 'Maps', 'MapServer'))
+        self.assertTrue(self.inventory.exists('Imagery', 'Maps', 'ImageServer'))
+        self.assertFalse(self.inventory.exists('Imagery', 'Maps', 'MapServer'))
+
+    def test_get_types(self):
+        self.assertEqual(self.inventory.get_types('Roads', 'Maps'), set(['MapServer', 'FeatureServer']))
+
+    def test_lists_each_folder_once(self):
+        for name in ['Roads', 'Imagery', 'Missing', 'Roads']:
+            self.inventory.exists(name, 'Maps')
+        self.assertEqual(self.api.list_services.call_count, 2)
+
+    def test_missing_folder_is_empty(self):
+        self.assertFalse(self.inventory.exists('Roads', 'Nowhere'))
+        self.api.list_services.assert_called_once_with('')
+
+    def test_list_services(self):
+        self.assertEqual(self.inventory.list_services('Maps'), [
+            ('Imagery', 'ImageServer'),
+            ('Roads', 'FeatureServer'),
+            ('Roads', 'MapServer')
+        ])
+
+    def test_add(self):
+        self.inventory.exists('New', 'Nowhere')
+        self.inventory.add('New', 'Nowhere', 'MapServer')
+        self.assertTrue(self.inventory.exists('New', 'Nowhere', 'MapServer'))
+
+    def test_add_and_remove_skip_folders_not_listed(self):
+        self.inventory.add('New', 'Maps', 'MapServer')
+        self.inventory.remove('Roads', 'Maps', 'MapServer')
+        self.api.list_services.assert_not_called()
+
+    def test_remove(self):
+        self.inventory.exists('Roads', 'Maps')
+        self.inventory.remove('Roads', 'Maps', 'MapServer')
+        self.assertFalse(self.inventory.exists('Roads', 'Maps', 'MapServer'))
+        self.assertTrue(self.inventory.exists('Roads', 'Maps', 'FeatureServer'))
+        self.inventory.remove('Roads', 'Maps', 'FeatureServer')
+        self.assertFalse(self.inventory.exists('Roads', 'Maps'))
+
+    def test_invalidate(self):
+        self.inventory.exists('Roads', 'Maps')
+        self.inventory.invalidate('Maps')
+        self.inventory.exists('Roads', 'Maps')
+        self.assertEqual(self.api.list_services.call_count, 3)
+
+    def test_folder_names_are_normalized(self):
+        self.assertTrue(self.inventory.exists('Roads', '/Maps/'))
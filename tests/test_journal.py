@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from slap.journal import Journal
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_latest_phase(self):
+        journal = Journal(self.path)
+        journal.record('a.MapServer', 'staged', 'abc', sd='a.sd')
+        journal.record('a.MapServer', 'uploaded', 'abc')
+        self.assertEqual(journal.get_phase('a.MapServer', 'abc'), 'uploaded')
+        self.assertEqual(journal.get('a.MapServer', 'abc')['sd'], 'a.sd')
+
+    def test_ignores_changed_services(self):
+        journal = Journal(self.path)
+        journal.record('a.MapServer', 'staged', 'abc', sd='a.sd')
+        self.assertIsNone(journal.get_phase('a.MapServer', 'changed'))
+        self.assertIsNone(journal.get_phase('b.MapServer', 'abc'))
+
+    def test_resume_loads_previous_run(self):
+        Journal(self.path).record('a.MapServer', 'published', 'abc')
+        self.assertEqual(Journal(self.path, resume=True).get_phase('a.MapServer', 'abc'), 'published')
+
+    def test_new_run_starts_over(self):
+        Journal(self.path).record('a.MapServer', 'published', 'abc')
+        self.assertIsNone(Journal(self.path).get_phase('a.MapServer', 'abc'))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_failure_keeps_completed_phase(self):
+        journal = Journal(self.path)
+        journal.record('a.MapServer', 'staged', 'abc', sd='a.sd')
+        journal.record('a.MapServer', 'failed', 'abc', error='RuntimeError: upload failed')
+        journal = Journal(self.path, resume=True)
+        self.assertEqual(journal.get_phase('a.MapServer', 'abc'), 'staged')
+        self.assertEqual(journal.get('a.MapServer', 'abc')['error'], 'RuntimeError: upload failed')
+
+    def test_skips_partly_written_line(self):
+        journal = Journal(self.path)
+        journal.record('a.MapServer', 'staged', 'abc', sd='a.sd')
+        with open(self.path, 'a') as journal_file:
+            journal_file.write('{"service": "a.MapServer", "pha')
+        self.assertEqual(Journal(self.path, resume=True).get_phase('a.MapServer', 'abc'), 'staged')
@@ -0,0 +1,128 @@
+import time
+import threading
+from unittest import TestCase
+from slap.limiter import AdaptiveLimiter
+
+
+class TestAdaptiveLimiter(TestCase):
+
+    def setUp(self):
+        self.time = [0.0]
+        self.limiter = AdaptiveLimiter(floor=1, ceiling=8, warmup=3, clock=lambda: self.time[0])
+
+    def succeed(self, duration=1.0, key='call', size=None):
+        start = self.limiter.acquire()
+        self.time[0] += duration
+        self.limiter.record(key, duration, start, size=size)
+        self.limiter.release()
+
+    def fail(self):
+        start = self.limiter.acquire()
+        self.time[0] += 1
+        self.limiter.record('call', 1, start, error=True)
+        self.limiter.release()
+
+    def test_starts_at_floor(self):
+        self.assertEqual(AdaptiveLimiter(floor=2, ceiling=8).limit, 2)
+
+    def test_grows_to_ceiling(self):
+        for call in range(20):
+            self.succeed()
+        self.assertEqual(self.limiter.limit, 8)
+        self.assertEqual(self.limiter.highest, 8)
+
+    def test_halves_on_error(self):
+        for call in range(5):
+            self.succeed()
+        self.assertEqual(self.limiter.limit, 6)
+        self.fail()
+        self.assertEqual(self.limiter.limit, 3)
+        self.assertEqual(self.limiter.decreases, 1)
+
+    def test_grows_slowly_after_backing_off(self):
+        for call in range(3):
+            self.succeed()
+        self.fail()
+        self.assertEqual(self.limiter.limit, 2)
+        self.succeed()
+        self.succeed()
+        self.assertEqual(self.limiter.limit, 2)
+        self.succeed()
+        self.assertEqual(self.limiter.limit, 3)
+
+    def test_never_below_floor(self):
+        for call in range(5):
+            self.fail()
+        self.assertEqual(self.limiter.limit, 1)
+
+    def test_backs_off_when_latency_degrades(self):
+        for call in range(5):
+            self.succeed(duration=1.0)
+        self.succeed(duration=1.5)
+        self.assertEqual(self.limiter.limit, 7)
+        self.succeed(duration=5.0)
+        self.assertEqual(self.limiter.limit, 3)
+
+    def test_latency_is_per_key(self):
+        for call in range(5):
+            self.succeed(duration=1.0, key='exists')
+        self.succeed(duration=30.0, key='upload')
+        self.assertEqual(self.limiter.decreases, 0)
+
+    def test_latency_is_per_size(self):
+        for call in range(5):
+            self.succeed(duration=1.0, size=100)
+        self.succeed(duration=10.0, size=1000)
+        self.assertEqual(self.limiter.decreases, 0)
+        self.succeed(duration=10.0, size=100)
+        self.assertEqual(self.limiter.decreases, 1)
+
+    def test_backs_off_once_for_calls_running_together(self):
+        for call in range(5):
+            self.succeed()
+        starts = [self.limiter.acquire() for call in range(3)]
+        self.time[0] += 1
+        for start in starts:
+            self.limiter.record('call', 1, start, error=True)
+            self.limiter.release()
+        self.assertEqual(self.limiter.limit, 3)
+        self.assertEqual(self.limiter.decreases, 1)
+
+    def test_slot_records_errors(self):
+        with self.assertRaises(ValueError):
+            with self.limiter.slot():
+                raise ValueError('failed')
+        self.assertEqual(self.limiter.decreases, 1)
+        with self.limiter.slot():
+            pass
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_limits_concurrent_calls(self):
+        limiter = AdaptiveLimiter(floor=2, ceiling=2)
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def call():
+            with limiter.slot():
+                with lock:
+                    state['running'] += 1
+                    state['peak'] = max(state['peak'], state['running'])
+                time.sleep(0.01)
+                with lock:
+                    state['running'] -= 1
+
+        threads = [threading.Thread(target=call) for thread in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(state['peak'], 2)
+
+    def test_close_lets_waiting_calls_through(self):
+        limiter = AdaptiveLimiter(floor=1, ceiling=1)
+        limiter.acquire()
+        waiter = threading.Thread(target=limiter.acquire)
+        waiter.start()
+        limiter.close()
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
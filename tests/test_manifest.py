@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import patch
+from slap.manifest import Manifest, hash_file, hash_path, get_fingerprint
+
+
+class TestFingerprint(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'map.mxd')
+        self.write(self.path, 'some map')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def write(path, content):
+        with open(path, 'wb') as output:
+            output.write(content)
+
+    def test_hash_file_in_chunks(self):
+        self.write(self.path, 'x' * 1000)
+        self.assertEqual(hash_file(self.path, chunk_size=7), hash_file(self.path))
+
+    def test_hash_directory(self):
+        gdb = os.path.join(self.directory, 'data.gdb')
+        os.mkdir(gdb)
+        self.write(os.path.join(gdb, 'a'), 'a')
+        before = hash_path(gdb)
+        self.write(os.path.join(gdb, 'a'), 'b')
+        self.assertNotEqual(before, hash_path(gdb))
+
+    def test_hash_missing_path(self):
+        self.assertIsNone(hash_path(os.path.join(self.directory, 'missing')))
+
+    def test_fingerprint_changes_with_input(self):
+        before = get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path])
+        self.assertEqual(before, get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path]))
+        self.write(self.path, 'another map')
+        self.assertNotEqual(before, get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path]))
+
+    def test_fingerprint_changes_with_config(self):
+        self.assertNotEqual(get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path]),
+                            get_fingerprint('mapServices', {'input': 'map.mxd', 'json': {'a': 1}}, [self.path]))
+
+    def test_fingerprint_changes_with_server(self):
+        self.assertNotEqual(get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path], 'https://a/arcgis'),
+                            get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path], 'https://b/arcgis'))
+
+    def test_fingerprint_changes_with_version(self):
+        before = get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path])
+        with patch('slap.__version__', '99.0.0'):
+            self.assertNotEqual(before, get_fingerprint('mapServices', {'input': 'map.mxd'}, [self.path]))
+
+
+class TestManifest(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_manifest(self):
+        self.assertFalse(Manifest(self.path).is_current('a.MapServer', 'abc'))
+
+    def test_record_persists(self):
+        Manifest(self.path).record('a.MapServer', 'abc')
+        reloaded = Manifest(self.path)
+        self.assertTrue(reloaded.is_current('a.MapServer', 'abc'))
+        self.assertFalse(reloaded.is_current('a.MapServer', 'def'))
+
+    def test_remove(self):
+        Manifest(self.path).record('a.MapServer', 'abc')
+        Manifest(self.path).remove('a.MapServer')
+        self.assertIsNone(Manifest(self.path).get('a.MapServer'))
+
+    def test_corrupt_manifest(self):
+        with open(self.path, 'w') as output:
+            output.write('{not json')
+        self.assertIsNone(Manifest(self.path).get('a.MapServer'))
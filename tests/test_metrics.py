@@ -0,0 +1,65 @@
+from unittest import TestCase
+from slap.metrics import Metrics, percentile
+
+
+class TestMetrics(TestCase):
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary(self):
+        metrics = Metrics()
+        for duration in [0.3, 0.1, 0.2]:
+            metrics.record('edit', duration, status=200, size=10)
+        metrics.record('edit', 0.4, status=500, size=5, retries=2, error=True)
+        summary = metrics.summary()['edit']
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['retries'], 2)
+        self.assertEqual(summary['bytes'], 35)
+        self.assertEqual(summary['statuses'], {200: 3, 500: 1})
+        self.assertEqual(summary['p50'], 0.2)
+        self.assertEqual(summary['p95'], 0.4)
+        self.assertEqual(summary['max'], 0.4)
+        self.assertAlmostEqual(summary['total'], 1.0)
+
+    def test_summary_by_operation(self):
+        metrics = Metrics()
+        metrics.record('edit', 0.1)
+        metrics.record('exists', 0.1)
+        self.assertEqual(sorted(metrics.summary().keys()), ['edit', 'exists'])
+
+    def test_reset(self):
+        metrics = Metrics()
+        metrics.record('edit', 0.1)
+        metrics.reset()
+        self.assertEqual(metrics.summary(), {})
+
+    def test_merge(self):
+        worker = Metrics()
+        worker.record('edit', 0.2, status=200, size=10)
+        worker.record('exists', 0.1, status=200, retries=1)
+        metrics = Metrics()
+        metrics.record('edit', 0.4, status=500, error=True)
+        metrics.merge(worker.pop_stats())
+        summary = metrics.summary()
+        self.assertEqual(summary['edit']['count'], 2)
+        self.assertEqual(summary['edit']['statuses'], {200: 1, 500: 1})
+        self.assertEqual(summary['edit']['bytes'], 10)
+        self.assertEqual(summary['edit']['errors'], 1)
+        self.assertEqual(summary['exists']['retries'], 1)
+        self.assertEqual(worker.summary(), {})
+
+    def test_format_summary(self):
+        metrics = Metrics()
+        metrics.record('exists', 0.1)
+        metrics.record('edit', 2.5)
+        lines = metrics.format_summary().splitlines()
+        self.assertTrue(lines[0].startswith('operation'))
+        self.assertTrue(lines[1].startswith('edit'))
+        self.assertTrue(lines[2].startswith('exists'))
@@ -0,0 +1,165 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import MagicMock, patch
+from slap import parallel, profiling
+from slap.parallel import ParallelPublisher
+from slap.publisher import Publisher, PublishError
+from slap.limiter import AdaptiveLimiter
+from slap.fake_server import FakeArcGISServer
+mock_arcpy = MagicMock()
+module_patcher = patch.dict('sys.modules', {'arcpy': mock_arcpy})
+module_patcher.start()
+
+
+def fail_on_bad_input(service_type, config_entry):
+    if config_entry['input'] == 'bad':
+        raise ValueError('bad input')
+
+
+def record_api_call(service_type, config_entry):
+    parallel._publisher.api.metrics.record('edit', 0.1, status=200)
+
+
+def list_services(service_type, config_entry):
+    parallel._publisher.api.list_services()
+
+
+class TestPublishInWorker(TestCase):
+
+    def setUp(self):
+        self.publisher = MagicMock()
+        self.publisher.pop_deferred_starts.return_value = []
+        parallel._publisher = self.publisher
+
+    def tearDown(self):
+        parallel._publisher = None
+
+    def test_success(self):
+        result = parallel._publish_in_worker(('mapServices', {'input': 'foo'}))
+        self.publisher.publish_service.assert_called_once_with('mapServices', {'input': 'foo'})
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['input'], 'foo')
+        self.assertEqual(result['service_type'], 'mapServices')
+
+    def test_failure(self):
+        self.publisher.publish_service.side_effect = RuntimeError('Analysis contained errors')
+        result = parallel._publish_in_worker(('mapServices', {'input': 'foo'}))
+        self.assertFalse(result['ok'])
+        self.assertEqual(result['error'], 'RuntimeError: Analysis contained errors')
+        self.assertIn('Traceback', result['traceback'])
+
+    def test_returns_deferred_starts(self):
+        deferred = [{'service_name': 'foo', 'folder': None, 'service_type': 'MapServer'}]
+        self.publisher.pop_deferred_starts.return_value = deferred
+        result = parallel._publish_in_worker(('mapServices', {'input': 'foo'}))
+        self.assertEqual(result['deferred_starts'], deferred)
+
+
+    def test_returns_api_stats(self):
+        self.publisher.api.metrics.pop_stats.return_value = {'edit': {'durations': [0.1]}}
+        self.publisher.api.pop_connection_stats.return_value = {'requests': 2, 'connections': 1, 'reused': 1}
+        result = parallel._publish_in_worker(('mapServices', {'input': 'foo'}))
+        self.assertEqual(result['metrics'], {'edit': {'durations': [0.1]}})
+        self.assertEqual(result['connection_stats'], {'requests': 2, 'connections': 1, 'reused': 1})
+
+    def test_returns_trace_events(self):
+        def publish_service(service_type, config_entry):
+            with profiling.span('draft', 'phase'):
+                pass
+
+        self.publisher.publish_service.side_effect = publish_service
+        profiling.enable()
+        try:
+            result = parallel._publish_in_worker(('mapServices', {'input': 'foo'}))
+        finally:
+            profiling.disable()
+        self.assertEqual(result['trace_events'][-1]['name'], 'draft')
+
+
+class TestParallelPublisher(TestCase):
+
+    def setUp(self):
+        self.config = {
+            'agsUrl': 'my/server',
+            'mapServices': {
+                'services': [{'input': 'a'}, {'input': 'b'}, {'input': 'c'}]
+            }
+        }
+        self.directory = tempfile.mkdtemp()
+        self.config['manifest'] = os.path.join(self.directory, 'manifest.json')
+        self.config['history'] = os.path.join(self.directory, 'history.sqlite')
+        self.publisher = Publisher('user', 'pwd', self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_publishes_all_work_items(self):
+        with patch('slap.publisher.Publisher.publish_service'):
+            work_items = self.publisher.get_service_entries()
+            results = ParallelPublisher(self.publisher, 'user', 'pwd', 2).publish(work_items)
+        self.assertEqual(sorted(result['input'] for result in results), ['a', 'b', 'c'])
+        self.assertTrue(all(result['ok'] for result in results))
+
+    def test_merges_api_metrics_from_workers(self):
+        with patch('slap.publisher.Publisher.publish_service', side_effect=record_api_call):
+            ParallelPublisher(self.publisher, 'user', 'pwd', 2).publish(self.publisher.get_service_entries())
+        self.assertEqual(self.publisher.api.metrics.summary()['edit']['count'], 3)
+
+    def test_workers_record_through_transport(self):
+        recording = os.path.join(self.directory, 'recording.jsonl')
+        with FakeArcGISServer() as server:
+            self.publisher.config['agsUrl'] = server.url
+            open(recording, 'w').close()
+            with patch('slap.publisher.Publisher.publish_service', side_effect=list_services):
+                ParallelPublisher(self.publisher, 'user', 'pwd', 2,
+                                  {'record': recording, 'replay': None}).publish(self.publisher.get_service_entries())
+        with open(recording) as recording_file:
+            urls = [json.loads(line)['url'] for line in recording_file]
+        self.assertEqual(len([url for url in urls if url.endswith('/services/')]), 3)
+
+    def test_aggregates_failures(self):
+        with patch('slap.publisher.Publisher.publish_service', side_effect=fail_on_bad_input):
+            work_items = [('mapServices', {'input': 'a'}), ('mapServices', {'input': 'bad'})]
+            with self.assertRaises(PublishError) as context:
+                ParallelPublisher(self.publisher, 'user', 'pwd', 2).publish(work_items)
+        self.assertEqual([failure['input'] for failure in context.exception.failures], ['bad'])
+        self.assertIn('bad: ValueError: bad input', str(context.exception))
+
+    def test_publishes_through_limiter(self):
+        self.publisher.config['adaptiveConcurrency'] = {'floor': 1}
+        with patch('slap.publisher.Publisher.publish_service', side_effect=fail_on_bad_input):
+            with patch('slap.publisher.Publisher.message') as mock_message:
+                work_items = [('mapServices', {'input': 'a'}), ('mapServices', {'input': 'bad'})]
+                with self.assertRaises(PublishError):
+                    ParallelPublisher(self.publisher, 'user', 'pwd', 2).publish(work_items)
+                mock_message.assert_any_call('Publish jobs ran up to 1 at once, between 1 and 2; backed off 0 time(s), '
+                                             'ending at 1')
+
+    def test_records_upload_load(self):
+        limiter = AdaptiveLimiter(floor=1, ceiling=4)
+        start = limiter.acquire()
+        result = {'ok': False, 'timings': [{'phases': {'draft': 1, 'upload': 10}, 'sd_size': 100}]}
+        ParallelPublisher._record_load(limiter, result, start)
+        self.assertEqual(limiter.decreases, 1)
+
+        start = limiter.acquire()
+        ParallelPublisher._record_load(limiter, {'ok': False, 'timings': [{'phases': {'draft': 1}, 'sd_size': None}]},
+                                       start)
+        self.assertEqual(limiter.decreases, 1)
+        self.assertEqual(limiter._in_flight, 0)
+
+    def test_predicts_duration_across_jobs(self):
+        estimates = [{'total': 3, 'phases': {}}, {'total': 2, 'phases': {}}, {'total': 2, 'phases': {}}]
+        self.assertEqual(ParallelPublisher(self.publisher, 'user', 'pwd', 2).predict(estimates), 4)
+
+    def test_skips_unchanged_services(self):
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        with patch('slap.publisher.Publisher.publish_service'):
+            work_items = self.publisher.get_service_entries()
+            ParallelPublisher(self.publisher, 'user', 'pwd', 2).publish(work_items)
+            self.assertTrue(self.publisher.is_unchanged('mapServices', {'input': 'a'}))
+            self.assertEqual(ParallelPublisher(self.publisher, 'user', 'pwd', 2).publish(work_items), [])
@@ -0,0 +1,196 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from mock import MagicMock
+from slap.pipeline import Pipeline, PublishPipeline
+from slap.publisher import PublishError
+from slap.limiter import AdaptiveLimiter
+
+
+class TestPipeline(TestCase):
+
+    def test_runs_every_stage_in_order(self):
+        pipeline = Pipeline([
+            ('add', lambda value: value + 1, 1),
+            ('double', lambda value: value * 2, 2)
+        ])
+        jobs = pipeline.run([1, 2, 3, 4, 5])
+        self.assertEqual([job['value'] for job in jobs], [4, 6, 8, 10, 12])
+        self.assertEqual([job['item'] for job in jobs], [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(jobs[0]['timings']), ['add', 'double'])
+
+    def test_runs_with_no_items(self):
+        self.assertEqual(Pipeline([('noop', lambda value: value, 2)]).run([]), [])
+
+    def test_failed_jobs_skip_later_stages(self):
+        later = MagicMock(side_effect=lambda value: value)
+
+        def fail_on_two(value):
+            if value == 2:
+                raise ValueError('bad value')
+            return value
+
+        jobs = Pipeline([('check', fail_on_two, 1), ('later', later, 1)]).run([1, 2, 3])
+        self.assertEqual(later.call_count, 2)
+        self.assertEqual(jobs[1]['error'], 'ValueError: bad value')
+        self.assertEqual(jobs[1]['stage'], 'check')
+        self.assertIn('Traceback', jobs[1]['traceback'])
+        self.assertIsNone(jobs[0]['error'])
+
+    def test_calls_on_complete_for_each_job(self):
+        completed = []
+        Pipeline([('noop', lambda value: value, 1)]).run(['a', 'b'], completed.append)
+        self.assertEqual(sorted(job['value'] for job in completed), ['a', 'b'])
+
+    def test_overlaps_stages(self):
+        active = set()
+        overlapped = []
+        lock = threading.Lock()
+
+        def stage(name):
+            def run(value):
+                with lock:
+                    active.add(name)
+                    if len(active) > 1:
+                        overlapped.append(value)
+                time.sleep(0.02)
+                with lock:
+                    active.discard(name)
+                return value
+            return run
+
+        Pipeline([('local', stage('local'), 1), ('server', stage('server'), 1)]).run(range(5))
+        self.assertTrue(overlapped)
+
+    def test_stage_workers_run_concurrently(self):
+        start = time.time()
+        Pipeline([('slow', lambda value: time.sleep(0.1), 4)]).run(range(4))
+        self.assertLess(time.time() - start, 0.3)
+
+
+class TestPublishPipeline(TestCase):
+
+    def setUp(self):
+        self.publisher = MagicMock()
+        self.publisher.filter_unchanged.side_effect = lambda work_items: work_items
+        self.publisher.schedule.side_effect = lambda work_items, predict=None: work_items
+        self.publisher.create_limiter.return_value = None
+        self.publisher.reuse_staged.return_value = None
+        self.publisher.resume_job.return_value = None
+        self.publisher.draft_service.side_effect = lambda service_type, config_entry: {
+            'key': config_entry['input'] + '.MapServer', 'input': config_entry['input']}
+        self.publisher.stage_service.side_effect = lambda job: job
+        self.publisher.upload_service.side_effect = lambda job: job
+        self.publisher.configure_service.side_effect = lambda job: job
+
+    def test_publishes_through_every_step(self):
+        PublishPipeline(self.publisher).publish([('mapServices', {'input': 'foo'})])
+        self.publisher.draft_service.assert_called_once_with('mapServices', {'input': 'foo'})
+        job = {'key': 'foo.MapServer', 'input': 'foo'}
+        self.publisher.stage_service.assert_called_once_with(job)
+        self.publisher.upload_service.assert_called_once_with(job)
+        self.publisher.configure_service.assert_called_once_with(job)
+        self.publisher.record_published.assert_called_once_with('mapServices', {'input': 'foo'})
+
+    def test_skips_unchanged_services(self):
+        self.publisher.filter_unchanged.side_effect = lambda work_items: []
+        self.assertEqual(PublishPipeline(self.publisher).publish([('mapServices', {'input': 'foo'})]), [])
+        self.publisher.draft_service.assert_not_called()
+
+    def test_reuses_staged_service_definitions(self):
+        job = {'key': 'foo.MapServer', 'input': 'foo', 'staged': True}
+        self.publisher.reuse_staged.return_value = job
+        PublishPipeline(self.publisher).publish([('mapServices', {'input': 'foo'})])
+        self.publisher.draft_service.assert_not_called()
+        self.publisher.stage_service.assert_not_called()
+        self.publisher.upload_service.assert_called_once_with(job)
+
+    def test_resumes_uploaded_services(self):
+        job = {'key': 'foo.MapServer', 'input': 'foo', 'staged': True, 'uploaded': True}
+        self.publisher.resume_job.return_value = job
+        PublishPipeline(self.publisher).publish([('mapServices', {'input': 'foo'})])
+        self.publisher.reuse_staged.assert_not_called()
+        self.publisher.upload_service.assert_not_called()
+        self.publisher.configure_service.assert_called_once_with(job)
+
+    def test_updates_manifest(self):
+        self.publisher.upload_service.side_effect = RuntimeError('upload failed')
+        with self.assertRaises(PublishError):
+            PublishPipeline(self.publisher).publish([('mapServices', {'input': 'foo'})])
+        self.publisher.forget_published.assert_called_once_with('mapServices', {'input': 'foo'},
+                                                                'RuntimeError: upload failed')
+        self.publisher.record_published.assert_not_called()
+
+    def test_schedules_work(self):
+        self.publisher.schedule.side_effect = lambda work_items, predict=None: list(reversed(work_items))
+        pipeline = PublishPipeline(self.publisher, {'draft': 1, 'stage': 1, 'upload': 1, 'configure': 1}, 1)
+        pipeline.publish([('mapServices', {'input': 'short'}), ('mapServices', {'input': 'long'})])
+        self.assertEqual(self.publisher.schedule.call_args[0][1], pipeline.predict)
+        self.assertEqual([args[0][1]['input'] for args in self.publisher.draft_service.call_args_list],
+                         ['long', 'short'])
+
+    def test_predicts_the_slowest_stage(self):
+        pipeline = PublishPipeline(self.publisher, {'upload': 2})
+        estimates = [{'total': 12, 'phases': {'draft': 2, 'stage': 1, 'upload': 9}},
+                     {'total': 12, 'phases': {'draft': 2, 'stage': 1, 'upload': 9}}]
+        self.assertEqual(pipeline.predict(estimates), 9)
+        estimates = [{'total': 5, 'phases': {'analyze': 3, 'stage': 1, 'upload': 1}}] * 3
+        self.assertEqual(pipeline.predict(estimates), 12)
+
+    def test_uploads_through_limiter(self):
+        directory = tempfile.mkdtemp()
+        try:
+            limiter = self.publisher.create_limiter.return_value = AdaptiveLimiter(floor=1, ceiling=2)
+            self.publisher.draft_service.side_effect = lambda service_type, config_entry: {
+                'key': config_entry['input'] + '.MapServer', 'input': config_entry['input'],
+                'sd': os.path.join(directory, config_entry['input'] + '.sd')}
+            for name in ['a', 'b']:
+                with open(os.path.join(directory, name + '.sd'), 'w') as sd:
+                    sd.write('sd')
+            self.publisher.upload_service.side_effect = [{'input': 'a'}, RuntimeError('upload failed')]
+            pipeline = PublishPipeline(self.publisher, {'upload': 2})
+            self.publisher.create_limiter.assert_called_once_with(2)
+            with self.assertRaises(PublishError):
+                pipeline.publish([('mapServices', {'input': 'a'}), ('mapServices', {'input': 'b'})])
+            self.assertEqual(limiter.decreases, 1)
+            self.assertEqual(limiter._baselines['upload'][0], 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_overrides_default_workers(self):
+        pipeline = PublishPipeline(self.publisher, {'upload': 4})
+        self.assertEqual(pipeline.workers, {'draft': 1, 'stage': 1, 'upload': 4, 'configure': 2})
+
+    def test_raises_publish_error_with_every_failure(self):
+        def fail_on_bad_input(job):
+            if job['input'] == 'bad':
+                raise RuntimeError('upload failed')
+            return job
+
+        self.publisher.upload_service.side_effect = fail_on_bad_input
+        work_items = [('mapServices', {'input': 'bad'}), ('mapServices', {'input': 'good'})]
+        with self.assertRaises(PublishError) as context:
+            PublishPipeline(self.publisher).publish(work_items)
+        self.assertEqual(context.exception.failures, [{'input': 'bad', 'error': 'RuntimeError: upload failed'}])
+        self.assertEqual(self.publisher.configure_service.call_count, 1)
+
+    def test_drafting_and_staging_never_overlap(self):
+        active = []
+        overlapped = []
+
+        def arcpy_call(*args):
+            active.append(1)
+            if len(active) > 1:
+                overlapped.append(args)
+            time.sleep(0.01)
+            active.pop()
+            return {'key': 'foo.MapServer', 'input': 'foo'}
+
+        self.publisher.draft_service.side_effect = arcpy_call
+        self.publisher.stage_service.side_effect = arcpy_call
+        work_items = [('mapServices', {'input': str(i)}) for i in range(5)]
+        PublishPipeline(self.publisher, {'draft': 2, 'stage': 2}).publish(work_items)
+        self.assertEqual(overlapped, [])
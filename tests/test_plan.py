@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import MagicMock
+from slap.plan import Planner, format_plan
+from slap.publisher import Publisher
+from slap.manifest import Manifest
+
+
+class TestPlanner(TestCase):
+
+    def setUp(self):
+        self.entries = [
+            {'input': 'new.mxd'},
+            {'input': 'changed.mxd'},
+            {'input': 'same.mxd'},
+            {'input': 'drifted.mxd', 'json': {'minInstancesPerNode': 2}}
+        ]
+        config = {'agsUrl': 'http://server/arcgis/admin', 'mapServices': {'services': self.entries}}
+        self.directory = tempfile.mkdtemp()
+        self.publisher = Publisher('user', 'pwd', config)
+        self.publisher.manifest = Manifest(os.path.join(self.directory, 'manifest.json'))
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.side_effect = lambda name, folder, service_type: name != 'new'
+        self.publisher.api = MagicMock()
+        self.publisher.api.get_params_many.return_value = [{'minInstancesPerNode': 1}]
+        for entry in self.entries[2:]:
+            self.publisher.record_published('mapServices', entry)
+        self.work_items = self.publisher.get_service_entries()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_actions(self, changed=None):
+        actions = Planner(self.publisher).plan(self.work_items, changed)
+        return [(action['input'], action['action']) for action in actions]
+
+    def test_plan(self):
+        self.assertEqual(self.get_actions(), [
+            ('new.mxd', 'create'),
+            ('changed.mxd', 'replace'),
+            ('same.mxd', 'skip'),
+            ('drifted.mxd', 'update-json')
+        ])
+        self.publisher.api.get_params_many.assert_called_once_with([
+            {'service_name': 'drifted', 'folder': None, 'service_type': 'MapServer'}
+        ])
+
+    def test_plan_creates_unchanged_service_missing_on_server(self):
+        self.publisher.record_published('mapServices', self.entries[0])
+        action = Planner(self.publisher).plan(self.work_items[:1])[0]
+        self.assertEqual((action['action'], action['reason']), ('create', 'unchanged, but missing on server'))
+
+    def test_plan_json_already_applied(self):
+        self.publisher.api.get_params_many.return_value = [{'minInstancesPerNode': 2}]
+        self.assertEqual(self.get_actions()[3], ('drifted.mxd', 'skip'))
+
+    def test_plan_force(self):
+        self.publisher.force = True
+        self.assertEqual([action for input_path, action in self.get_actions()],
+                         ['create', 'replace', 'replace', 'replace'])
+
+    def test_plan_git(self):
+        changed = set([id(self.entries[0]), id(self.entries[2])])
+        self.assertEqual([action for input_path, action in self.get_actions(changed)],
+                         ['create', 'skip', 'skip', 'update-json'])
+
+    def test_does_not_load_arcpy(self):
+        self.get_actions()
+        self.assertIsNone(self.publisher._arcpy_helper)
+
+    def test_format_plan(self):
+        actions = Planner(self.publisher).plan(self.work_items)
+        output = format_plan(actions)
+        self.assertIn('create       new.MapServer', output)
+        self.assertIn('update-json  drifted.MapServer                       minInstancesPerNode', output)
+        self.assertTrue(output.endswith('Plan: 1 create, 1 replace, 1 update-json, 1 skip'))
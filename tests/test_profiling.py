@@ -0,0 +1,113 @@
+import os
+import json
+import pstats
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from slap import profiling
+from slap.profiling import Tracer, span
+
+
+class TestTracer(TestCase):
+
+    def test_records_complete_events(self):
+        tracer = Tracer()
+        with tracer.span('edit', 'rest', method='POST'):
+            pass
+        metadata, event = tracer.events
+        self.assertEqual(metadata['ph'], 'M')
+        self.assertEqual(metadata['args']['name'], threading.current_thread().name)
+        self.assertEqual(event['name'], 'edit')
+        self.assertEqual(event['cat'], 'rest')
+        self.assertEqual(event['ph'], 'X')
+        self.assertEqual(event['pid'], os.getpid())
+        self.assertEqual(event['args'], {'method': 'POST'})
+        self.assertGreaterEqual(event['dur'], 0)
+
+    def test_records_spans_that_raise(self):
+        tracer = Tracer()
+        with self.assertRaises(ValueError):
+            with tracer.span('draft', 'phase'):
+                raise ValueError('bad')
+        self.assertEqual(tracer.events[-1]['name'], 'draft')
+
+    def test_names_each_thread_once(self):
+        tracer = Tracer()
+        started = threading.Event()
+
+        def work():
+            # Both threads stay alive until each has started, so they can't share a thread id
+            started.wait()
+            for i in range(3):
+                with tracer.span('upload', 'phase'):
+                    pass
+
+        threads = [threading.Thread(target=work, name='worker-{0}'.format(i)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        started.set()
+        for thread in threads:
+            thread.join()
+        names = [event['args']['name'] for event in tracer.events if event['ph'] == 'M']
+        self.assertEqual(sorted(names), ['worker-0', 'worker-1'])
+        self.assertEqual(len([event for event in tracer.events if event['ph'] == 'X']), 6)
+
+    def test_pop_and_add_events(self):
+        tracer = Tracer()
+        with tracer.span('stage', 'phase'):
+            pass
+        events = tracer.pop_events()
+        self.assertEqual(tracer.events, [])
+        other = Tracer()
+        other.add_events(events)
+        self.assertEqual(other.events, events)
+
+    def test_write(self):
+        directory = tempfile.mkdtemp()
+        try:
+            tracer = Tracer()
+            with tracer.span('stage', 'phase'):
+                pass
+            path = os.path.join(directory, 'trace.json')
+            tracer.write(path)
+            with open(path) as trace:
+                self.assertEqual(json.load(trace)['traceEvents'][-1]['name'], 'stage')
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestProfiling(TestCase):
+
+    def tearDown(self):
+        profiling.disable()
+
+    def test_span_is_a_no_op_when_disabled(self):
+        with span('edit', 'rest'):
+            pass
+        self.assertIsNone(profiling.get_tracer())
+
+    def test_span_records_when_enabled(self):
+        profiling.enable()
+        with span('edit', 'rest'):
+            pass
+        self.assertEqual(profiling.get_tracer().events[-1]['name'], 'edit')
+
+    def test_settings_round_trip(self):
+        profiling.enable(profile_path='trace-{pid}.prof')
+        settings = profiling.get_settings()
+        profiling.disable()
+        self.assertEqual(settings, {'trace': True, 'profile_path': 'trace-{pid}.prof'})
+        profiling.enable_from_settings(settings)
+        self.assertIsNotNone(profiling.get_tracer())
+
+    def test_dump_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            profiling.enable(profile_path=os.path.join(directory, 'trace-{pid}.prof'))
+            sum(range(100))
+            profiling.dump_profile()
+            path = os.path.join(directory, 'trace-{0}.prof'.format(os.getpid()))
+            self.assertTrue(pstats.Stats(path).total_calls > 0)
+        finally:
+            shutil.rmtree(directory)
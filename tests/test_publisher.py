@@ -1,9 +1,17 @@
 from os import path
 import json
+import shutil
+import tempfile
 import unittest
 from unittest import TestCase
 from mock import MagicMock, patch, call
 from slap.publisher import Publisher
+from slap.manifest import Manifest
+from slap.artifacts import ArtifactCache
+from slap.data_sources import RegistrationCache
+from slap.journal import Journal
+from slap.history import History
+from slap.publisher import PublishError
 
 
 class TestMapServicePublisher(TestCase):
@@ -20,6 +28,11 @@ class TestMapServicePublisher(TestCase):
             }
         }
         self.publisher = Publisher('user', 'pwd', config)
+        self.directory = tempfile.mkdtemp()
+        self.publisher.manifest = Manifest(path.join(self.directory, 'manifest.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
 
     def test_publish_all(self):
         expected_calls = [call(x) for x in self.publisher.config_parser.service_types]
@@ -50,7 +63,7 @@ class TestMapServicePublisher(TestCase):
         with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
             mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
             with patch('slap.publisher.Publisher.publish_sd_draft') as mock_publish_sd_draft:
-                self.publisher.publish_service('some_type', {'input': 'some/input'})
+                self.publisher.publish_service('mapServices', {'input': 'some/input'})
                 mock_publish_sd_draft.assert_called_once()
 
     def test_publish_service_with_errors(self):
@@ -58,9 +71,466 @@ class TestMapServicePublisher(TestCase):
             mock_publish_method.return_value = MagicMock(return_value={'errors': {'something': 'bad'}})
             with patch('slap.publisher.Publisher.publish_sd_draft') as mock_publish_sd_draft:
                 with self.assertRaises(RuntimeError):
-                    self.publisher.publish_service('some_type', {'input': 'some/input'})
+                    self.publisher.publish_service('mapServices', {'input': 'some/input'})
                 mock_publish_sd_draft.assert_not_called()
 
+    def test_publish_service_records_fingerprint(self):
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        with patch('slap.publisher.Publisher.draft_service') as mock_draft:
+            with patch('slap.publisher.Publisher.publish_sd_draft'):
+                mock_draft.return_value = {'input': 'foo', 'sddraft': None, 'sd': None, 'service_name': 'foo',
+                                           'folder_name': None, 'initial_state': 'STARTED', 'json': {},
+                                           'service_type': 'MapServer'}
+                self.publisher.publish_service('mapServices', {'input': 'foo'})
+                self.publisher.publish_service('mapServices', {'input': 'foo'})
+                mock_draft.assert_called_once_with('mapServices', {'input': 'foo'})
+                self.assertTrue(self.publisher.is_unchanged('mapServices', {'input': 'foo'}))
+                self.assertFalse(self.publisher.is_unchanged('mapServices', {'input': 'foo', 'summary': 'new'}))
+
+    def test_publish_service_records_timings(self):
+        self.publisher.measure_downtime = True
+        with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+            mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
+            with patch('slap.esri.ArcpyHelper.stage_service_definition'):
+                with patch('slap.esri.ArcpyHelper.upload_service_definition'):
+                    self.publisher.inventory = MagicMock()
+                    self.publisher.api = MagicMock()
+                    self.publisher.publish_service('mapServices', {'input': 'foo'})
+        record = self.publisher.timer.records[0]
+        self.assertEqual(record['service'], 'foo.MapServer')
+        self.assertEqual(sorted(record['phases']), ['delete', 'stage', 'upload', 'wait'])
+        self.assertIsNotNone(record['unavailable'])
+
+    def test_publish_service_force(self):
+        self.publisher.force = True
+        self.publisher.record_published('mapServices', {'input': 'foo'})
+        with patch('slap.publisher.Publisher.draft_service') as mock_draft:
+            with patch('slap.publisher.Publisher.stage_service'), patch('slap.publisher.Publisher.publish_sd_draft'):
+                mock_draft.return_value = {'input': 'foo', 'sddraft': None, 'sd': None, 'service_name': 'foo',
+                                           'folder_name': None, 'initial_state': 'STARTED', 'json': {},
+                                           'service_type': 'MapServer'}
+                self.publisher.publish_service('mapServices', {'input': 'foo'})
+                mock_draft.assert_called_once_with('mapServices', {'input': 'foo'})
+
+    def test_publish_service_failure_forgets_fingerprint(self):
+        self.publisher.record_published('mapServices', {'input': 'foo'})
+        self.publisher.force = True
+        with patch('slap.publisher.Publisher.draft_service', side_effect=RuntimeError('Analysis failed')):
+            with self.assertRaises(RuntimeError):
+                self.publisher.publish_service('mapServices', {'input': 'foo'})
+        self.publisher.force = False
+        self.assertFalse(self.publisher.is_unchanged('mapServices', {'input': 'foo'}))
+
+    def test_fingerprint_changes_with_server(self):
+        config = {'agsUrl': 'https://a/arcgis/admin', 'mapServices': {'services': [{'input': 'foo'}]}}
+        before = Publisher('user', 'pwd', config).get_fingerprint('mapServices', {'input': 'foo'})
+        config = {'agsUrl': 'https://a/arcgis/admin', 'mapServices': {'services': [{'input': 'foo'}]}}
+        after = Publisher('user', 'pwd', config, 'b').get_fingerprint('mapServices', {'input': 'foo'})
+        self.assertNotEqual(before, after)
+
+    def test_fingerprint_ignores_top_level_settings(self):
+        before = self.publisher.get_fingerprint('mapServices', {'input': 'foo'})
+        self.publisher.config.update({'dataSources': {'foo': 'bar'}, 'verifyCerts': False, 'site': 'x', 'poolSize': 2})
+        entry = {'input': 'foo', 'dataSources': {'foo': 'bar'}, 'verifyCerts': False, 'site': 'x', 'poolSize': 2}
+        self.assertEqual(before, self.publisher.get_fingerprint('mapServices', entry))
+
+    def test_fingerprint_keeps_top_level_service_settings(self):
+        before = self.publisher.get_fingerprint('mapServices', {'input': 'foo'})
+        self.publisher.config['json'] = {'maxRecordCount': 1}
+        self.assertNotEqual(before, self.publisher.get_fingerprint('mapServices', {'input': 'foo', 'json': {
+            'maxRecordCount': 1}}))
+
+    def test_fingerprint_keeps_settings_set_on_the_service(self):
+        before = self.publisher.get_fingerprint('mapServices', {'input': 'foo'})
+        self.assertNotEqual(before, self.publisher.get_fingerprint('mapServices', {'input': 'foo', 'extra': 1}))
+        self.publisher.config['mapServices']['verifyCerts'] = False
+        self.publisher.config['verifyCerts'] = False
+        self.assertNotEqual(before, self.publisher.get_fingerprint('mapServices', {'input': 'foo',
+                                                                                   'verifyCerts': False}))
+
+    def test_fingerprints_each_input_once_until_drafted(self):
+        self.publisher.journal = Journal(path.join(self.directory, 'journal.jsonl'))
+        with patch('slap.publisher.get_fingerprint', return_value='abc') as mock_fingerprint:
+            with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+                mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
+                with patch('slap.publisher.Publisher.stage_service'):
+                    with patch('slap.publisher.Publisher.publish_sd_draft'):
+                        self.publisher.get_skip_reason('mapServices', {'input': 'foo'})
+                        self.assertEqual(mock_fingerprint.call_count, 1)
+                        self.publisher.publish_service('mapServices', {'input': 'foo'})
+        # Once before drafting, which may save the map document, and once after
+        self.assertEqual(mock_fingerprint.call_count, 2)
+
+    def test_artifact_key_ignores_server(self):
+        config = {'agsUrl': 'https://a/arcgis/admin', 'mapServices': {'services': [{'input': 'foo'}]}}
+        before = Publisher('user', 'pwd', config).get_artifact_key('mapServices', {'input': 'foo'})
+        config = {'agsUrl': 'https://a/arcgis/admin', 'mapServices': {'services': [{'input': 'foo'}]}}
+        after = Publisher('user', 'pwd', config, 'b').get_artifact_key('mapServices', {'input': 'foo'})
+        self.assertEqual(before, after)
+
+    def test_artifact_key_ignores_settings_applied_after_upload(self):
+        self.assertEqual(self.publisher.get_artifact_key('mapServices', {'input': 'foo'}),
+                         self.publisher.get_artifact_key('mapServices', {'input': 'foo', 'json': {'a': 1},
+                                                                         'initialState': 'STOPPED'}))
+        self.assertNotEqual(self.publisher.get_artifact_key('mapServices', {'input': 'foo'}),
+                            self.publisher.get_artifact_key('mapServices', {'input': 'foo', 'summary': 'new'}))
+
+    def test_publish_service_caches_staged_service_definition(self):
+        self.publisher.artifact_cache = ArtifactCache(path.join(self.directory, 'cache'))
+        self.publisher.force = True
+        config_entry = {'input': 'foo', 'output': path.join(self.directory, 'output')}
+
+        def stage(sddraft, sd):
+            with open(sd, 'wb') as sd_file:
+                sd_file.write('staged')
+
+        with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+            mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
+            with patch('slap.esri.ArcpyHelper.stage_service_definition', side_effect=stage) as mock_stage:
+                with patch('slap.publisher.Publisher.publish_sd_draft') as mock_publish_sd_draft:
+                    self.publisher.publish_service('mapServices', config_entry)
+                    self.publisher.publish_service('mapServices', config_entry)
+                    mock_publish_method.assert_called_once_with('mapServices')
+                    mock_stage.assert_called_once()
+                    self.assertEqual(mock_publish_sd_draft.call_count, 2)
+
+    def test_caches_staged_service_definition_after_drafting_saves_input(self):
+        self.publisher.artifact_cache = ArtifactCache(path.join(self.directory, 'cache'))
+        self.publisher.force = True
+        input_path = path.join(self.directory, 'map.mxd')
+        with open(input_path, 'w') as input_file:
+            input_file.write('before')
+        config_entry = {'input': input_path, 'output': path.join(self.directory, 'output'), 'workspaces': []}
+
+        def publish_mxd(config_entry, filename, sddraft, replace=False):
+            # Replacing workspaces saves the map document
+            with open(input_path, 'w') as input_file:
+                input_file.write('after')
+            return {'errors': {}}
+
+        def stage(sddraft, sd):
+            with open(sd, 'wb') as sd_file:
+                sd_file.write('staged')
+
+        with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+            mock_publish_method.return_value = MagicMock(side_effect=publish_mxd)
+            with patch('slap.esri.ArcpyHelper.stage_service_definition', side_effect=stage) as mock_stage:
+                with patch('slap.publisher.Publisher.publish_sd_draft'):
+                    self.publisher.publish_service('mapServices', config_entry)
+                    self.publisher.publish_service('mapServices', config_entry)
+                    mock_publish_method.assert_called_once_with('mapServices')
+                    mock_stage.assert_called_once()
+
+    def test_keep_going_reports_every_failure(self):
+        self.publisher.keep_going = True
+        self.publisher.config = {'mapServices': {'services': [{'input': 'a'}, {'input': 'b'}, {'input': 'c'}]}}
+
+        def publish_service(service_type, config_entry):
+            if config_entry['input'] != 'b':
+                raise RuntimeError('failed')
+
+        with patch('slap.publisher.Publisher.publish_service', side_effect=publish_service) as mock_publish:
+            self.publisher.publish_services('mapServices')
+            self.assertEqual(mock_publish.call_count, 3)
+        with self.assertRaises(PublishError) as context:
+            self.publisher.raise_failures()
+        self.assertEqual([failure['input'] for failure in context.exception.failures], ['a', 'c'])
+        self.publisher.raise_failures()  # the failures have been reported
+
+    def test_stops_at_first_failure_by_default(self):
+        self.publisher.config = {'mapServices': {'services': [{'input': 'a'}, {'input': 'b'}]}}
+        with patch('slap.publisher.Publisher.publish_service', side_effect=RuntimeError('failed')) as mock_publish:
+            with self.assertRaises(RuntimeError):
+                self.publisher.publish_services('mapServices')
+            self.assertEqual(mock_publish.call_count, 1)
+
+    def test_resume_job_after_staging(self):
+        self.publisher.journal = Journal(path.join(self.directory, 'journal.jsonl'))
+        config_entry = {'input': 'foo', 'output': path.join(self.directory, 'output')}
+        sd = path.join(self.directory, 'foo.sd')
+        open(sd, 'w').close()
+        fingerprint = self.publisher.get_fingerprint('mapServices', config_entry)
+        self.publisher.journal.record('foo.MapServer', 'staged', fingerprint, sd=sd, replace=True)
+        job = self.publisher.resume_job('mapServices', config_entry)
+        self.assertEqual(job['sd'], sd)
+        self.assertTrue(job['staged'])
+        self.assertTrue(job['replace'])
+        self.assertFalse(job['uploaded'])
+
+    def test_resume_job_needs_staged_service_definition(self):
+        self.publisher.journal = Journal(path.join(self.directory, 'journal.jsonl'))
+        fingerprint = self.publisher.get_fingerprint('mapServices', {'input': 'foo'})
+        self.publisher.journal.record('foo.MapServer', 'staged', fingerprint, sd=path.join(self.directory, 'gone.sd'))
+        self.assertIsNone(self.publisher.resume_job('mapServices', {'input': 'foo'}))
+
+    def test_skips_services_published_before_interruption(self):
+        self.publisher.force = True
+        self.publisher.journal = Journal(path.join(self.directory, 'journal.jsonl'))
+        self.publisher.record_published('mapServices', {'input': 'foo'})
+        with patch('slap.publisher.Publisher.draft_service') as mock_draft:
+            self.publisher.publish_service('mapServices', {'input': 'foo'})
+            mock_draft.assert_not_called()
+
+    def test_failure_is_journaled(self):
+        self.publisher.journal = Journal(path.join(self.directory, 'journal.jsonl'))
+        with patch('slap.publisher.Publisher.draft_service', side_effect=RuntimeError('Analysis failed')):
+            with self.assertRaises(RuntimeError):
+                self.publisher.publish_service('mapServices', {'input': 'foo'})
+        fingerprint = self.publisher.get_fingerprint('mapServices', {'input': 'foo'})
+        self.assertEqual(self.publisher.journal.get('foo.MapServer', fingerprint)['error'],
+                         'RuntimeError: Analysis failed')
+
+    def record_history(self, service, total):
+        self.publisher.history.record([{'service': service, 'input_size': None, 'total': total, 'phases': {}}])
+
+    def test_adaptive_concurrency_off_by_default(self):
+        self.assertIsNone(self.publisher.create_limiter(4))
+        self.assertIsNone(self.publisher.api.limiter)
+
+    def test_create_limiter(self):
+        self.publisher.config['adaptiveConcurrency'] = {'floor': 2, 'ceiling': 6, 'latencyTolerance': 3}
+        limiter = self.publisher.create_limiter(4)
+        self.assertEqual((limiter.floor, limiter.ceiling, limiter.tolerance, limiter.backoff), (2, 4, 3, 0.5))
+        self.assertEqual(self.publisher.create_limiter(10).ceiling, 6)
+
+    def test_admin_calls_use_limiter(self):
+        publisher = Publisher('user', 'pwd', {'agsUrl': 'my/server', 'maxWorkers': 12, 'adaptiveConcurrency': True})
+        self.assertEqual((publisher.api.limiter.floor, publisher.api.limiter.ceiling), (1, 12))
+
+    def create_inputs(self, sizes):
+        work_items = []
+        for name, size in sizes:
+            input_path = path.join(self.directory, name + '.mxd')
+            with open(input_path, 'w') as input_file:
+                input_file.write('x' * size)
+            work_items.append(('mapServices', {'input': input_path}))
+        return work_items
+
+    def test_select_shard_by_size(self):
+        work_items = self.create_inputs([('a', 10), ('b', 50), ('c', 20), ('d', 30)])
+        with patch('slap.publisher.Publisher.message'):
+            first = self.publisher.select_shard(work_items, 1, 2)
+            plan = self.publisher.shard['plan']
+            second = self.publisher.select_shard(work_items, 2, 2)
+        self.assertEqual(first, [work_items[0], work_items[1]])
+        self.assertEqual(second, [work_items[2], work_items[3]])
+        self.assertEqual(self.publisher.shard, {'index': 2, 'count': 2, 'plan': plan,
+                                                'services': ['c.MapServer', 'd.MapServer']})
+
+    def test_select_shard_by_shared_history(self):
+        work_items = self.create_inputs([('a', 10), ('b', 50), ('c', 20), ('d', 30)])
+        self.publisher.config['history'] = path.join(self.directory, 'history.sqlite')
+        self.record_history('a.MapServer', 100)
+        self.record_history('b.MapServer', 10)
+        with patch('slap.publisher.Publisher.message'):
+            self.assertEqual(self.publisher.select_shard(work_items, 1, 2), [work_items[0]])
+
+    def test_select_shard_ignores_local_history(self):
+        work_items = self.create_inputs([('a', 10), ('b', 50)])
+        history = MagicMock()
+        self.publisher._history = history
+        with patch('slap.publisher.Publisher.message'):
+            self.publisher.select_shard(work_items, 1, 2)
+        history.estimate.assert_not_called()
+
+    def test_records_skipped_services(self):
+        with patch('slap.publisher.Publisher.is_unchanged', return_value=True):
+            self.publisher.publish_entries([('mapServices', {'input': 'a'})])
+        self.assertEqual(self.publisher.skipped, ['a.MapServer'])
+
+    def test_schedule_orders_longest_first(self):
+        self.publisher.config['history'] = path.join(self.directory, 'history.sqlite')
+        self.record_history('a.MapServer', 10)
+        self.record_history('b.MapServer', 60)
+        work_items = [('mapServices', {'input': 'a'}), ('mapServices', {'input': 'b'}), ('mapServices', {'input': 'c'})]
+        with patch('slap.publisher.Publisher.message') as mock_message:
+            scheduled = self.publisher.schedule(work_items)
+            mock_message.assert_called_once_with('Expecting 3 services to take about 1m 45s (1 never published before)')
+        self.assertEqual([config_entry['input'] for service_type, config_entry in scheduled], ['b', 'c', 'a'])
+        self.assertEqual(self.publisher.progress.predicted, 105)
+
+    def test_schedule_uses_predict(self):
+        self.publisher.config['history'] = path.join(self.directory, 'history.sqlite')
+        self.record_history('a.MapServer', 10)
+        predict = MagicMock(return_value=5)
+        self.publisher.schedule([('mapServices', {'input': 'a'})], predict)
+        predict.assert_called_once_with([{'total': 10, 'phases': {}}])
+        self.assertEqual(self.publisher.progress.predicted, 5)
+
+    def test_schedule_without_history(self):
+        self.publisher.config['history'] = path.join(self.directory, 'history.sqlite')
+        work_items = [('mapServices', {'input': 'a'}), ('mapServices', {'input': 'b'})]
+        self.assertEqual(self.publisher.schedule(work_items), work_items)
+        self.assertIsNone(self.publisher.progress.predicted)
+        self.assertEqual(self.publisher.progress.total, 2)
+
+    def test_schedule_disabled(self):
+        self.publisher.config['history'] = False
+        work_items = [('mapServices', {'input': 'a'})]
+        self.assertEqual(self.publisher.schedule(work_items), work_items)
+        self.assertIsNone(self.publisher.progress)
+
+    def test_reports_progress(self):
+        self.publisher.progress = MagicMock()
+        self.publisher.progress.completed, self.publisher.progress.total = 1, 2
+        self.publisher.progress.eta.return_value = 30
+        with patch('slap.publisher.Publisher.message') as mock_message:
+            self.publisher.record_published('mapServices', {'input': 'a'})
+            self.publisher.progress.complete.assert_called_once_with('a.MapServer')
+            mock_message.assert_called_once_with('1/2 services done, about 30s left')
+
+    def test_record_history(self):
+        self.publisher.config['history'] = path.join(self.directory, 'history.sqlite')
+        with self.publisher.timer.service('a.MapServer', 'a'):
+            pass
+        with self.publisher.timer.service('b.MapServer', 'b'):
+            self.publisher.timer.set('resumed', True)
+        with self.assertRaises(RuntimeError):
+            with self.publisher.timer.service('c.MapServer', 'c'):
+                raise RuntimeError('failed')
+        self.publisher.record_history()
+        history = History(path.join(self.directory, 'history.sqlite'))
+        self.assertIsNotNone(history.estimate('a.MapServer'))
+        self.assertIsNone(history.estimate('b.MapServer'))
+        self.assertIsNone(history.estimate('c.MapServer'))
+
+    def test_filter_unchanged(self):
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        self.publisher.record_published('mapServices', {'input': 'foo'})
+        work_items = [('mapServices', {'input': 'foo'}), ('mapServices', {'input': 'bar'})]
+        self.assertEqual(self.publisher.filter_unchanged(work_items), [('mapServices', {'input': 'bar'})])
+
+    def test_publishes_unchanged_service_missing_on_server(self):
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = False
+        self.publisher.record_published('mapServices', {'input': 'foo', 'folderName': 'Maps'})
+        self.assertIsNone(self.publisher.get_skip_reason('mapServices', {'input': 'foo', 'folderName': 'Maps'}))
+        self.publisher.inventory.exists.assert_called_once_with('foo', 'Maps', 'MapServer')
+
+    def test_get_service_key(self):
+        self.assertEqual(self.publisher.get_service_key('gpServices', {'input': 'a/tool.tbx', 'folderName': 'GP'}),
+                         'GP/tool.GPServer')
+
+    def test_draft_service(self):
+        with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+            mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
+            job = self.publisher.draft_service('gpServices', {'input': 'some/input', 'json': {'foo': 'bar'}})
+            self.assertEqual(job['service_name'], 'input')
+            self.assertEqual(job['service_type'], 'GPServer')
+            self.assertEqual(job['json'], {'foo': 'bar'})
+            self.assertEqual(job['initial_state'], 'STARTED')
+
+    def test_draft_service_marks_existing_service_for_overwrite(self):
+        self.publisher.overwrite = True
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        with patch('slap.publisher.Publisher._get_method_by_service_type') as mock_publish_method:
+            mock_publish_method.return_value = MagicMock(return_value={'errors': {}})
+            job = self.publisher.draft_service('mapServices', {'input': 'some/input'})
+            self.assertTrue(job['replace'])
+            self.assertTrue(mock_publish_method.return_value.call_args[1]['replace'])
+
+    def test_overwrite_does_not_change_fingerprint(self):
+        before = self.publisher.get_fingerprint('mapServices', {'input': 'foo'})
+        self.publisher.config['overwrite'] = True
+        self.assertEqual(before, self.publisher.get_fingerprint('mapServices', {'input': 'foo', 'overwrite': True}))
+
+    def test_overwrite_does_not_delete_service(self):
+        job = {'sd': 'file.sd', 'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer',
+               'initial_state': 'STARTED', 'replace': True}
+        self.publisher.api = MagicMock()
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        with self.publisher.timer.service('foo.MapServer'):
+            self.publisher.upload_service(job)
+        self.publisher.api.delete_service.assert_not_called()
+        self.publisher.api.upload_service_definition.assert_called_once_with('file.sd', timeout=3600)
+        self.publisher.api.wait_for_service.assert_called_once_with('foo', None, 'MapServer', timeout=300)
+        self.assertIsNotNone(self.publisher.timer.records[0]['unavailable'])
+
+    def test_replaced_service_is_not_monitored_by_default(self):
+        job = {'sd': 'file.sd', 'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer',
+               'initial_state': 'STARTED'}
+        self.publisher.api = MagicMock()
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        self.publisher.upload_service(job)
+        self.publisher.api.delete_service.assert_called_once_with(service_name='foo', folder=None,
+                                                                  service_type='MapServer')
+        self.publisher.api.is_service_started.assert_not_called()
+        self.publisher.api.wait_for_service.assert_not_called()
+
+    def test_slow_start_does_not_fail_publish(self):
+        job = {'sd': 'file.sd', 'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer',
+               'initial_state': 'STARTED'}
+        self.publisher.measure_downtime = True
+        self.publisher.start_timeout = 5
+        self.publisher.api = MagicMock()
+        self.publisher.api.is_service_started.return_value = False
+        self.publisher.api.wait_for_service.return_value = False
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = True
+        with patch('slap.publisher.Publisher.message') as mock_message:
+            with self.publisher.timer.service('foo.MapServer'):
+                self.publisher.upload_service(job)
+            mock_message.assert_any_call("foo hadn't started 5s after it was replaced; carrying on")
+        self.publisher.api.wait_for_service.assert_called_once_with('foo', None, 'MapServer', timeout=5)
+        self.assertTrue(job['uploaded'])
+
+    def test_new_service_is_not_monitored(self):
+        job = {'sd': 'file.sd', 'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer',
+               'initial_state': 'STARTED'}
+        self.publisher.api = MagicMock()
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = False
+        self.publisher.upload_service(job)
+        self.publisher.api.is_service_started.assert_not_called()
+        self.publisher.api.wait_for_service.assert_not_called()
+
+    def test_upload_service(self):
+        job = {'sd': 'file.sd', 'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer',
+               'initial_state': 'STARTED'}
+        self.publisher.api = MagicMock()
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = False
+        self.publisher.upload_service(job)
+        self.publisher.api.upload_service_definition.assert_called_once_with('file.sd', timeout=3600)
+        self.publisher.inventory.add.assert_called_once_with('foo', None, 'MapServer')
+
+    def test_upload_service_does_not_defer_start(self):
+        job = {'sd': 'file.sd', 'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer',
+               'initial_state': 'STARTED', 'json': {}}
+        self.publisher.api = MagicMock()
+        self.publisher.inventory = MagicMock()
+        self.publisher.inventory.exists.return_value = False
+        self.publisher.batch_start = 10
+        self.publisher.configure_service(self.publisher.upload_service(job))
+        self.assertEqual(job['initial_state'], 'STARTED')
+        self.assertEqual(self.publisher.pop_deferred_starts(), [])
+        self.publisher.api.stop_service.assert_not_called()
+
+    def test_configure_service_stops_stopped_services(self):
+        job = {'service_name': 'foo', 'folder_name': 'bar', 'service_type': 'MapServer', 'json': {},
+               'initial_state': 'STOPPED'}
+        self.publisher.api = MagicMock()
+        with patch('slap.publisher.Publisher.update_service') as mock_update:
+            self.publisher.configure_service(job)
+            mock_update.assert_not_called()
+        self.publisher.api.stop_service.assert_called_once_with(service_name='foo', folder='bar',
+                                                                service_type='MapServer')
+
+    def test_configure_service_updates_json(self):
+        job = {'service_name': 'foo', 'folder_name': None, 'service_type': 'MapServer', 'json': {'a': 1},
+               'initial_state': 'STARTED'}
+        self.publisher.api = MagicMock()
+        with patch('slap.publisher.Publisher.update_service') as mock_update:
+            self.publisher.configure_service(job)
+            mock_update.assert_called_once_with(service_name='foo', json={'a': 1}, folder_name=None,
+                                                service_type='MapServer')
+        self.publisher.api.stop_service.assert_not_called()
+
     def test_get_service_definition_paths(self):
         expected = ('file', path.abspath('output/file.sddraft'), path.abspath('output/file.sd'))
         actual = self.publisher._get_service_definition_paths('/my/file.mxd', 'output')
@@ -119,6 +589,29 @@ class TestMapServicePublisher(TestCase):
             '"connectionFilePath": "my/service/connection"}]}}')
         self.assertTrue(self.publisher._check_service_type('imageServices', '\\foo\bar\baz'))
 
+    def test_publish_input_matches_normalized_path(self):
+        self.publisher.publish_service = MagicMock()
+        self.publisher.config = {'mapServices': {'services': [{'input': 'maps/a.mxd'}]}}
+        self.publisher.publish_input('./maps/a.mxd')
+        self.publisher.publish_service.assert_called_once_with('mapServices', {'input': 'maps/a.mxd'})
+
+    def test_publish_input_publishes_every_matching_entry(self):
+        self.publisher.publish_service = MagicMock()
+        entries = [{'input': 'a.mxd'}, {'input': 'a.mxd', 'serviceName': 'a_copy'}]
+        self.publisher.config = {'mapServices': {'services': entries}}
+        self.publisher.publish_input('a.mxd')
+        self.publisher.publish_service.assert_has_calls([call('mapServices', entries[0]),
+                                                         call('mapServices', entries[1])])
+
+    def test_resolve_inputs_removes_duplicates(self):
+        entry = {'input': 'a.mxd', 'serviceName': 'roads'}
+        self.publisher.config = {'mapServices': {'services': [entry]}}
+        self.assertEqual(self.publisher.resolve_inputs(['a.mxd', 'roads']), [('mapServices', entry)])
+
+    def test_resolve_inputs_raises_for_missing_input(self):
+        with self.assertRaises(ValueError):
+            self.publisher.resolve_inputs(['foo', 'missing.mxd'])
+
     def test_analysis_successful_true(self):
         self.assertTrue(self.publisher.analysis_successful({}))
 
@@ -135,30 +628,71 @@ class TestMapServicePublisher(TestCase):
             self.publisher._get_method_by_service_type('foo')
 
     def test_register_data_sources(self):
-        data_sources = [{'foo': 'bar'}]
-        self.publisher.config = {'dataSources': data_sources}
-        with patch('slap.esri.ArcpyHelper.register_data_sources') as mock_register:
-            self.publisher.register_data_sources()
-            mock_register.assert_called_once_with(data_sources)
+        data_sources = [{'name': 'existing', 'serverPath': '/data/existing'},
+                        {'name': 'folder', 'serverPath': '/data/folder'},
+                        {'name': 'database', 'serverPath': '/data/connection.sde'}]
+        self.publisher.config = {'agsUrl': 'my/server', 'dataSources': data_sources}
+        self.publisher._data_source_cache = RegistrationCache('my/server', directory=self.directory)
+        self.publisher.api = MagicMock()
+        self.publisher.api.find_data_items_many.return_value = [{'items': [{'path': '/fileShares/existing'}]}, {}]
+        with patch('slap.esri.ArcpyHelper.register_data_source') as mock_register:
+            self.assertEqual(self.publisher.register_data_sources(), ['folder', 'database'])
+            mock_register.assert_called_once_with(data_sources[2])
+        self.publisher.api.find_data_items_many.assert_called_once_with(['/enterpriseDatabases', '/fileShares'])
+        self.publisher.api.register_data_items_many.assert_called_once_with([{
+            'type': 'folder', 'path': '/fileShares/folder',
+            'info': {'path': path.normpath('/data/folder'), 'dataStoreConnectionType': 'shared'}
+        }])
+
+    def test_register_data_sources_uses_cache(self):
+        self.publisher.config = {'agsUrl': 'my/server', 'dataSources': [{'name': 'a', 'serverPath': '/a'}]}
+        self.publisher._data_source_cache = RegistrationCache('my/server', directory=self.directory)
+        self.publisher.api = MagicMock()
+        self.publisher.api.find_data_items_many.return_value = [{'items': [{'path': '/fileShares/a'}]}]
+        self.publisher.register_data_sources()
+        self.publisher.register_data_sources()
+        self.publisher.api.find_data_items_many.assert_called_once_with(['/fileShares'])
 
     def test_delete_service(self):
         service_name = 'myService'
         folder_name = 'folder'
-        with patch('slap.api.Api.service_exists') as mock_exists:
-            mock_exists.return_value = {'exists': True}
+        with patch('slap.inventory.ServiceInventory.exists') as mock_exists:
+            mock_exists.return_value = True
             with patch('slap.api.Api.delete_service') as mock_delete:
                 self.publisher.delete_service(service_name, folder_name)
-                mock_delete.assert_called_once_with(service_name=service_name, folder=folder_name)
+                mock_exists.assert_called_once_with(service_name, folder_name, 'MapServer')
+                mock_delete.assert_called_once_with(service_name=service_name, folder=folder_name,
+                                                    service_type='MapServer')
 
     def test_delete_service_only_if_exists(self):
         service_name = 'myService'
         folder_name = 'folder'
-        with patch('slap.api.Api.service_exists') as mock_exists:
-            mock_exists.return_value = {'exists': False}
+        with patch('slap.inventory.ServiceInventory.exists') as mock_exists:
+            mock_exists.return_value = False
             with patch('slap.api.Api.delete_service') as mock_delete:
                 self.publisher.delete_service(service_name, folder_name)
                 mock_delete.assert_not_called()
 
+    def test_delete_service_uses_inventory(self):
+        with patch('slap.api.Api.list_services') as mock_list:
+            mock_list.side_effect = [
+                {'folders': ['folder'], 'services': []},
+                {'services': [
+                    {'serviceName': 'a', 'type': 'MapServer'},
+                    {'serviceName': 'b', 'type': 'ImageServer'}
+                ]}
+            ]
+            with patch('slap.api.Api.delete_service') as mock_delete:
+                self.publisher.delete_service('a', 'folder')
+                self.publisher.delete_service('a', 'folder')
+                self.publisher.delete_service('b', 'folder')
+                self.publisher.delete_service('b', 'folder', 'ImageServer')
+                self.assertEqual(mock_list.call_count, 2)
+                self.assertEqual(mock_delete.call_args_list, [
+                    call(service_name='a', folder='folder', service_type='MapServer'),
+                    call(service_name='b', folder='folder', service_type='ImageServer')
+                ])
+
     def test_update_service(self):
         service_name = 'myService'
         folder_name = 'folder'
@@ -167,7 +701,65 @@ class TestMapServicePublisher(TestCase):
             mock_get_params.return_value = {'baz': 'quux'}
             with patch('slap.api.Api.edit_service') as mock_edit:
                 self.publisher.update_service(service_name, folder_name, {'foo': 'bar'})
-                mock_edit.assert_called_once_with(service_name=service_name, folder=folder_name, params=params)
+                mock_edit.assert_called_once_with(service_name=service_name, folder=folder_name, params=params,
+                                                  service_type='MapServer')
+
+    def test_update_service_skips_edit_without_changes(self):
+        with patch('slap.api.Api.get_service_params') as mock_get_params:
+            mock_get_params.return_value = {'foo': 'bar', 'properties': {'baz': 'quux'}}
+            with patch('slap.api.Api.edit_service') as mock_edit:
+                changes = self.publisher.update_service('myService', 'folder', {'properties': {'baz': 'quux'}})
+                mock_edit.assert_not_called()
+                self.assertEqual(changes, [])
+
+    def test_update_service_returns_changes(self):
+        with patch('slap.api.Api.get_service_params') as mock_get_params:
+            mock_get_params.return_value = {'foo': 'bar'}
+            with patch('slap.api.Api.edit_service'):
+                changes = self.publisher.update_service('myService', 'folder', {'foo': 'baz'})
+                self.assertEqual(changes, [('foo', 'bar', 'baz')])
+
+    def test_get_service_entries(self):
+        self.publisher.config = {
+            'mapServices': {'services': [{'input': 'a.mxd'}, {'input': 'b.mxd'}]},
+            'gpServices': {'services': [{'input': 'c.rlt'}]}
+        }
+        self.assertEqual(self.publisher.get_service_entries(), [
+            ('mapServices', {'input': 'a.mxd'}),
+            ('mapServices', {'input': 'b.mxd'}),
+            ('gpServices', {'input': 'c.rlt'})
+        ])
+        self.assertEqual(self.publisher.get_service_entries(['c.rlt']), [('gpServices', {'input': 'c.rlt'})])
+
+    def test_resolve_inputs(self):
+        self.publisher.config = {'mapServices': {'services': [{'input': 'a.mxd'}, {'input': 'b.mxd'}]}}
+        self.assertEqual(self.publisher.resolve_inputs(['b.mxd']), [('mapServices', {'input': 'b.mxd'})])
+        with self.assertRaises(ValueError):
+            self.publisher.resolve_inputs(['b.mxd', 'c.mxd'])
+
+    def test_update_json(self):
+        self.publisher.config = {
+            'mapServices': {'services': [
+                {'input': 'a.mxd', 'json': {'minInstancesPerNode': 2}},
+                {'input': 'b.mxd', 'json': {'minInstancesPerNode': 2}},
+                {'input': 'c.mxd', 'json': {'minInstancesPerNode': 2}},
+                {'input': 'd.mxd'}
+            ]}
+        }
+        self.publisher.inventory._folders = {'': {'a': set(['MapServer']), 'b': set(['MapServer'])}}
+        with patch('slap.api.ConcurrentApi.get_params_many') as mock_get_many:
+            mock_get_many.return_value = [{'minInstancesPerNode': 1}, {'minInstancesPerNode': 2}]
+            with patch('slap.api.ConcurrentApi.edit_many') as mock_edit_many:
+                updated = self.publisher.update_json()
+                mock_get_many.assert_called_once_with([
+                    {'service_name': 'a', 'folder': None, 'service_type': 'MapServer'},
+                    {'service_name': 'b', 'folder': None, 'service_type': 'MapServer'}
+                ])
+                mock_edit_many.assert_called_once_with([
+                    {'service_name': 'a', 'folder': None, 'service_type': 'MapServer',
+                     'params': {'minInstancesPerNode': 2}}
+                ])
+                self.assertEqual(updated, ['a'])
 
 
 @patch('slap.esri.ArcpyHelper.stage_service_definition')
@@ -188,6 +780,7 @@ class TestMapServicePublisherSdDraft(TestCase):
             }
         }
         self.publisher = Publisher('user', 'pwd', config)
+        self.publisher.inventory._folders = {'': {}, 'folder': {}}
 
     def test_publish_sd_draft(self, mock_update, mock_upload_sd, mock_delete, mock_stage_sd):
         sddraft = 'path/to/sddraft'
@@ -195,9 +788,47 @@ class TestMapServicePublisherSdDraft(TestCase):
         service_name = 'myService'
         self.publisher.publish_sd_draft(sddraft, sd, service_name)
         mock_stage_sd.assert_called_once_with(sddraft=sddraft, sd=sd)
-        mock_delete.assert_called_once_with(service_name=service_name, folder_name=None)
+        mock_delete.assert_called_once_with(service_name=service_name, folder_name=None, service_type='MapServer')
         mock_upload_sd.assert_called_once_with(sd=sd, initial_state='STARTED')
         mock_update.assert_not_called()
+        self.assertTrue(self.publisher.inventory.exists(service_name, None, 'MapServer'))
+
+    def test_publish_sd_draft_with_batch_start(self, mock_update, mock_upload_sd, mock_delete, mock_stage_sd):
+        self.publisher.batch_start = 10
+        self.publisher.publish_sd_draft('path/to/sddraft', 'path/to/sd', 'myService', 'folder')
+        mock_upload_sd.assert_called_once_with(sd='path/to/sd', initial_state='STOPPED')
+        self.assertEqual(self.publisher._deferred_starts, [
+            {'service_name': 'myService', 'folder': 'folder', 'service_type': 'MapServer'}
+        ])
+
+    def test_batch_start_does_not_stop_overwritten_services(self, mock_update, mock_upload_sd, mock_delete,
+                                                            mock_stage_sd):
+        self.publisher.batch_start = 10
+        self.publisher.publish_sd_draft('path/to/sddraft', 'path/to/sd', 'myService', 'folder', replace=True)
+        mock_upload_sd.assert_called_once_with(sd='path/to/sd', initial_state='STARTED')
+        self.assertEqual(self.publisher._deferred_starts, [])
+
+    def test_batch_start_leaves_stopped_services_stopped(self, mock_update, mock_upload_sd, mock_delete,
+                                                         mock_stage_sd):
+        self.publisher.batch_start = 10
+        self.publisher.publish_sd_draft('path/to/sddraft', 'path/to/sd', 'myService', 'folder', 'STOPPED')
+        mock_upload_sd.assert_called_once_with(sd='path/to/sd', initial_state='STOPPED')
+        self.assertEqual(self.publisher._deferred_starts, [])
+
+    def test_start_deferred_services_in_groups(self, mock_update, mock_upload_sd, mock_delete, mock_stage_sd):
+        self.publisher.batch_start = 2
+        for name in ['a', 'b', 'c']:
+            self.publisher.publish_sd_draft('path/to/sddraft', 'path/to/sd', name)
+        with patch('slap.api.Api.start_services') as mock_start:
+            timings = self.publisher.start_deferred_services()
+            self.assertEqual(mock_start.call_args_list, [
+                call([{'service_name': 'a', 'folder': None, 'service_type': 'MapServer'},
+                      {'service_name': 'b', 'folder': None, 'service_type': 'MapServer'}]),
+                call([{'service_name': 'c', 'folder': None, 'service_type': 'MapServer'}])
+            ])
+        self.assertEqual(timings['services'], 3)
+        self.assertTrue(timings['time_to_all_available'] >= timings['start_duration'])
+        self.assertIsNone(self.publisher.start_deferred_services())
 
     def test_publish_sd_draft_with_json(self, mock_update, mock_upload_sd, mock_delete, mock_stage_sd):
         sddraft = 'path/to/sddraft'
@@ -206,11 +837,12 @@ class TestMapServicePublisherSdDraft(TestCase):
         folder = 'folder'
         initial_state = 'STOPPED'
         json = {'foo': 'bar'}
-        self.publisher.publish_sd_draft(sddraft, sd, service_name, folder, initial_state, json)
+        self.publisher.publish_sd_draft(sddraft, sd, service_name, folder, initial_state, json, 'ImageServer')
         mock_stage_sd.assert_called_once_with(sddraft=sddraft, sd=sd)
-        mock_delete.assert_called_once_with(service_name=service_name, folder_name=folder)
+        mock_delete.assert_called_once_with(service_name=service_name, folder_name=folder, service_type='ImageServer')
         mock_upload_sd.assert_called_once_with(sd=sd, initial_state=initial_state)
-        mock_update.assert_called_once_with(service_name=service_name, folder_name=folder, json=json)
+        mock_update.assert_called_once_with(service_name=service_name, folder_name=folder, json=json,
+                                            service_type='ImageServer')
 
 
 @patch('slap.config.ConfigParser.load_config')
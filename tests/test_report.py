@@ -0,0 +1,73 @@
+from unittest import TestCase
+from slap.report import create_report, merge_reports, format_merged
+
+
+def create_record(service, ok=True, total=10.0):
+    return {'service': service, 'input': service, 'ok': ok, 'error': None if ok else 'RuntimeError: failed',
+            'input_size': None, 'sd_size': None, 'unavailable': None, 'total': total, 'phases': {'upload': total}}
+
+
+def create_shard(index, services, plan='abc', count=2):
+    return {'index': index, 'count': count, 'plan': plan, 'services': services}
+
+
+class TestReport(TestCase):
+
+    def test_create_report(self):
+        shard = create_shard(1, ['a.MapServer', 'b.MapServer', 'c.MapServer', 'd.MapServer'])
+        records = [create_record('a.MapServer'), create_record('b.MapServer', ok=False)]
+        report = create_report(shard, records, ['c.MapServer'], 100.0, 160.0)
+        self.assertEqual((report['shard'], report['shards'], report['plan'], report['duration']), (1, 2, 'abc', 60.0))
+        self.assertEqual([result['status'] for result in report['services']],
+                         ['published', 'failed', 'skipped', 'not published'])
+        self.assertEqual(report['services'][1]['error'], 'RuntimeError: failed')
+
+    def test_create_report_without_shard(self):
+        report = create_report(None, [create_record('a.MapServer')], ['b.MapServer'], 0, 1)
+        self.assertEqual((report['shard'], report['shards']), (1, 1))
+        self.assertEqual([result['service'] for result in report['services']], ['a.MapServer', 'b.MapServer'])
+
+    def create_reports(self):
+        return [
+            create_report(create_shard(2, ['b.MapServer']), [create_record('b.MapServer', total=30)], [], 0, 30),
+            create_report(create_shard(1, ['a.MapServer', 'c.MapServer']), [create_record('a.MapServer')],
+                          ['c.MapServer'], 0, 10)
+        ]
+
+    def test_merge_reports(self):
+        merged = merge_reports(self.create_reports())
+        self.assertTrue(merged['ok'])
+        self.assertEqual(merged['problems'], [])
+        self.assertEqual([shard['shard'] for shard in merged['shards']], [1, 2])
+        self.assertEqual([(result['service'], result['shard']) for result in merged['services']],
+                         [('a.MapServer', 1), ('c.MapServer', 1), ('b.MapServer', 2)])
+        self.assertEqual(len(merged['timings']), 2)
+        summary = format_merged(merged)
+        self.assertIn('Longest shard took 30s, 1.50x the average', summary)
+        self.assertIn('Slowest services:', summary)
+
+    def test_merge_reports_with_failures(self):
+        reports = self.create_reports()
+        reports[0]['services'][0].update(status='failed', error='RuntimeError: failed')
+        merged = merge_reports(reports)
+        self.assertFalse(merged['ok'])
+        self.assertIn('  b.MapServer (shard 2): RuntimeError: failed', format_merged(merged))
+
+    def test_merge_reports_missing_shard(self):
+        merged = merge_reports(self.create_reports()[1:])
+        self.assertFalse(merged['ok'])
+        self.assertEqual(merged['problems'], ['Missing shard(s): 2'])
+
+    def test_merge_reports_split_differently(self):
+        reports = self.create_reports()
+        reports[0]['plan'] = 'def'
+        merged = merge_reports(reports)
+        self.assertFalse(merged['ok'])
+        self.assertIn('Shards were split differently (plans abc, def)', merged['problems'][0])
+
+    def test_merge_reports_duplicate_and_stopped_shards(self):
+        reports = self.create_reports()
+        reports.append(dict(reports[0], error='KeyboardInterrupt: '))
+        merged = merge_reports(reports)
+        self.assertEqual(merged['problems'], ['Shard(s) reported more than once: 2',
+                                              'Shard 2 stopped: KeyboardInterrupt: '])
@@ -0,0 +1,87 @@
+import requests
+from requests import Response
+from unittest import TestCase
+from mock import MagicMock
+from slap.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+
+
+def create_http_error(status_code, headers=None):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers if headers else {})
+    return requests.exceptions.HTTPError(response=response)
+
+
+class TestRetryPolicy(TestCase):
+
+    def test_connection_errors_are_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable(requests.exceptions.ConnectionError()))
+        self.assertTrue(policy.is_retryable(requests.exceptions.Timeout()))
+
+    def test_gateway_errors_are_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable(create_http_error(502)))
+        self.assertTrue(policy.is_retryable(create_http_error(503)))
+
+    def test_client_errors_are_not_retryable(self):
+        policy = RetryPolicy()
+        self.assertFalse(policy.is_retryable(create_http_error(404)))
+        self.assertFalse(policy.is_retryable(requests.exceptions.RequestException('Service not found')))
+
+    def test_open_circuit_is_not_retryable(self):
+        self.assertFalse(RetryPolicy().is_retryable(CircuitOpenError()))
+
+    def test_exponential_backoff(self):
+        policy = RetryPolicy(backoff_factor=0.5, max_backoff=3, jitter=False)
+        self.assertEqual([policy.get_backoff(attempt) for attempt in range(5)], [0.5, 1, 2, 3, 3])
+
+    def test_jitter_stays_within_backoff(self):
+        policy = RetryPolicy(backoff_factor=1, jitter=True)
+        for i in range(20):
+            self.assertTrue(0 <= policy.get_backoff(2) <= 4)
+
+    def test_honors_retry_after_seconds(self):
+        policy = RetryPolicy()
+        self.assertEqual(policy.get_backoff(0, create_http_error(503, {'Retry-After': '7'})), 7.0)
+
+    def test_caps_retry_after(self):
+        policy = RetryPolicy(max_backoff=30)
+        self.assertEqual(policy.get_backoff(0, create_http_error(503, {'Retry-After': '7200'})), 30)
+
+    def test_honors_retry_after_date(self):
+        policy = RetryPolicy()
+        backoff = policy.get_backoff(0, create_http_error(503, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}))
+        self.assertEqual(backoff, 0.0)  # already in the past
+
+
+class TestCircuitBreaker(TestCase):
+
+    def create_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.clock = MagicMock(return_value=100.0)
+        return breaker
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = self.create_breaker()
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
+        self.assertRaises(CircuitOpenError, breaker.before_call)
+
+    def test_success_resets_failures(self):
+        breaker = self.create_breaker()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertFalse(breaker.is_open)
+
+    def test_allows_trial_call_after_reset_timeout(self):
+        breaker = self.create_breaker()
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.clock.return_value = 111.0
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open)
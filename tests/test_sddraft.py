@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from slap.sddraft import set_replacement
+
+SDDRAFT = """<?xml version="1.0" encoding="utf-8"?>
+<SVCManifest xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:type="typens:SVCManifest">
+<Type>esriServiceDefinitionType_New</Type>
+<State>esriSDState_Unpublished</State>
+<Configurations><SVCConfiguration><Definition><Type>MapServer</Type></Definition></SVCConfiguration></Configurations>
+</SVCManifest>"""
+
+
+class TestSetReplacement(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'map.sddraft')
+        with open(self.path, 'w') as sddraft:
+            sddraft.write(SDDRAFT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_marks_draft_as_replacement(self):
+        set_replacement(self.path)
+        with open(self.path) as sddraft:
+            content = sddraft.read()
+        self.assertIn('<Type>esriServiceDefinitionType_Replacement</Type>', content)
+        self.assertIn('<State>esriSDState_Published</State>', content)
+        self.assertIn('<Type>MapServer</Type>', content)
+        self.assertIn('xsi:type="typens:SVCManifest"', content)
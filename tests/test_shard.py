@@ -0,0 +1,42 @@
+from unittest import TestCase
+from slap.shard import get_costs, assign_shards, get_plan_id
+
+
+class TestShard(TestCase):
+
+    def test_costs_from_size(self):
+        self.assertEqual(get_costs([None, None, None], [100, 300, None]), [100, 300, 200])
+
+    def test_costs_without_sizes(self):
+        self.assertEqual(get_costs([None, None], [None, None]), [1.0, 1.0])
+
+    def test_costs_from_history(self):
+        estimates = [{'total': 10.0}, None, None, {'total': 30.0}]
+        # 40s for 400 bytes of known services, so 0.1s per byte for the unknown one with a size
+        self.assertEqual(get_costs(estimates, [100, 500, None, 300]), [10.0, 50.0, 20.0, 30.0])
+
+    def test_costs_from_history_without_sizes(self):
+        self.assertEqual(get_costs([{'total': 10.0}, None], [None, 100]), [10.0, 10.0])
+
+    def test_balances_by_cost(self):
+        assignments = assign_shards([5, 1, 1, 1, 1, 1], 2)
+        self.assertEqual(assignments, [0, 1, 1, 1, 1, 1])
+
+    def test_every_item_in_one_shard(self):
+        costs = [(index * 7919) % 101 for index in range(200)]
+        assignments = assign_shards(costs, 4)
+        self.assertEqual(sorted(set(assignments)), [0, 1, 2, 3])
+        loads = [sum(cost for cost, shard in zip(costs, assignments) if shard == index) for index in range(4)]
+        self.assertLessEqual(max(loads) - min(loads), max(costs))
+
+    def test_ties_are_deterministic(self):
+        self.assertEqual(assign_shards([1, 1, 1, 1], 3), [0, 1, 2, 0])
+        self.assertEqual(assign_shards([1, 1, 1, 1], 3), assign_shards([1.0, 1.0, 1.0, 1.0], 3))
+
+    def test_more_shards_than_items(self):
+        self.assertEqual(assign_shards([3, 1], 4), [0, 1])
+
+    def test_plan_id(self):
+        keys = ['a.MapServer', 'b.MapServer']
+        self.assertEqual(get_plan_id(keys, [0, 1]), get_plan_id(list(reversed(keys)), [1, 0]))
+        self.assertNotEqual(get_plan_id(keys, [0, 1]), get_plan_id(keys, [1, 0]))
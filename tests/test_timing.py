@@ -0,0 +1,142 @@
+import os
+import csv
+import json
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+from slap.timing import PhaseTimer, AvailabilityMonitor, PHASES
+
+
+class TestPhaseTimer(TestCase):
+
+    def setUp(self):
+        self.timer = PhaseTimer()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_phases_for_current_service(self):
+        with self.timer.service('a.MapServer', 'a.mxd'):
+            with self.timer.phase('draft'):
+                pass
+            with self.timer.phase('stage'):
+                pass
+        record = self.timer.records[0]
+        self.assertEqual(record['service'], 'a.MapServer')
+        self.assertEqual(record['input'], 'a.mxd')
+        self.assertTrue(record['ok'])
+        self.assertEqual(sorted(record['phases']), ['draft', 'stage'])
+        self.assertGreaterEqual(record['total'], sum(record['phases'].values()))
+
+    def test_ignores_phases_outside_a_service(self):
+        with self.timer.phase('upload'):
+            pass
+        self.assertEqual(self.timer.records, [])
+
+    def test_records_errors(self):
+        with self.assertRaises(ValueError):
+            with self.timer.service('a.MapServer'):
+                raise ValueError('bad')
+        self.assertFalse(self.timer.records[0]['ok'])
+        self.assertEqual(self.timer.records[0]['error'], 'ValueError: bad')
+
+    def test_accumulates_across_threads(self):
+        # A pipeline works on one service from several threads, one stage at a time
+        def stage(name):
+            with self.timer.service('a.MapServer'):
+                with self.timer.phase(name):
+                    pass
+
+        for name in ['draft', 'upload']:
+            thread = threading.Thread(target=stage, args=(name,))
+            thread.start()
+            thread.join()
+        self.assertEqual(sorted(self.timer.records[0]['phases']), ['draft', 'upload'])
+
+    def test_record_file_size(self):
+        path = os.path.join(self.directory, 'a.sd')
+        with open(path, 'wb') as sd:
+            sd.write('12345')
+        with self.timer.service('a.MapServer'):
+            self.timer.record_file_size('sd_size', path)
+            self.timer.record_file_size('input_size', os.path.join(self.directory, 'missing'))
+        self.assertEqual(self.timer.records[0]['sd_size'], 5)
+        self.assertIsNone(self.timer.records[0]['input_size'])
+
+    def test_add_and_pop_records(self):
+        with self.timer.service('a.MapServer'):
+            pass
+        records = self.timer.pop_records()
+        self.assertEqual(self.timer.records, [])
+        other = PhaseTimer()
+        other.add_records(records)
+        self.assertEqual(other.records, records)
+
+    def test_write_json(self):
+        with self.timer.service('a.MapServer'):
+            with self.timer.phase('draft'):
+                pass
+        path = os.path.join(self.directory, 'timings.json')
+        self.timer.write(path)
+        with open(path) as report:
+            self.assertEqual(json.load(report)['services'][0]['service'], 'a.MapServer')
+
+    def test_write_csv(self):
+        with self.timer.service('a.MapServer', 'a.mxd'):
+            with self.timer.phase('draft'):
+                pass
+        path = os.path.join(self.directory, 'timings.csv')
+        self.timer.write(path)
+        with open(path) as report:
+            rows = list(csv.reader(report))
+        self.assertEqual(rows[0], ['service', 'input', 'ok', 'error', 'input_size', 'sd_size', 'unavailable',
+                                   'total'] + PHASES)
+        self.assertEqual(rows[1][:3], ['a.MapServer', 'a.mxd', 'True'])
+        self.assertNotEqual(rows[1][9], '')
+
+    def test_format_summary(self):
+        for service in ['fast.MapServer', 'slow.MapServer']:
+            with self.timer.service(service):
+                with self.timer.phase('upload'):
+                    pass
+        self.timer.records[1]['total'] = 100.0
+        self.timer.records[1]['phases']['upload'] = 90.0
+        lines = self.timer.format_summary().splitlines()
+        self.assertTrue(lines[2].startswith('slow.MapServer'))
+        self.assertIn('upload (90.0s)', lines[2])
+        self.assertIn('Time by phase:', lines)
+
+    def test_format_summary_reports_unavailability(self):
+        for service, unavailable in [('a.MapServer', 2.0), ('b.MapServer', 5.0)]:
+            with self.timer.service(service):
+                self.timer.set('unavailable', unavailable)
+        self.assertIn('Unavailable while replaced: 5.0s longest (b.MapServer), 7.0s total over 2 services',
+                      self.timer.format_summary())
+
+
+class TestAvailabilityMonitor(TestCase):
+
+    def setUp(self):
+        self.now = 0
+
+    def test_adds_up_time_seen_unavailable(self):
+        monitor = AvailabilityMonitor(lambda: True, clock=lambda: self.now)
+        for now, available in [(0, True), (1, False), (3, False), (4, True), (6, True)]:
+            self.now = now
+            monitor.record(available)
+        self.assertEqual(monitor.unavailable, 3)
+
+    def test_stop_ends_outage(self):
+        monitor = AvailabilityMonitor(lambda: False, interval=60, clock=lambda: self.now).start()
+        self.now = 5
+        self.assertEqual(monitor.stop(), 5)
+
+    def test_errors_count_as_unavailable(self):
+        def fail():
+            raise RuntimeError('Service not found')
+
+        monitor = AvailabilityMonitor(fail, interval=60, clock=lambda: self.now).start()
+        self.now = 2
+        self.assertEqual(monitor.stop(available=False), 2)
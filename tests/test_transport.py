@@ -0,0 +1,98 @@
+import os
+import json
+import shutil
+import tempfile
+import requests
+from requests import Response
+from unittest import TestCase
+from mock import MagicMock
+from slap.transport import RecordingTransport, ReplayTransport, create_transport
+
+
+def create_response(body, status_code=200):
+    response = Response()
+    response.status_code = status_code
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps(body)
+    return response
+
+
+class TestRecordAndReplay(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'recording.jsonl')
+        self.inner = MagicMock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, *exchanges):
+        self.inner.send.side_effect = [create_response(body, status) for (method, url, params, body, status) in exchanges]
+        recorder = RecordingTransport(self.inner, self.path)
+        for (method, url, params, body, status) in exchanges:
+            recorder.send(method, url, params, verify=False, timeout=None)
+
+    def read_recording(self):
+        with open(self.path) as recording:
+            return [json.loads(line) for line in recording]
+
+    def test_records_exchanges(self):
+        self.record(('POST', 'http://server/exists', {'serviceName': 'a', 'f': 'json'}, {'exists': True}, 200))
+        exchange = self.read_recording()[0]
+        self.assertEqual(exchange['method'], 'POST')
+        self.assertEqual(exchange['url'], 'http://server/exists')
+        self.assertEqual(exchange['params'], {'serviceName': 'a', 'f': 'json'})
+        self.assertEqual(exchange['status'], 200)
+        self.assertEqual(json.loads(exchange['body']), {'exists': True})
+
+    def test_redacts_credentials(self):
+        self.record(('POST', 'http://server/generateToken', {'username': 'user', 'password': 'secret'},
+                     {'token': 'real-token', 'expires': 1}, 200))
+        exchange = self.read_recording()[0]
+        self.assertEqual(exchange['params']['password'], '***')
+        self.assertEqual(json.loads(exchange['body'])['token'], 'recorded-token')
+        with open(self.path) as recording:
+            content = recording.read()
+        self.assertNotIn('secret', content)
+        self.assertNotIn('real-token', content)
+
+    def test_appends_to_recording(self):
+        self.record(('POST', 'http://server/exists', {'serviceName': 'a'}, {'exists': True}, 200))
+        self.inner.send.side_effect = [create_response({'exists': False}, 200)]
+        RecordingTransport(self.inner, self.path, append=True).send('POST', 'http://server/exists',
+                                                                    {'serviceName': 'b'}, False, None)
+        self.assertEqual([exchange['params']['serviceName'] for exchange in self.read_recording()], ['a', 'b'])
+
+    def test_create_transport(self):
+        self.assertIsNone(create_transport())
+        self.assertIsInstance(create_transport(record=self.path), RecordingTransport)
+        self.record(('POST', 'http://server/exists', {'serviceName': 'a'}, {'exists': True}, 200))
+        self.assertIsInstance(create_transport(replay=self.path), ReplayTransport)
+
+    def test_replays_responses(self):
+        self.record(('GET', 'http://server/services', {'token': 'abc', 'f': 'json'}, {'services': []}, 200))
+        replay = ReplayTransport(self.path)
+        response = replay.send('GET', 'http://server/services', {'token': 'different', 'f': 'json'}, False, None)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'services': []})
+
+    def test_replays_repeated_calls_in_order(self):
+        url = 'http://server/exists'
+        self.record(('POST', url, {'serviceName': 'a'}, {'exists': True}, 200),
+                    ('POST', url, {'serviceName': 'a'}, {'exists': False}, 200))
+        replay = ReplayTransport(self.path)
+        self.assertEqual(replay.send('POST', url, {'serviceName': 'a'}, False, None).json(), {'exists': True})
+        self.assertEqual(replay.send('POST', url, {'serviceName': 'a'}, False, None).json(), {'exists': False})
+        self.assertEqual(replay.send('POST', url, {'serviceName': 'a'}, False, None).json(), {'exists': False})
+
+    def test_replays_errors(self):
+        self.record(('POST', 'http://server/edit', {}, {}, 502))
+        response = ReplayTransport(self.path).send('POST', 'http://server/edit', {}, False, None)
+        self.assertEqual(response.status_code, 502)
+
+    def test_raises_for_unrecorded_request(self):
+        self.record(('POST', 'http://server/edit', {}, {}, 200))
+        replay = ReplayTransport(self.path)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            replay.send('POST', 'http://server/delete', {}, False, None)